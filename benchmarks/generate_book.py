@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic book project for benchmarking.
+
+Creates config.yaml and book_content/ with N chapters of configurable
+size. Chapters contain headings, blockquotes and images, and use a mix of
+the filename patterns detect_chapters.py supports.
+
+Usage: generate_book.py <dest> [--chapters N] [--sections N] [--paragraphs N] [--words N]
+"""
+
+import sys
+import random
+import shutil
+import argparse
+from pathlib import Path
+
+ENGINE_ROOT = Path(__file__).resolve().parent.parent
+
+# Filename patterns accepted by detect_chapters.py
+CHAPTER_NAMES = [
+    'chapter_{n}.md',
+    'chapter_{n:02d}.md',
+    'ch{n}.md',
+    '{n:02d}.md',
+    '{n:02d}_section_title.md',
+    'chapter_{n}_draft.md',
+]
+
+WORDS = (
+    "ledger margin folio signature gutter leading kerning serif recto verso colophon "
+    "imprint galley proof spine binding chapter preface appendix index glossary quire "
+    "manuscript edition printing typeface octavo quarto ornament rubric epigraph footnote "
+    "the a of and to in is that for with as on by at from this which be it or an"
+).split()
+
+# Smallest valid PNG (1x1 transparent pixel)
+PNG_PIXEL = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000b4944415478da636000020000050001e9fadcd80000000049454e44ae426082'
+)
+
+def _sentence(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+def _paragraph(rng, words):
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentences.append(_sentence(rng, length))
+        words -= length
+    return ' '.join(sentences)
+
+def chapter_markdown(rng, number, sections, paragraphs, words, image_path=None):
+    """
+    Markdown for one chapter.
+
+    Args:
+        rng: random.Random instance
+        number: Chapter number
+        sections: Number of level-2 sections
+        paragraphs: Paragraphs per section
+        words: Words per paragraph
+        image_path: Image to reference once per chapter, or None
+
+    Returns:
+        Markdown text
+    """
+    lines = [f"# Chapter {number}: {_sentence(rng, 3)[:-1]}", ""]
+    lines += [_paragraph(rng, words), ""]
+
+    for section in range(1, sections + 1):
+        lines += [f"## Section {number}.{section}", ""]
+        for index in range(paragraphs):
+            if index == paragraphs // 2:
+                lines += [f"> {_sentence(rng, 18)}", ""]
+            if index == 1 and section == 1 and image_path:
+                lines += [f"![Figure {number}]({image_path})", ""]
+            if index and index % 7 == 0:
+                lines += [f"### Note {number}.{section}.{index}", ""]
+            lines += [_paragraph(rng, words), ""]
+
+    return '\n'.join(lines)
+
+def chapter_filename(number):
+    """Rotate through the supported naming patterns"""
+    return CHAPTER_NAMES[number % len(CHAPTER_NAMES)].format(n=number)
+
+def generate_book(dest, chapters=20, sections=4, paragraphs=10, words=80, images=True, seed=0):
+    """
+    Write a synthetic book project.
+
+    Args:
+        dest: Directory to create (replaced if it exists)
+        chapters: Number of chapters
+        sections: Level-2 sections per chapter
+        paragraphs: Paragraphs per section
+        words: Words per paragraph
+        images: Reference a small image in every chapter
+        seed: Random seed, so the same arguments give the same book
+
+    Returns:
+        Path to the project directory
+    """
+    rng = random.Random(seed)
+    dest = Path(dest)
+    if dest.exists():
+        shutil.rmtree(dest)
+
+    content = dest / "book_content"
+    for sub in ('front_matter', 'chapters', 'back_matter', 'images'):
+        (content / sub).mkdir(parents=True)
+
+    config = (ENGINE_ROOT / "templates" / "config.yaml.example").read_text(encoding='utf-8')
+    config = config.replace('"Your Book Title"', f'"Benchmark Book {chapters}x{sections}x{paragraphs}"')
+    config = config.replace('cover_image: "book_content/cover_epub.png"', 'cover_image: ""')
+    (dest / "config.yaml").write_text(config, encoding='utf-8')
+
+    styles = dest / "styles"
+    styles.mkdir()
+    for name in ('ebook_styles.css', 'print_styles.css'):
+        shutil.copy(ENGINE_ROOT / "styles" / name, styles / name)
+
+    for name, title in (('title_page.md', 'Title'), ('copyright_page.md', 'Copyright'),
+                        ('dedication.md', 'Dedication'), ('table_of_contents.md', 'Contents'),
+                        ('preface.md', 'Preface')):
+        (content / "front_matter" / name).write_text(
+            f"# {title}\n\n{_paragraph(rng, words)}\n", encoding='utf-8')
+
+    image_path = None
+    if images:
+        (content / "images" / "figure.png").write_bytes(PNG_PIXEL)
+        image_path = "book_content/images/figure.png"
+
+    for number in range(1, chapters + 1):
+        (content / "chapters" / chapter_filename(number)).write_text(
+            chapter_markdown(rng, number, sections, paragraphs, words, image_path), encoding='utf-8')
+
+    (content / "chapters" / "conclusion.md").write_text(
+        f"# Conclusion\n\n{_paragraph(rng, words)}\n", encoding='utf-8')
+    (content / "back_matter" / "acknowledgments.md").write_text(
+        f"# Acknowledgments\n\n{_paragraph(rng, words)}\n", encoding='utf-8')
+
+    return dest
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Generate a synthetic book project.")
+    parser.add_argument('dest', help="Directory to create (replaced if it exists)")
+    parser.add_argument('--chapters', type=int, default=20)
+    parser.add_argument('--sections', type=int, default=4, help="Level-2 sections per chapter")
+    parser.add_argument('--paragraphs', type=int, default=10, help="Paragraphs per section")
+    parser.add_argument('--words', type=int, default=80, help="Words per paragraph")
+    parser.add_argument('--no-images', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    dest = generate_book(args.dest, args.chapters, args.sections, args.paragraphs, args.words,
+                         images=not args.no_images, seed=args.seed)
+    print(f"✅ Generated {args.chapters} chapter(s) in {dest}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
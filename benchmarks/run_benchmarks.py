@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Python build stages on a synthetic book.
+
+Generates a book with generate_book.py, puts the stand-in pandoc,
+WeasyPrint and epubcheck from benchmarks/stubs/ first on PATH, and times
+chapter detection, manuscript assembly, fix_epub_links, validate_epub,
+format_word, the per-chapter EPUB builder, the chunked PDF renderer and
+a full build_book run.
+Results are written as JSON so runs can be compared across releases.
+
+Usage: run_benchmarks.py [--chapters N] [--repeat N] [--stages a,b] [--output results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ENGINE_ROOT = BENCH_DIR.parent
+STUBS_DIR = BENCH_DIR / "stubs"
+
+sys.path.insert(0, str(ENGINE_ROOT / "tools"))
+
+from generate_book import generate_book
+from book_config import FORMATS, load_config
+from detect_chapters import clear_cache, detect_chapters
+from manuscript import STREAMS, load_manuscript, write_stream
+
+RESULTS_VERSION = 1
+
+def _time(func, repeat, setup=None):
+    """
+    Time func() repeat times, calling setup() untimed before each run.
+
+    Returns:
+        Dictionary of per-run seconds and summary statistics
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+    return {
+        'runs': [round(run, 6) for run in runs],
+        'min': round(min(runs), 6),
+        'median': round(statistics.median(runs), 6),
+        'mean': round(statistics.mean(runs), 6),
+    }
+
+def _stub_pandoc(book, manuscript, config, fmt, output_file):
+    """Produce a raw pandoc-style artifact with the stub, for the post-processing stages"""
+    process = subprocess.Popen([str(STUBS_DIR / "pandoc"), '--from=markdown', '-o', str(output_file),
+                                f'--resource-path={book}'],
+                               stdin=subprocess.PIPE)
+    write_stream(STREAMS[fmt](manuscript, config), process.stdin)
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"stub pandoc failed for {fmt}")
+
+def bench_detect_chapters(book, work_dir, repeat):
+    chapters_dir = str(book / "book_content" / "chapters")
+    # Each build process scans once, so time a scan rather than a cache hit
+    return _time(lambda: detect_chapters(chapters_dir), repeat, setup=clear_cache)
+
+def bench_assemble(book, work_dir, repeat):
+    config = load_config(book / "config.yaml")
+
+    def run():
+        manuscript = load_manuscript(book, config)
+        for fmt in FORMATS:
+            for _ in STREAMS[fmt](manuscript, config):
+                pass
+
+    return _time(run, repeat)
+
+def bench_fix_epub_links(book, work_dir, repeat):
+    from fix_epub_links import rewrite_epub
+
+    config = load_config(book / "config.yaml")
+    raw = work_dir / "raw.epub"
+    _stub_pandoc(book, load_manuscript(book, config), config, 'epub', raw)
+    target = work_dir / "fix.epub"
+
+    return _time(lambda: rewrite_epub(target), repeat, setup=lambda: shutil.copy(raw, target))
+
+def bench_validate_epub(book, work_dir, repeat):
+    from fix_epub_links import rewrite_epub
+    from validate_epub import validate_epub
+
+    config = load_config(book / "config.yaml")
+    target = work_dir / "validate.epub"
+    _stub_pandoc(book, load_manuscript(book, config), config, 'epub', target)
+    with contextlib.redirect_stdout(io.StringIO()):
+        rewrite_epub(target)
+
+    return _time(lambda: validate_epub(target, use_cache=False), repeat)
+
+def bench_format_word(book, work_dir, repeat):
+    try:
+        from format_word import format_word_document, load_rules
+    except SystemExit:
+        return None  # python-docx not installed
+
+    config = load_config(book / "config.yaml")
+    raw = work_dir / "raw.docx"
+    _stub_pandoc(book, load_manuscript(book, config), config, 'word', raw)
+    target = work_dir / "format.docx"
+    rules = load_rules(config)
+
+    return _time(lambda: format_word_document(str(target), rules), repeat,
+                 setup=lambda: shutil.copy(raw, target))
+
+def bench_build_epub_cold(book, work_dir, repeat):
+    from build_epub import CACHE_DIRNAME, build_epub
+    from book_config import output_dir
+
+    config = load_config(book / "config.yaml")
+    cache_dir = output_dir(book, config) / CACHE_DIRNAME
+    output_file = work_dir / "per_chapter.epub"
+
+    return _time(lambda: build_epub(book, config, output_file), repeat,
+                 setup=lambda: shutil.rmtree(cache_dir, ignore_errors=True))
+
+def bench_build_epub_warm(book, work_dir, repeat):
+    from build_epub import build_epub
+
+    config = load_config(book / "config.yaml")
+    output_file = work_dir / "per_chapter.epub"
+    build_epub(book, config, output_file, log=lambda message: None)  # Fill the cache
+
+    return _time(lambda: build_epub(book, config, output_file), repeat)
+
+def bench_build_pdf(book, work_dir, repeat):
+    from build_pdf import CACHE_DIRNAME, build_pdf, missing_dependencies
+    from book_config import output_dir
+
+    if missing_dependencies():
+        return None  # weasyprint or pypdf not installed
+
+    config = load_config(book / "config.yaml")
+    cache_dir = output_dir(book, config) / CACHE_DIRNAME
+    output_file = work_dir / "chunked.pdf"
+
+    return _time(lambda: build_pdf(book, config, output_file), repeat,
+                 setup=lambda: shutil.rmtree(cache_dir, ignore_errors=True))
+
+def bench_build_book(book, work_dir, repeat):
+    from build_book import build
+
+    return _time(lambda: build(list(FORMATS), project_root=book, force=True), repeat)
+
+STAGES = {
+    'detect_chapters': bench_detect_chapters,
+    'assemble': bench_assemble,
+    'fix_epub_links': bench_fix_epub_links,
+    'validate_epub': bench_validate_epub,
+    'format_word': bench_format_word,
+    'build_epub_cold': bench_build_epub_cold,
+    'build_epub_warm': bench_build_epub_warm,
+    'build_pdf': bench_build_pdf,
+    'build_book': bench_build_book,
+}
+
+def _git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ENGINE_ROOT,
+                                capture_output=True, text=True, check=True)
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+def _content_bytes(book):
+    return sum(path.stat().st_size for path in (book / "book_content").rglob('*.md'))
+
+def run_benchmarks(stages, repeat, book_params, keep=False):
+    """
+    Generate a book and time each stage against it.
+
+    Args:
+        stages: Stage names from STAGES
+        repeat: Timed runs per stage
+        book_params: Keyword arguments for generate_book()
+        keep: Leave the generated book on disk
+
+    Returns:
+        Results dictionary
+    """
+    # Children (build_book's pandoc/weasyprint/epubcheck calls) find the stubs first
+    os.environ['PATH'] = f"{STUBS_DIR}{os.pathsep}{os.environ.get('PATH', '')}"
+
+    temp_root = Path(tempfile.mkdtemp(prefix="book_bench_"))
+    try:
+        book = generate_book(temp_root / "book", **book_params)
+        results = {
+            'version': RESULTS_VERSION,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'book': dict(book_params, content_bytes=_content_bytes(book)),
+            'stages': {},
+        }
+
+        for name in stages:
+            work_dir = temp_root / name
+            work_dir.mkdir()
+            print(f"   → {name}...", flush=True)
+            timing = STAGES[name](book, work_dir, repeat)
+            if timing is None:
+                print(f"   ⚠️  {name} skipped (dependency not installed)")
+                continue
+            results['stages'][name] = timing
+            print(f"   ✅ {name}: median {timing['median'] * 1000:.1f}ms, min {timing['min'] * 1000:.1f}ms")
+
+        if keep:
+            print(f"📁 Book kept at {book}")
+        return results
+    finally:
+        if not keep:
+            shutil.rmtree(temp_root, ignore_errors=True)
+
+def parse_stages(value):
+    """Parse a comma-separated stage list"""
+    stages = [stage.strip() for stage in value.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stage(s): {', '.join(unknown)} "
+                                         f"(choose from {', '.join(STAGES)})")
+    return stages
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Benchmark the Python build stages on a synthetic book.")
+    parser.add_argument('--chapters', type=int, default=40)
+    parser.add_argument('--sections', type=int, default=4, help="Level-2 sections per chapter")
+    parser.add_argument('--paragraphs', type=int, default=10, help="Paragraphs per section")
+    parser.add_argument('--words', type=int, default=80, help="Words per paragraph")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per stage")
+    parser.add_argument('--stages', type=parse_stages, default=list(STAGES),
+                        help=f"Comma-separated stages (default: {','.join(STAGES)})")
+    parser.add_argument('--output', default="benchmark-results.json",
+                        help="Where to write the JSON results")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated book")
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    book_params = {'chapters': args.chapters, 'sections': args.sections,
+                   'paragraphs': args.paragraphs, 'words': args.words}
+    print(f"⏱️  Benchmarking {args.chapters} chapter(s), {args.repeat} run(s) per stage")
+    results = run_benchmarks(args.stages, args.repeat, book_params, keep=args.keep)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print(f"📋 Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
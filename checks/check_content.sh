@@ -46,7 +46,7 @@ check_image() {
         
         # Check file size (should be < 2MB for KDP)
         if [ "$size" != "unknown" ] && [ "$size" -gt 2097152 ]; then
-            echo -e "${YELLOW}⚠️  Cover image is large (>2MB), may cause issues${NC}"
+            echo -e "${YELLOW}⚠️  Cover image is large (>2MB); EPUB builds embed a resized copy when Pillow is installed${NC}"
             warnings=$((warnings + 1))
         fi
         return 0
@@ -123,6 +123,18 @@ if [ -f "$PROJECT_ROOT/config.yaml" ]; then
     fi
 fi
 
+# Check links, images, ids, headings and footnotes across the whole manuscript
+if [ -n "$chapters" ]; then
+    echo "Linting manuscript..."
+    lint_output=$(python3 "$PROJECT_ROOT/tools/lint_manuscript.py" "$PROJECT_ROOT" 2>&1 || true)
+    echo "$lint_output"
+    lint_errors=$(grep '^   ❌ ' <<< "$lint_output" | grep -vc ' Lint: ' || true)
+    lint_warnings=$(grep -c '^   ⚠️ ' <<< "$lint_output" || true)
+    errors=$((errors + lint_errors))
+    warnings=$((warnings + lint_warnings))
+    echo ""
+fi
+
 # Summary
 if [ $errors -gt 0 ]; then
     echo -e "${RED}❌ Content check failed with $errors error(s)${NC}"
@@ -23,28 +23,6 @@ fi
 
 OUTPUT_PATH="$PROJECT_ROOT/$OUTPUT_DIR"
 
-check_output_file() {
-    local file="$1"
-    local min_size="${2:-1000}"  # Default minimum 1KB
-    
-    if [ ! -f "$file" ]; then
-        echo -e "${RED}❌ Output file missing: $file${NC}"
-        return 1
-    fi
-    
-    local size
-    size=$(stat -f%z "$file" 2>/dev/null || stat -c%s "$file" 2>/dev/null || echo "0")
-    
-    if [ "$size" -lt "$min_size" ]; then
-        echo -e "${YELLOW}⚠️  Output file seems too small: $file${NC} (${size} bytes)"
-        return 2
-    else
-        local size_kb=$((size / 1024))
-        echo -e "${GREEN}✅ Output file OK: $file${NC} (${size_kb}KB)"
-        return 0
-    fi
-}
-
 echo "Checking output files..."
 echo ""
 
@@ -54,77 +32,19 @@ if [ ! -d "$OUTPUT_PATH" ]; then
     exit 0
 fi
 
-# Check for EPUB
-epub_files=$(find "$OUTPUT_PATH" -name "*.epub" 2>/dev/null || echo "")
-if [ -n "$epub_files" ]; then
-    echo "EPUB files:"
-    while IFS= read -r file; do
-        if [ -n "$file" ]; then
-            check_output_file "$file" 50000  # EPUB should be at least 50KB
-            case $? in
-                1) errors=$((errors + 1));;
-                2) warnings=$((warnings + 1));;
-            esac
-            
-            # Validate EPUB if epubcheck is available
-            if command -v epubcheck &> /dev/null; then
-                echo "  Validating EPUB structure..."
-                if epubcheck "$file" &> /dev/null; then
-                    echo -e "  ${GREEN}✅ EPUB validation passed${NC}"
-                else
-                    echo -e "  ${YELLOW}⚠️  EPUB validation found issues${NC}"
-                    warnings=$((warnings + 1))
-                fi
-            fi
-        fi
-    done <<< "$epub_files"
-else
-    echo -e "${YELLOW}⚠️  No EPUB files found${NC}"
-    warnings=$((warnings + 1))
-fi
-
-echo ""
-
-# Check for PDF
-pdf_files=$(find "$OUTPUT_PATH" -name "*.pdf" 2>/dev/null || echo "")
-if [ -n "$pdf_files" ]; then
-    echo "PDF files:"
-    while IFS= read -r file; do
-        if [ -n "$file" ]; then
-            check_output_file "$file" 100000  # PDF should be at least 100KB
-            case $? in
-                1) errors=$((errors + 1));;
-                2) warnings=$((warnings + 1));;
-            esac
-        fi
-    done <<< "$pdf_files"
-else
-    echo -e "${YELLOW}⚠️  No PDF files found${NC}"
-    warnings=$((warnings + 1))
-fi
-
-echo ""
-
-# Check for Word
-docx_files=$(find "$OUTPUT_PATH" -name "*.docx" 2>/dev/null || echo "")
-if [ -n "$docx_files" ]; then
-    echo "Word files:"
-    while IFS= read -r file; do
-        if [ -n "$file" ]; then
-            check_output_file "$file" 50000  # Word should be at least 50KB
-            case $? in
-                1) errors=$((errors + 1));;
-                2) warnings=$((warnings + 1));;
-            esac
-        fi
-    done <<< "$docx_files"
-else
-    echo -e "${YELLOW}⚠️  No Word files found${NC}"
-    warnings=$((warnings + 1))
+# Sizes and structure of the EPUB, PDF and Word files; files whose content hash
+# was already verified (by the build or an earlier check) are not validated again
+check_status=0
+check_output=$(python3 "$PROJECT_ROOT/tools/artifact_store.py" check "$PROJECT_ROOT" 2>&1) || check_status=$?
+echo "$check_output"
+errors=$((errors + $(grep -c '^ *❌' <<< "$check_output" || true)))
+warnings=$((warnings + $(grep -c '^ *⚠️' <<< "$check_output" || true)))
+# A failed check that reported no error of its own crashed
+if [ $check_status -ne 0 ] && [ $errors -eq 0 ]; then
+    echo -e "${RED}❌ Output check did not complete (exit status $check_status)${NC}"
+    errors=$((errors + 1))
 fi
 
-echo ""
-
 # Summary
 if [ $errors -gt 0 ]; then
     echo -e "${RED}❌ Output check failed with $errors error(s)${NC}"
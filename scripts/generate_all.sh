@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 # Master script to generate all formats
+# Usage: generate_all.sh [--verbose] [--quiet] [--formats epub,pdf,word] [--jobs N] [--force] [--per-chapter] [--epubcheck] [--lint] [--chrome-trace] [--watch]
 
 set -euo pipefail
 
@@ -15,6 +16,14 @@ NC='\033[0m'
 
 VERBOSE=false
 QUIET=false
+FORMATS="epub,pdf,word"
+JOBS=""
+FORCE=false
+CHROME_TRACE=false
+EPUBCHECK=false
+LINT=false
+PER_CHAPTER=false
+WATCH=false
 
 # Parse arguments
 while [[ $# -gt 0 ]]; do
@@ -27,6 +36,39 @@ while [[ $# -gt 0 ]]; do
             QUIET=true
             shift
             ;;
+        --formats)
+            FORMATS="$2"
+            shift 2
+            ;;
+        --jobs|-j)
+            JOBS="$2"
+            shift 2
+            ;;
+        --force|-f)
+            FORCE=true
+            shift
+            ;;
+        --per-chapter)
+            PER_CHAPTER=true
+            shift
+            ;;
+        --epubcheck)
+            EPUBCHECK=true
+            shift
+            ;;
+        --lint)
+            # Stop before building if the manuscript has broken links, images or ids
+            LINT=true
+            shift
+            ;;
+        --watch)
+            WATCH=true
+            shift
+            ;;
+        --chrome-trace)
+            CHROME_TRACE=true
+            shift
+            ;;
         *)
             echo "Unknown option: $1"
             exit 1
@@ -84,43 +126,49 @@ else
 fi
 log ""
 
-# Generate formats
+# Generate formats (concurrently, one worker per format by default)
 log_info "Step 3: Generating formats..."
 log ""
 
-EPUB_SUCCESS=false
-PDF_SUCCESS=false
-WORD_SUCCESS=false
+BUILD_ARGS=(--formats "$FORMATS")
+if [ -n "$JOBS" ]; then
+    BUILD_ARGS+=(--jobs "$JOBS")
+fi
+if [ "$FORCE" = true ]; then
+    BUILD_ARGS+=(--force)
+fi
+if [ "$PER_CHAPTER" = true ]; then
+    BUILD_ARGS+=(--per-chapter)
+fi
+if [ "$EPUBCHECK" = true ]; then
+    BUILD_ARGS+=(--epubcheck)
+fi
 
-# Generate EPUB
-log_info "━━━ Generating EPUB ━━━"
-if "$SCRIPT_DIR/generate_epub.sh"; then
-    EPUB_SUCCESS=true
-    log_success "✅ EPUB generation successful"
-else
-    log_error "❌ EPUB generation failed"
+# Watch mode: build what is stale, then rebuild affected formats on every save
+if [ "$WATCH" = true ]; then
+    exec python3 "$PROJECT_ROOT/tools/watch_book.py" "${BUILD_ARGS[@]}"
 fi
-log ""
 
-# Generate PDF
-log_info "━━━ Generating PDF ━━━"
-if "$SCRIPT_DIR/generate_pdf.sh"; then
-    PDF_SUCCESS=true
-    log_success "✅ PDF generation successful"
-else
-    log_error "❌ PDF generation failed"
+if [ "$LINT" = true ]; then
+    BUILD_ARGS+=(--lint)
+fi
+if [ "$CHROME_TRACE" = true ]; then
+    BUILD_ARGS+=(--chrome-trace)
 fi
-log ""
 
-# Generate Word
-log_info "━━━ Generating Word ━━━"
-if "$SCRIPT_DIR/generate_word.sh"; then
-    WORD_SUCCESS=true
-    log_success "✅ Word generation successful"
+BUILD_LOG=$(mktemp)
+trap 'rm -f "$BUILD_LOG"' EXIT
+
+# Per-format output is shown as the build runs (unbuffered); the summary is kept
+# in the log and shown after post-generation validation
+BUILD_EXIT=0
+if [ "$QUIET" = false ]; then
+    python3 -u "$PROJECT_ROOT/tools/build_book.py" "${BUILD_ARGS[@]}" 2>&1 | tee "$BUILD_LOG" \
+        | awk '/^📊 Generation Summary/ { summary = 1 } !summary { print; fflush() }' \
+        && BUILD_EXIT=0 || BUILD_EXIT=${PIPESTATUS[0]}
 else
-    log_error "❌ Word generation failed"
+    python3 "$PROJECT_ROOT/tools/build_book.py" "${BUILD_ARGS[@]}" > "$BUILD_LOG" 2>&1 || BUILD_EXIT=$?
 fi
-log ""
 
 # Post-generation validation
 log_info "Step 4: Running post-generation validation..."
@@ -133,35 +181,6 @@ log_info "📊 Generation Summary"
 log_info "═══════════════════════════════════════════════════════════"
 log ""
 
-if [ "$EPUB_SUCCESS" = true ]; then
-    log_success "✅ EPUB: Generated successfully"
-else
-    log_error "❌ EPUB: Generation failed"
-fi
-
-if [ "$PDF_SUCCESS" = true ]; then
-    log_success "✅ PDF: Generated successfully"
-else
-    log_error "❌ PDF: Generation failed"
-fi
-
-if [ "$WORD_SUCCESS" = true ]; then
-    log_success "✅ Word: Generated successfully"
-else
-    log_error "❌ Word: Generation failed"
-fi
-
-log ""
-
-# Exit code
-if [ "$EPUB_SUCCESS" = true ] && [ "$PDF_SUCCESS" = true ] && [ "$WORD_SUCCESS" = true ]; then
-    log_success "🎉 All formats generated successfully!"
-    exit 0
-elif [ "$EPUB_SUCCESS" = true ] || [ "$PDF_SUCCESS" = true ] || [ "$WORD_SUCCESS" = true ]; then
-    log_warning "⚠️  Some formats generated successfully, but some failed"
-    exit 0  # Partial success
-else
-    log_error "❌ All format generation failed"
-    exit 1
-fi
+sed -n '/^📊 Generation Summary/,$p' "$BUILD_LOG" | tail -n +2
 
+exit $BUILD_EXIT
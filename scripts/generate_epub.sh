@@ -6,174 +6,141 @@ set -euo pipefail
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_ROOT="$(cd "$SCRIPT_DIR/.." && pwd)"
 
+FORCE=false
+CHROME_TRACE=false
+PER_CHAPTER=false
+EPUBCHECK_FLAG=""
+
+# Parse arguments
+while [[ $# -gt 0 ]]; do
+    case $1 in
+        --force|-f)
+            FORCE=true
+            shift
+            ;;
+        --chrome-trace)
+            CHROME_TRACE=true
+            shift
+            ;;
+        --per-chapter)
+            # Convert each chapter separately and reuse cached conversions
+            PER_CHAPTER=true
+            export BUILD_VARIANT=per-chapter
+            shift
+            ;;
+        --epubcheck)
+            # Deep validation with epubcheck on top of the built-in checks
+            EPUBCHECK_FLAG="--epubcheck"
+            shift
+            ;;
+        *)
+            echo "Unknown option: $1"
+            exit 1
+            ;;
+    esac
+done
+
+# Per-stage trace (wall/CPU time, peak RSS, bytes), written to the output directory on exit
+TRACE_FILE=$(mktemp "${TMPDIR:-/tmp}/book_epub_trace.XXXXXX")
+trace_run() {
+    local stage=$1
+    shift
+    python3 "$PROJECT_ROOT/tools/build_trace.py" run "$TRACE_FILE" "$stage" -- "$@"
+}
+# Python steps run through tools/book.py, which records its own stages
+book() {
+    python3 "$PROJECT_ROOT/tools/book.py" --project "$PROJECT_ROOT" --config "$CONFIG_FILE" --trace "$TRACE_FILE" "$@"
+}
+finish_trace() {
+    if [ -n "${OUTPUT_PATH:-}" ]; then
+        local trace_args=(--label epub)
+        if [ "$CHROME_TRACE" = true ]; then
+            trace_args+=(--chrome)
+        fi
+        python3 "$PROJECT_ROOT/tools/build_trace.py" finish "$TRACE_FILE" \
+            "$OUTPUT_PATH/epub-trace.json" "${trace_args[@]}" || true
+    fi
+    rm -f "$TRACE_FILE"
+}
+trap finish_trace EXIT
+
 # Load config
-CONFIG_FILE="$PROJECT_ROOT/config.yaml"
+export CONFIG_FILE="$PROJECT_ROOT/config.yaml"
 if [ ! -f "$CONFIG_FILE" ]; then
     echo "❌ Config file not found: $CONFIG_FILE"
     exit 1
 fi
 
-# Parse config using Python
-eval $(python3 << 'PYEOF'
-import yaml
-import sys
-import os
-
-config_file = os.environ.get('CONFIG_FILE', '$CONFIG_FILE')
-with open(config_file, 'r') as f:
-    config = yaml.safe_load(f)
-
-book = config.get('book', {})
-structure = config.get('structure', {})
-output = config.get('output', {})
-styles = config.get('styles', {})
-
-# Escape single quotes in strings
-def escape(s):
-    return str(s).replace("'", "'\\''")
-
-print(f"BOOK_TITLE='{escape(book.get('title', ''))}'")
-print(f"BOOK_SUBTITLE='{escape(book.get('subtitle', ''))}'")
-print(f"BOOK_AUTHOR='{escape(book.get('author', ''))}'")
-print(f"BOOK_PUBLISHER='{escape(book.get('publisher', ''))}'")
-print(f"BOOK_DATE='{escape(book.get('date', ''))}'")
-print(f"BOOK_LANGUAGE='{escape(book.get('language', 'en-US'))}'")
-print(f"BOOK_DESCRIPTION='{escape(book.get('description', ''))}'")
-print(f"BOOK_RIGHTS='{escape(book.get('rights', ''))}'")
-print(f"HAS_CONCLUSION='{structure.get('has_conclusion', False)}'")
-print(f"COVER_IMAGE='{escape(structure.get('cover_image', ''))}'")
-print(f"OUTPUT_DIR='{output.get('output_dir', 'output')}'")
-print(f"EPUB_CSS='{styles.get('epub_css', 'styles/ebook_styles.css')}'")
-PYEOF
-)
-
-# Get output filename from config or generate from title
-EPUB_FILENAME_CONFIG=$(python3 << EOF
-import yaml
-with open("$CONFIG_FILE", 'r') as f:
-    config = yaml.safe_load(f)
-print(config.get('output', {}).get('epub_filename', ''))
-EOF
-)
-
-if [ -z "$EPUB_FILENAME_CONFIG" ] || [ "$EPUB_FILENAME_CONFIG" = '""' ]; then
-    EPUB_FILENAME=$(echo "$BOOK_TITLE" | "$PROJECT_ROOT/tools/sanitize_filename.py")
-    EPUB_FILENAME="${EPUB_FILENAME}_Professional.epub"
-else
-    EPUB_FILENAME=$(basename "$EPUB_FILENAME_CONFIG")
+# Config, output path, chapter count and build cache state in one call; the inputs
+# are hashed now, before the build, and INPUTS_HASH is what cache record stores.
+# Unless the EPUB is up to date, the same call makes the resized images (COVER_PATH
+# is the cover to use) and the subsets of the stylesheet's @font-face fonts with a
+# stylesheet copy pointing at them (FONT_CSS, FONT_FILES), all cached
+PREPARE_FLAGS=(--prepare)
+if [ "$PER_CHAPTER" = true ]; then
+    PREPARE_FLAGS=()
+elif [ "$FORCE" = true ]; then
+    PREPARE_FLAGS+=(--force)
 fi
-
-OUTPUT_PATH="$PROJECT_ROOT/$OUTPUT_DIR"
+COVER_PATH=""
+FONT_CSS=""
+FONT_FILES=()
+CONFIG_VARS=$(book config epub --check-cache ${PREPARE_FLAGS[@]+"${PREPARE_FLAGS[@]}"}) || exit 1
+eval "$CONFIG_VARS"
 mkdir -p "$OUTPUT_PATH"
 
-OUTPUT_FILE="$OUTPUT_PATH/$EPUB_FILENAME"
+# Skip the build if no input changed since the last recorded build
+if [ "$FORCE" != true ] && [ "${UP_TO_DATE:-false}" = true ]; then
+    echo "✅ EPUB is up to date: $OUTPUT_FILE"
+    echo "   Use --force to rebuild"
+    exit 0
+fi
 
-# Cleanup function
-cleanup() {
-    rm -f "$PROJECT_ROOT/temp_book_for_epub.md"
-}
-trap cleanup EXIT
+if [ "$PER_CHAPTER" = true ]; then
+    if ! trace_run build_epub python3 "$PROJECT_ROOT/tools/build_epub.py" "$OUTPUT_FILE"; then
+        echo "❌ EPUB generation failed"
+        exit 1
+    fi
+
+    echo "   → Validating EPUB..."
+    book validate "$OUTPUT_FILE" $EPUBCHECK_FLAG + cache record epub "$OUTPUT_FILE" --inputs-hash "$INPUTS_HASH" \
+        || echo "   ⚠️  Validation found issues"
+
+    ls -lh "$OUTPUT_FILE"
+    exit 0
+fi
 
 echo "📖 Generating Professional EPUB..."
 echo ""
 
-# Detect chapters
-echo "   → Detecting chapters..."
-CHAPTERS=$("$PROJECT_ROOT/tools/detect_chapters.py" "$PROJECT_ROOT/book_content/chapters" || echo "")
-if [ -z "$CHAPTERS" ]; then
+if [ "$CHAPTER_COUNT" -eq 0 ]; then
     echo "❌ No chapters found"
     exit 1
 fi
-
-CHAPTER_COUNT=$(echo "$CHAPTERS" | wc -l | tr -d ' ')
 echo "   ✅ Found $CHAPTER_COUNT chapter(s)"
 
-# Create temporary combined file
-echo "   → Combining book components..."
-
-cat > "$PROJECT_ROOT/temp_book_for_epub.md" << EOF
----
-title: "$BOOK_TITLE"
-subtitle: "$BOOK_SUBTITLE"
-publisher: "$BOOK_PUBLISHER"
-date: "$BOOK_DATE"
-language: $BOOK_LANGUAGE
-description: "$BOOK_DESCRIPTION"
-rights: "$BOOK_RIGHTS"
----
-
-EOF
-
-# Add front matter
-echo "   → Adding front matter..."
-
-echo '<section class="title-page" epub:type="titlepage">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-cat "$PROJECT_ROOT/book_content/front_matter/title_page.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-
-echo '<section class="copyright-page" epub:type="copyright-page">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-cat "$PROJECT_ROOT/book_content/front_matter/copyright_page.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-
-echo '<section class="dedication" epub:type="dedication">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-cat "$PROJECT_ROOT/book_content/front_matter/dedication.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-
-echo '<section class="toc" epub:type="frontmatter toc">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-cat "$PROJECT_ROOT/book_content/front_matter/table_of_contents.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-
-echo '<section class="preface" epub:type="preface">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-cat "$PROJECT_ROOT/book_content/front_matter/preface.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-
-# Add chapters
-echo "   → Adding chapters..."
-chapter_num=1
-while IFS= read -r chapter; do
-    if [ -n "$chapter" ]; then
-        echo "<section class=\"chapter\" epub:type=\"chapter\" id=\"chapter-$chapter_num\">" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-        cat "$chapter" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-        echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-        echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-        chapter_num=$((chapter_num + 1))
-    fi
-done <<< "$CHAPTERS"
-
-# Add conclusion
-if [ "$HAS_CONCLUSION" = "True" ] && [ -f "$PROJECT_ROOT/book_content/chapters/conclusion.md" ]; then
-    echo '<section class="chapter" epub:type="chapter conclusion" id="conclusion">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-    cat "$PROJECT_ROOT/book_content/chapters/conclusion.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-    echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-fi
-
-# Add back matter (appendices, references, acknowledgments)
-if [ -f "$PROJECT_ROOT/book_content/back_matter/acknowledgments.md" ]; then
-    echo '<section class="acknowledgments" epub:type="acknowledgments" id="acknowledgments">' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-    cat "$PROJECT_ROOT/book_content/back_matter/acknowledgments.md" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-    echo '</section>' >> "$PROJECT_ROOT/temp_book_for_epub.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_epub.md"
-fi
-
 # Generate EPUB
 echo "   → Converting to EPUB..."
 
 COVER_FLAG=""
 if [ -n "$COVER_IMAGE" ] && [ "$COVER_IMAGE" != '""' ] && [ -f "$PROJECT_ROOT/$COVER_IMAGE" ]; then
-    COVER_FLAG="--epub-cover-image=$PROJECT_ROOT/$COVER_IMAGE"
+    COVER_FLAG="--epub-cover-image=$PROJECT_ROOT/${COVER_PATH:-$COVER_IMAGE}"
 fi
 
-CSS_PATH="$PROJECT_ROOT/$EPUB_CSS"
+CSS_PATH="${FONT_CSS:-$PROJECT_ROOT/$EPUB_CSS}"
+FONT_FLAGS=()
+for font in ${FONT_FILES[@]+"${FONT_FILES[@]}"}; do
+    FONT_FLAGS+=("--epub-embed-font=$font")
+done
 
-pandoc "$PROJECT_ROOT/temp_book_for_epub.md" \
+# The manuscript is parsed once per file (cached, shared with the other formats)
+# and its JSON AST streamed straight into pandoc
+if book assemble epub --optimize-images --ast | trace_run pandoc pandoc \
+    --from=json \
     -o "$OUTPUT_FILE" \
+    --resource-path="$PROJECT_ROOT" \
     $COVER_FLAG \
+    ${FONT_FLAGS[@]+"${FONT_FLAGS[@]}"} \
     --css="$CSS_PATH" \
     --toc \
     --toc-depth=3 \
@@ -184,22 +151,14 @@ pandoc "$PROJECT_ROOT/temp_book_for_epub.md" \
     --metadata date="$BOOK_DATE" \
     --metadata language="$BOOK_LANGUAGE" \
     --metadata description="$BOOK_DESCRIPTION" \
-    --metadata rights="$BOOK_RIGHTS"
-
-if [ $? -eq 0 ]; then
+    --metadata rights="$BOOK_RIGHTS"; then
     echo "✅ EPUB created: $OUTPUT_FILE"
     
-    # Fix EPUB links if tool available
-    if [ -f "$PROJECT_ROOT/tools/fix_epub_links.py" ]; then
-        echo "   → Fixing EPUB links..."
-        python3 "$PROJECT_ROOT/tools/fix_epub_links.py" "$OUTPUT_FILE" || echo "   ⚠️  Link fixing failed (continuing...)"
-    fi
-    
-    # Validate EPUB if epubcheck available
-    if command -v epubcheck &> /dev/null; then
-        echo "   → Validating EPUB..."
-        epubcheck "$OUTPUT_FILE" || echo "   ⚠️  Validation found issues"
-    fi
+    # Fix links, validate (cached by content hash; epubcheck only with --epubcheck)
+    # and record the build in one process
+    echo "   → Fixing EPUB links and validating..."
+    book fix-epub "$OUTPUT_FILE" + validate "$OUTPUT_FILE" $EPUBCHECK_FLAG + cache record epub "$OUTPUT_FILE" --inputs-hash "$INPUTS_HASH" \
+        || echo "   ⚠️  Link fixing or validation found issues (continuing...)"
     
     ls -lh "$OUTPUT_FILE"
     exit 0
@@ -6,67 +6,85 @@ set -euo pipefail
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_ROOT="$(cd "$SCRIPT_DIR/.." && pwd)"
 
+FORCE=false
+CHROME_TRACE=false
+PER_CHAPTER=false
+
+# Parse arguments
+while [[ $# -gt 0 ]]; do
+    case $1 in
+        --force|-f)
+            FORCE=true
+            shift
+            ;;
+        --chrome-trace)
+            CHROME_TRACE=true
+            shift
+            ;;
+        --per-chapter)
+            # Lay out chapters in parallel and stitch them into one PDF
+            PER_CHAPTER=true
+            export BUILD_VARIANT=per-chapter
+            shift
+            ;;
+        *)
+            echo "Unknown option: $1"
+            exit 1
+            ;;
+    esac
+done
+
+# Per-stage trace (wall/CPU time, peak RSS, bytes), written to the output directory on exit
+TRACE_FILE=$(mktemp "${TMPDIR:-/tmp}/book_pdf_trace.XXXXXX")
+trace_run() {
+    local stage=$1
+    shift
+    python3 "$PROJECT_ROOT/tools/build_trace.py" run "$TRACE_FILE" "$stage" -- "$@"
+}
+# Python steps run through tools/book.py, which records its own stages
+book() {
+    python3 "$PROJECT_ROOT/tools/book.py" --project "$PROJECT_ROOT" --config "$CONFIG_FILE" --trace "$TRACE_FILE" "$@"
+}
+finish_trace() {
+    if [ -n "${OUTPUT_PATH:-}" ]; then
+        local trace_args=(--label pdf)
+        if [ "$CHROME_TRACE" = true ]; then
+            trace_args+=(--chrome)
+        fi
+        python3 "$PROJECT_ROOT/tools/build_trace.py" finish "$TRACE_FILE" \
+            "$OUTPUT_PATH/pdf-trace.json" "${trace_args[@]}" || true
+    fi
+    rm -f "$TRACE_FILE"
+}
+trap finish_trace EXIT
+
 # Load config
-CONFIG_FILE="$PROJECT_ROOT/config.yaml"
+export CONFIG_FILE="$PROJECT_ROOT/config.yaml"
 if [ ! -f "$CONFIG_FILE" ]; then
     echo "❌ Config file not found: $CONFIG_FILE"
     exit 1
 fi
 
-# Parse config using Python
-eval $(python3 << 'PYEOF'
-import yaml
-import sys
-import os
-
-config_file = os.environ.get('CONFIG_FILE', '$CONFIG_FILE')
-with open(config_file, 'r') as f:
-    config = yaml.safe_load(f)
-
-book = config.get('book', {})
-structure = config.get('structure', {})
-output = config.get('output', {})
-styles = config.get('styles', {})
-
-def escape(s):
-    return str(s).replace("'", "'\\''")
-
-print(f"BOOK_TITLE='{escape(book.get('title', ''))}'")
-print(f"BOOK_SUBTITLE='{escape(book.get('subtitle', ''))}'")
-print(f"BOOK_PUBLISHER='{escape(book.get('publisher', ''))}'")
-print(f"BOOK_DATE='{escape(book.get('date', ''))}'")
-print(f"HAS_CONCLUSION='{structure.get('has_conclusion', False)}'")
-print(f"OUTPUT_DIR='{output.get('output_dir', 'output')}'")
-print(f"PRINT_CSS='{styles.get('print_css', 'styles/print_styles.css')}'")
-PYEOF
-)
-
-# Get output filename from config or generate from title
-PDF_FILENAME_CONFIG=$(python3 << EOF
-import yaml
-with open("$CONFIG_FILE", 'r') as f:
-    config = yaml.safe_load(f)
-print(config.get('output', {}).get('pdf_filename', ''))
-EOF
-)
-
-if [ -z "$PDF_FILENAME_CONFIG" ] || [ "$PDF_FILENAME_CONFIG" = '""' ]; then
-    PDF_FILENAME=$(echo "$BOOK_TITLE" | "$PROJECT_ROOT/tools/sanitize_filename.py")
-    PDF_FILENAME="${PDF_FILENAME}_Print_Professional.pdf"
-else
-    PDF_FILENAME=$(basename "$PDF_FILENAME_CONFIG")
+# Config, output path, chapter count and build cache state in one call; the inputs
+# are hashed now, before the build, and INPUTS_HASH is what cache record stores.
+# Unless the PDF is up to date, the same call makes the resized images and the
+# subsets of the stylesheet's @font-face fonts with a stylesheet copy pointing at
+# them (FONT_CSS), all cached
+PREPARE_FLAGS=(--prepare)
+if [ "$FORCE" = true ]; then
+    PREPARE_FLAGS+=(--force)
 fi
-
-OUTPUT_PATH="$PROJECT_ROOT/$OUTPUT_DIR"
+FONT_CSS=""
+CONFIG_VARS=$(book config pdf --check-cache "${PREPARE_FLAGS[@]}") || exit 1
+eval "$CONFIG_VARS"
 mkdir -p "$OUTPUT_PATH"
 
-OUTPUT_FILE="$OUTPUT_PATH/$PDF_FILENAME"
-
-# Cleanup function
-cleanup() {
-    rm -f "$PROJECT_ROOT/temp_book_for_pdf.md" "$PROJECT_ROOT/temp_book.html"
-}
-trap cleanup EXIT
+# Skip the build if no input changed since the last recorded build
+if [ "$FORCE" != true ] && [ "${UP_TO_DATE:-false}" = true ]; then
+    echo "✅ PDF is up to date: $OUTPUT_FILE"
+    echo "   Use --force to rebuild"
+    exit 0
+fi
 
 echo "🖨️  Generating Professional PDF..."
 echo ""
@@ -77,105 +95,43 @@ if ! command -v weasyprint &> /dev/null; then
     exit 1
 fi
 
-# Detect chapters
-echo "   → Detecting chapters..."
-CHAPTERS=$("$PROJECT_ROOT/tools/detect_chapters.py" "$PROJECT_ROOT/book_content/chapters" || echo "")
-if [ -z "$CHAPTERS" ]; then
-    echo "❌ No chapters found"
-    exit 1
-fi
-
-CHAPTER_COUNT=$(echo "$CHAPTERS" | wc -l | tr -d ' ')
-echo "   ✅ Found $CHAPTER_COUNT chapter(s)"
+if [ "$PER_CHAPTER" = true ]; then
+    if python3 -c "import weasyprint, pypdf" &> /dev/null; then
+        if ! trace_run build_pdf python3 "$PROJECT_ROOT/tools/build_pdf.py" "$OUTPUT_FILE"; then
+            echo "❌ PDF generation failed"
+            exit 1
+        fi
 
-# Create temporary combined file
-echo "   → Combining book components..."
-
-cat > "$PROJECT_ROOT/temp_book_for_pdf.md" << EOF
----
-title: "$BOOK_TITLE"
-subtitle: "$BOOK_SUBTITLE"
-publisher: "$BOOK_PUBLISHER"
-date: "$BOOK_DATE"
----
-
-EOF
-
-# Add front matter
-echo "   → Adding front matter..."
-
-echo '<div class="frontmatter title-page">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-cat "$PROJECT_ROOT/book_content/front_matter/title_page.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-
-echo '<div class="frontmatter copyright-page">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-cat "$PROJECT_ROOT/book_content/front_matter/copyright_page.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-
-echo '<div class="frontmatter dedication">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-cat "$PROJECT_ROOT/book_content/front_matter/dedication.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-
-echo '<div class="frontmatter toc">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-cat "$PROJECT_ROOT/book_content/front_matter/table_of_contents.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-
-echo '<div class="frontmatter preface">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-cat "$PROJECT_ROOT/book_content/front_matter/preface.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-
-# Add chapters
-echo "   → Adding chapters..."
-while IFS= read -r chapter; do
-    if [ -n "$chapter" ]; then
-        echo '<div class="chapter">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-        cat "$chapter" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-        echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-        echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
+        ls -lh "$OUTPUT_FILE"
+        book cache record pdf "$OUTPUT_FILE" --inputs-hash "$INPUTS_HASH" || echo "   ⚠️  Could not update build cache"
+        exit 0
     fi
-done <<< "$CHAPTERS"
-
-# Add conclusion
-if [ "$HAS_CONCLUSION" = "True" ] && [ -f "$PROJECT_ROOT/book_content/chapters/conclusion.md" ]; then
-    echo '<div class="chapter">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-    cat "$PROJECT_ROOT/book_content/chapters/conclusion.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-    echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
+    echo "   ⚠️  Chunked PDF rendering needs the weasyprint and pypdf Python packages; rendering in one pass"
 fi
 
-# Add back matter
-if [ -f "$PROJECT_ROOT/book_content/back_matter/acknowledgments.md" ]; then
-    echo '<div class="acknowledgments">' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-    cat "$PROJECT_ROOT/book_content/back_matter/acknowledgments.md" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-    echo '</div>' >> "$PROJECT_ROOT/temp_book_for_pdf.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_pdf.md"
+if [ "$CHAPTER_COUNT" -eq 0 ]; then
+    echo "❌ No chapters found"
+    exit 1
 fi
+echo "   ✅ Found $CHAPTER_COUNT chapter(s)"
 
 # Generate PDF via HTML
 echo "   → Converting to PDF..."
 
-CSS_PATH="$PROJECT_ROOT/$PRINT_CSS"
+CSS_PATH="${FONT_CSS:-$PROJECT_ROOT/$PRINT_CSS}"
 
-# First convert markdown to HTML
-pandoc "$PROJECT_ROOT/temp_book_for_pdf.md" \
-    -o "$PROJECT_ROOT/temp_book.html" \
+# Manuscript → pandoc (HTML) → WeasyPrint, streamed through pipes
+if book assemble pdf --optimize-images --ast | trace_run pandoc pandoc \
+    --from=json \
+    --to=html5 \
     --standalone \
     --metadata title="$BOOK_TITLE" \
     --metadata subtitle="$BOOK_SUBTITLE" \
-    --metadata publisher="$BOOK_PUBLISHER"
-
-# Then convert HTML to PDF with WeasyPrint
-weasyprint "$PROJECT_ROOT/temp_book.html" \
+    --metadata publisher="$BOOK_PUBLISHER" | trace_run weasyprint weasyprint - \
     "$OUTPUT_FILE" \
+    --base-url "$PROJECT_ROOT/" \
     --stylesheet "$CSS_PATH" \
-    --presentational-hints
-
-if [ $? -eq 0 ]; then
+    --presentational-hints; then
     echo "✅ PDF created: $OUTPUT_FILE"
     ls -lh "$OUTPUT_FILE"
     
@@ -187,6 +143,7 @@ if [ $? -eq 0 ]; then
         fi
     fi
     
+    book cache record pdf "$OUTPUT_FILE" --inputs-hash "$INPUTS_HASH" || echo "   ⚠️  Could not update build cache"
     exit 0
 else
     echo "❌ PDF generation failed"
@@ -6,178 +6,130 @@ set -euo pipefail
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_ROOT="$(cd "$SCRIPT_DIR/.." && pwd)"
 
+FORCE=false
+CHROME_TRACE=false
+
+# Parse arguments
+while [[ $# -gt 0 ]]; do
+    case $1 in
+        --force|-f)
+            FORCE=true
+            shift
+            ;;
+        --chrome-trace)
+            CHROME_TRACE=true
+            shift
+            ;;
+        *)
+            echo "Unknown option: $1"
+            exit 1
+            ;;
+    esac
+done
+
+# Per-stage trace (wall/CPU time, peak RSS, bytes), written to the output directory on exit
+TRACE_FILE=$(mktemp "${TMPDIR:-/tmp}/book_word_trace.XXXXXX")
+trace_run() {
+    local stage=$1
+    shift
+    python3 "$PROJECT_ROOT/tools/build_trace.py" run "$TRACE_FILE" "$stage" -- "$@"
+}
+# Python steps run through tools/book.py, which records its own stages
+book() {
+    python3 "$PROJECT_ROOT/tools/book.py" --project "$PROJECT_ROOT" --config "$CONFIG_FILE" --trace "$TRACE_FILE" "$@"
+}
+finish_trace() {
+    if [ -n "${OUTPUT_PATH:-}" ]; then
+        local trace_args=(--label word)
+        if [ "$CHROME_TRACE" = true ]; then
+            trace_args+=(--chrome)
+        fi
+        python3 "$PROJECT_ROOT/tools/build_trace.py" finish "$TRACE_FILE" \
+            "$OUTPUT_PATH/word-trace.json" "${trace_args[@]}" || true
+    fi
+    rm -f "$TRACE_FILE"
+}
+trap finish_trace EXIT
+
 # Load config
-CONFIG_FILE="$PROJECT_ROOT/config.yaml"
+export CONFIG_FILE="$PROJECT_ROOT/config.yaml"
 if [ ! -f "$CONFIG_FILE" ]; then
     echo "❌ Config file not found: $CONFIG_FILE"
     exit 1
 fi
 
-# Parse config using Python
-eval $(python3 << 'PYEOF'
-import yaml
-import sys
-import os
-
-config_file = os.environ.get('CONFIG_FILE', '$CONFIG_FILE')
-with open(config_file, 'r') as f:
-    config = yaml.safe_load(f)
-
-book = config.get('book', {})
-structure = config.get('structure', {})
-output = config.get('output', {})
-styles = config.get('styles', {})
-
-def escape(s):
-    return str(s).replace("'", "'\\''")
-
-print(f"BOOK_TITLE='{escape(book.get('title', ''))}'")
-print(f"BOOK_SUBTITLE='{escape(book.get('subtitle', ''))}'")
-print(f"BOOK_PUBLISHER='{escape(book.get('publisher', ''))}'")
-print(f"BOOK_DATE='{escape(book.get('date', ''))}'")
-print(f"HAS_CONCLUSION='{structure.get('has_conclusion', False)}'")
-print(f"OUTPUT_DIR='{output.get('output_dir', 'output')}'")
-print(f"WORD_TEMPLATE='{styles.get('word_template', 'styles/word_template.docx')}'")
-PYEOF
-)
-
-# Get output filename from config or generate from title
-WORD_FILENAME_CONFIG=$(python3 << EOF
-import yaml
-with open("$CONFIG_FILE", 'r') as f:
-    config = yaml.safe_load(f)
-print(config.get('output', {}).get('word_filename', ''))
-EOF
-)
-
-if [ -z "$WORD_FILENAME_CONFIG" ] || [ "$WORD_FILENAME_CONFIG" = '""' ]; then
-    WORD_FILENAME=$(echo "$BOOK_TITLE" | "$PROJECT_ROOT/tools/sanitize_filename.py")
-    WORD_FILENAME="${WORD_FILENAME}_Print_Professional.docx"
-else
-    WORD_FILENAME=$(basename "$WORD_FILENAME_CONFIG")
+# Config, output path, chapter count and build cache state in one call; the inputs
+# are hashed now, before the build, and INPUTS_HASH is what cache record stores.
+# Unless the document is up to date, the same call makes the resized images and
+# compiles the formatting rules into a cached reference.docx (REFERENCE_DOC)
+PREPARE_FLAGS=(--prepare)
+if [ "$FORCE" = true ]; then
+    PREPARE_FLAGS+=(--force)
 fi
-
-OUTPUT_PATH="$PROJECT_ROOT/$OUTPUT_DIR"
+REFERENCE_DOC=""
+CONFIG_VARS=$(book config word --check-cache "${PREPARE_FLAGS[@]}") || exit 1
+eval "$CONFIG_VARS"
 mkdir -p "$OUTPUT_PATH"
 
-OUTPUT_FILE="$OUTPUT_PATH/$WORD_FILENAME"
-TEMPLATE_PATH="$PROJECT_ROOT/$WORD_TEMPLATE"
+# Skip the build if no input changed since the last recorded build
+if [ "$FORCE" != true ] && [ "${UP_TO_DATE:-false}" = true ]; then
+    echo "✅ Word is up to date: $OUTPUT_FILE"
+    echo "   Use --force to rebuild"
+    exit 0
+fi
 
-# Cleanup function
-cleanup() {
-    rm -f "$PROJECT_ROOT/temp_book_for_word.md"
-}
-trap cleanup EXIT
+TEMPLATE_PATH="$PROJECT_ROOT/$WORD_TEMPLATE"
 
 echo "📝 Generating Professional Word Document..."
 echo ""
 
-# Check template exists
-if [ ! -f "$TEMPLATE_PATH" ]; then
+# With the compiled reference.docx pandoc's output needs no post-processing;
+# fall back to the template otherwise
+POST_PROCESS=false
+if [ -n "$REFERENCE_DOC" ]; then
+    TEMPLATE_FLAG="--reference-doc=$REFERENCE_DOC"
+elif [ ! -f "$TEMPLATE_PATH" ]; then
     echo "⚠️  Word template not found: $TEMPLATE_PATH"
     echo "   Continuing without template..."
     TEMPLATE_FLAG=""
+    POST_PROCESS=true
 else
     TEMPLATE_FLAG="--reference-doc=$TEMPLATE_PATH"
+    POST_PROCESS=true
 fi
 
-# Detect chapters
-echo "   → Detecting chapters..."
-CHAPTERS=$("$PROJECT_ROOT/tools/detect_chapters.py" "$PROJECT_ROOT/book_content/chapters" || echo "")
-if [ -z "$CHAPTERS" ]; then
+if [ "$CHAPTER_COUNT" -eq 0 ]; then
     echo "❌ No chapters found"
     exit 1
 fi
-
-CHAPTER_COUNT=$(echo "$CHAPTERS" | wc -l | tr -d ' ')
 echo "   ✅ Found $CHAPTER_COUNT chapter(s)"
 
-# Create temporary combined file
-echo "   → Combining book components..."
-
-cat > "$PROJECT_ROOT/temp_book_for_word.md" << EOF
----
-title: "$BOOK_TITLE"
-subtitle: "$BOOK_SUBTITLE"
-publisher: "$BOOK_PUBLISHER"
-date: "$BOOK_DATE"
----
-
-EOF
-
-# Add front matter
-echo "   → Adding front matter..."
-
-cat "$PROJECT_ROOT/book_content/front_matter/title_page.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-
-cat "$PROJECT_ROOT/book_content/front_matter/copyright_page.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-
-cat "$PROJECT_ROOT/book_content/front_matter/dedication.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-
-cat "$PROJECT_ROOT/book_content/front_matter/table_of_contents.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-
-cat "$PROJECT_ROOT/book_content/front_matter/preface.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-
-# Add chapters
-echo "   → Adding chapters..."
-while IFS= read -r chapter; do
-    if [ -n "$chapter" ]; then
-        cat "$chapter" >> "$PROJECT_ROOT/temp_book_for_word.md"
-        echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-        echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-        echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-    fi
-done <<< "$CHAPTERS"
-
-# Add conclusion
-if [ "$HAS_CONCLUSION" = "True" ] && [ -f "$PROJECT_ROOT/book_content/chapters/conclusion.md" ]; then
-    cat "$PROJECT_ROOT/book_content/chapters/conclusion.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-    echo "\\newpage" >> "$PROJECT_ROOT/temp_book_for_word.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-fi
-
-# Add back matter
-if [ -f "$PROJECT_ROOT/book_content/back_matter/acknowledgments.md" ]; then
-    cat "$PROJECT_ROOT/book_content/back_matter/acknowledgments.md" >> "$PROJECT_ROOT/temp_book_for_word.md"
-    echo "" >> "$PROJECT_ROOT/temp_book_for_word.md"
-fi
-
 # Generate Word document
 echo "   → Converting to Word..."
 
-pandoc "$PROJECT_ROOT/temp_book_for_word.md" \
+# The manuscript is parsed once per file (cached, shared with the other formats)
+# and its JSON AST streamed straight into pandoc
+if book assemble word --optimize-images --ast | trace_run pandoc pandoc \
+    --from=json \
     -o "$OUTPUT_FILE" \
+    --resource-path="$PROJECT_ROOT" \
     $TEMPLATE_FLAG \
     --toc \
     --toc-depth=3 \
     --metadata title="$BOOK_TITLE" \
     --metadata subtitle="$BOOK_SUBTITLE" \
     --metadata publisher="$BOOK_PUBLISHER" \
-    --metadata date="$BOOK_DATE"
-
-if [ $? -eq 0 ]; then
+    --metadata date="$BOOK_DATE"; then
     echo "✅ Word document created: $OUTPUT_FILE"
     
-    # Post-process Word document if tool available
-    if [ -f "$PROJECT_ROOT/tools/format_word.py" ]; then
+    # Post-process Word document if no reference document was compiled
+    # and record the build in the same process
+    if [ "$POST_PROCESS" = true ]; then
         echo "   → Formatting Word document..."
-        python3 "$PROJECT_ROOT/tools/format_word.py" "$OUTPUT_FILE" || echo "   ⚠️  Formatting failed (continuing...)"
+        book format-word "$OUTPUT_FILE" + cache record word "$OUTPUT_FILE" --inputs-hash "$INPUTS_HASH" \
+            || echo "   ⚠️  Formatting failed (continuing...)"
+    else
+        book cache record word "$OUTPUT_FILE" --inputs-hash "$INPUTS_HASH" || echo "   ⚠️  Could not update build cache"
     fi
     
     ls -lh "$OUTPUT_FILE"
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store for generated EPUB, PDF and Word files.
+Every recorded build adds the output's SHA-256 to
+<output_dir>/.artifacts/index.json with the hash of the inputs it was
+built from, its stage timings and its validation result, so "did this
+release's EPUB change?" is a hash comparison. A file whose hash has
+already been verified is not validated again, and a file whose size and
+mtime match its last record is not even hashed again.
+
+Releases copy each output into the store once (objects/<hash>) and
+hard-link it into <output_dir>/releases/<name>/, so identical outputs
+across releases share one copy on disk. Outputs in <output_dir> stay
+ordinary files, since pandoc, WeasyPrint and python-docx overwrite them
+in place.
+
+Usage:
+    artifact_store.py check [project_root]              Check the outputs, skipping verified hashes
+    artifact_store.py release <name> [project_root]     Snapshot the outputs as a release
+    artifact_store.py history [project_root]            List recorded artifacts per format
+"""
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, FORMATS, FORMAT_LABELS, load_config, output_dir
+from build_cache import locked
+from file_hash import hash_file
+from validate_epub import CACHE_FILENAME as VALIDATION_CACHE_FILENAME, cached_validation, check_epub
+
+STORE_DIRNAME = ".artifacts"
+INDEX_FILENAME = "index.json"
+STORE_VERSION = 1
+RELEASES_DIRNAME = "releases"
+
+# Artifact records kept besides those of releases and current outputs (most recent first)
+HISTORY_ENTRIES = 200
+
+FORMAT_SUFFIXES = {
+    '.epub': 'epub',
+    '.pdf': 'pdf',
+    '.docx': 'word',
+}
+
+# Smallest plausible output, as check_outputs.sh has always required
+MIN_SIZES = {
+    'epub': 50000,
+    'pdf': 100000,
+    'word': 50000,
+}
+
+def store_path(project_root, config):
+    """Directory of the artifact store for a project"""
+    return output_dir(project_root, config) / STORE_DIRNAME
+
+def load_index(path):
+    """Load the store index, or an empty one if missing or unreadable"""
+    empty = {'version': STORE_VERSION, 'artifacts': {}, 'outputs': {}, 'releases': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return empty
+
+    if index.get('version') != STORE_VERSION:
+        return empty
+    for key in ('artifacts', 'outputs', 'releases'):
+        index.setdefault(key, {})
+    return index
+
+def save_index(path, index):
+    """Write the store index atomically, dropping the oldest unreferenced records"""
+    keep = {entry['hash'] for entry in index['outputs'].values()}
+    for release in index['releases'].values():
+        keep.update(release['files'].values())
+    history = sorted((digest for digest in index['artifacts'] if digest not in keep),
+                     key=lambda digest: index['artifacts'][digest].get('last_built', ''), reverse=True)
+    for digest in history[HISTORY_ENTRIES:]:
+        del index['artifacts'][digest]
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(temp_path, path)
+
+def output_digest(index, name, path):
+    """
+    Content hash of an output, reusing the recorded one while size and mtime match.
+
+    Args:
+        index: Store index
+        name: Output file name (key in index['outputs'])
+        path: Path to the output
+
+    Returns:
+        SHA-256 hex digest, or None if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    entry = index['outputs'].get(name)
+    if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        return entry['hash']
+    digest = hash_file(path)
+    index['outputs'][name] = {'hash': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return digest
+
+def check_pdf(path):
+    """Cheap structural check of a PDF: header and end-of-file marker"""
+    errors = []
+    with open(path, 'rb') as f:
+        if f.read(5) != b'%PDF-':
+            errors.append("Missing %PDF- header")
+        f.seek(max(0, os.path.getsize(path) - 1024))
+        if b'%%EOF' not in f.read():
+            errors.append("No %%EOF marker (truncated file?)")
+    return errors, []
+
+def check_docx(path):
+    """Cheap structural check of a DOCX: a zip with the main document part"""
+    try:
+        with zipfile.ZipFile(path) as zipf:
+            names = set(zipf.namelist())
+    except zipfile.BadZipFile:
+        return ["Not a zip archive"], []
+    missing = [name for name in ('[Content_Types].xml', 'word/document.xml') if name not in names]
+    return [f"Missing {name}" for name in missing], []
+
+def validate_artifact(path, fmt, digest):
+    """
+    Validate an output whose hash has not been verified.
+
+    EPUBs reuse the build's validation cache when it has this hash.
+
+    Returns:
+        Dictionary with 'errors' and 'warnings' lists
+    """
+    if fmt == 'epub':
+        result = cached_validation(digest, Path(path).parent / VALIDATION_CACHE_FILENAME)
+        if result is not None:
+            return result
+        errors, warnings = check_epub(path)
+    elif fmt == 'pdf':
+        errors, warnings = check_pdf(path)
+    else:
+        errors, warnings = check_docx(path)
+    return {'errors': errors, 'warnings': warnings}
+
+def _artifact(index, digest, fmt, size, now):
+    """Record for a hash, created on first sight"""
+    entry = index['artifacts'].setdefault(digest, {
+        'format': fmt,
+        'size': size,
+        'first_built': now,
+        'builds': 0,
+        'releases': [],
+    })
+    entry['last_built'] = now
+    return entry
+
+def record_artifact(project_root, config, fmt, output_file, inputs_hash=None, elapsed=None,
+                    stages=None, log=print):
+    """
+    Record a successful build's output by content hash.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        fmt: One of FORMATS
+        output_file: Path to the generated output
+        inputs_hash: Input manifest hash from build_cache.inputs_digest()
+        elapsed: Build time in seconds
+        stages: Trace records of the build's stages
+        log: Function called with a progress line (None for quiet)
+
+    Returns:
+        Tuple of (content hash, True if the bytes differ from the
+        previous build of this output)
+    """
+    index_file = store_path(project_root, config) / INDEX_FILENAME
+    name = os.path.basename(output_file)
+    stat = os.stat(output_file)
+    digest = hash_file(output_file)
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    # Validation (maybe epubcheck) runs before the index is locked
+    validation = None
+    if 'validation' not in load_index(index_file)['artifacts'].get(digest, {}):
+        validation = dict(validate_artifact(output_file, fmt, digest), checked_at=now)
+
+    with locked(index_file):
+        index = load_index(index_file)
+        previous = (index['outputs'].get(name) or {}).get('hash')
+        index['outputs'][name] = {'hash': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                  'format': fmt}
+
+        entry = _artifact(index, digest, fmt, stat.st_size, now)
+        entry['builds'] += 1
+        if inputs_hash is not None:
+            entry['inputs_hash'] = inputs_hash
+        if elapsed is not None:
+            entry['elapsed'] = round(elapsed, 3)
+        if stages:
+            entry['stages'] = {}
+            for stage in stages:
+                entry['stages'][stage['name']] = round(entry['stages'].get(stage['name'], 0) + stage['wall'], 3)
+        if 'validation' not in entry:
+            entry['validation'] = validation or dict(validate_artifact(output_file, fmt, digest), checked_at=now)
+        save_index(index_file, index)
+
+    changed = digest != previous
+    if log:
+        if previous is None:
+            status = "new"
+        elif changed:
+            status = "changed since the last build"
+        else:
+            status = "unchanged since the last build"
+        log(f"   📦 Artifact {digest[:12]} ({status})")
+    return digest, changed
+
+def find_outputs(project_root, config):
+    """Generated files at the top of the output directory, as (format, path) in format then name order"""
+    try:
+        with os.scandir(output_dir(project_root, config)) as entries:
+            outputs = [(FORMAT_SUFFIXES[os.path.splitext(entry.name)[1].lower()], Path(entry.path))
+                       for entry in entries
+                       if entry.is_file() and os.path.splitext(entry.name)[1].lower() in FORMAT_SUFFIXES]
+    except FileNotFoundError:
+        return []
+    return sorted(outputs, key=lambda output: (FORMATS.index(output[0]), output[1].name))
+
+def check_outputs(project_root, config, log=print):
+    """
+    Check every output's size and structure, skipping hashes already verified.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        log: Function called with each report line
+
+    Returns:
+        Tuple of (error count, warning count)
+    """
+    index_file = store_path(project_root, config) / INDEX_FILENAME
+    # Checked against a snapshot, merged into the index under its lock at the end
+    index = load_index(index_file)
+    outputs = find_outputs(project_root, config)
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    errors = warnings = 0
+    validated = {}
+
+    for fmt in FORMATS:
+        label = FORMAT_LABELS[fmt]
+        paths = [path for file_format, path in outputs if file_format == fmt]
+        if not paths:
+            log(f"⚠️  No {label} files found")
+            warnings += 1
+            log("")
+            continue
+
+        log(f"{label} files:")
+        for path in paths:
+            size = path.stat().st_size
+            if size < MIN_SIZES[fmt]:
+                log(f"⚠️  Output file seems too small: {path} ({size} bytes)")
+                warnings += 1
+            else:
+                log(f"✅ Output file OK: {path} ({size // 1024}KB)")
+
+            digest = output_digest(index, path.name, path)
+            index['outputs'][path.name].setdefault('format', fmt)
+            entry = index['artifacts'].get(digest)
+            if entry is None:
+                entry = _artifact(index, digest, fmt, size, now)
+            suffix = " (verified)" if 'validation' in entry else ""
+            if 'validation' not in entry:
+                entry['validation'] = dict(validate_artifact(path, fmt, digest), checked_at=now)
+                validated[digest] = entry
+
+            result = entry['validation']
+            if result['errors']:
+                log(f"  ❌ {label} validation failed: {'; '.join(result['errors'][:3])}{suffix}")
+                errors += 1
+            elif result['warnings']:
+                log(f"  ⚠️  {label} validation passed with {len(result['warnings'])} warning(s){suffix}")
+                warnings += 1
+            else:
+                log(f"  ✅ {label} validation passed{suffix}")
+        log("")
+
+    # Outputs that no longer exist are no longer current
+    names = {path.name for _, path in outputs}
+    with locked(index_file):
+        current = load_index(index_file)
+        for name in names:
+            # A build that recorded the output meanwhile has the newer entry
+            entry = current['outputs'].get(name)
+            if entry is None or entry.get('mtime_ns', 0) < index['outputs'][name]['mtime_ns']:
+                current['outputs'][name] = index['outputs'][name]
+        current['outputs'] = {name: entry for name, entry in current['outputs'].items() if name in names}
+        for digest, entry in validated.items():
+            current['artifacts'].setdefault(digest, entry).setdefault('validation', entry['validation'])
+        save_index(index_file, current)
+    return errors, warnings
+
+def _store_object(store, digest, source):
+    """Copy a file into the store once; returns the object's path"""
+    target = store / "objects" / digest[:2] / f"{digest}{Path(source).suffix.lower()}"
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = target.with_name(target.name + f".{os.getpid()}.tmp")
+        shutil.copyfile(source, temp_path)
+        # Objects are shared by every release that links them
+        os.chmod(temp_path, 0o444)
+        os.replace(temp_path, target)
+    return target
+
+def create_release(project_root, config, name, log=print):
+    """
+    Snapshot the current outputs as a named release.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        name: Release name (a directory name, e.g. v1.2)
+        log: Function called with each report line
+
+    Returns:
+        Path to the release directory
+
+    Raises:
+        ValueError: If the name is not a plain directory name
+        FileExistsError: If the release already exists
+        FileNotFoundError: If there are no outputs
+    """
+    if not name or name in ('.', '..') or os.sep in name or (os.altsep and os.altsep in name):
+        raise ValueError(f"Invalid release name: {name!r}")
+    release_dir = output_dir(project_root, config) / RELEASES_DIRNAME / name
+    if release_dir.exists():
+        raise FileExistsError(f"Release already exists: {release_dir}")
+
+    store = store_path(project_root, config)
+    index_file = store / INDEX_FILENAME
+    outputs = find_outputs(project_root, config)
+    if not outputs:
+        raise FileNotFoundError("No outputs to release")
+    with locked(index_file):
+        return _create_release(store, index_file, release_dir, name, outputs, log)
+
+def _create_release(store, index_file, release_dir, name, outputs, log):
+    """Body of create_release(), run with the index locked"""
+    index = load_index(index_file)
+
+    previous = max(index['releases'].items(), key=lambda item: item[1]['created_at'], default=None)
+
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    release_dir.mkdir(parents=True)
+    files = {}
+    total = shared = 0
+    for fmt, path in outputs:
+        digest = output_digest(index, path.name, path)
+        index['outputs'][path.name].setdefault('format', fmt)
+        stored = (store / "objects" / digest[:2] / f"{digest}{path.suffix.lower()}").exists()
+        source = _store_object(store, digest, path)
+        try:
+            os.link(source, release_dir / path.name)
+        except OSError:
+            # Different filesystem or no hard links: keep a copy
+            shutil.copyfile(source, release_dir / path.name)
+        size = path.stat().st_size
+        total += size
+        shared += size if stored else 0
+
+        entry = index['artifacts'].get(digest) or _artifact(index, digest, fmt, size, now)
+        entry.setdefault('releases', []).append(name)
+        files[path.name] = digest
+
+        if previous is None:
+            status = "first release"
+        elif path.name not in previous[1]['files']:
+            status = f"not in {previous[0]}"
+        elif previous[1]['files'][path.name] == digest:
+            status = f"unchanged since {previous[0]}"
+        else:
+            status = f"changed since {previous[0]}"
+        log(f"   ✅ {FORMAT_LABELS[fmt]}: {path.name} {digest[:12]} ({status})")
+
+    index['releases'][name] = {'created_at': now, 'files': files}
+    save_index(index_file, index)
+    log(f"   📦 {len(files)} file(s), {total / 1024:.0f}KB ({shared / 1024:.0f}KB already stored)")
+    return release_dir
+
+def history_lines(project_root, config):
+    """Recorded artifacts per format, newest first"""
+    index = load_index(store_path(project_root, config) / INDEX_FILENAME)
+    current = {entry['hash'] for entry in index['outputs'].values()}
+    lines = []
+    for fmt in FORMATS:
+        entries = sorted(((digest, entry) for digest, entry in index['artifacts'].items() if entry['format'] == fmt),
+                         key=lambda item: item[1].get('last_built', ''), reverse=True)
+        if not entries:
+            continue
+        lines.append(f"{FORMAT_LABELS[fmt]}:")
+        for digest, entry in entries:
+            validation = entry.get('validation')
+            if validation is None:
+                status = "not validated"
+            elif validation['errors']:
+                status = f"{len(validation['errors'])} error(s)"
+            else:
+                status = "valid"
+            parts = [f"   {'*' if digest in current else ' '} {digest[:12]}", entry.get('last_built', ''),
+                     f"{entry['size'] // 1024}KB", status]
+            if entry.get('elapsed') is not None:
+                parts.append(f"{entry['elapsed']:.1f}s")
+            if entry.get('inputs_hash'):
+                parts.append(f"inputs {entry['inputs_hash'][:12]}")
+            if entry.get('releases'):
+                parts.append(f"[{', '.join(entry['releases'])}]")
+            lines.append('  '.join(parts))
+    return lines
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Content-addressed store for generated outputs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help in (('check', "Check the outputs, skipping hashes already verified"),
+                          ('release', "Snapshot the outputs as a named release"),
+                          ('history', "List recorded artifacts per format")):
+        sub = subparsers.add_parser(command, help=help)
+        if command == 'release':
+            sub.add_argument('name', help="Release name, e.g. v1.2")
+        sub.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+        sub.add_argument('--config', default=None,
+                         help="Path to config.yaml (default: <project root>/config.yaml)")
+    args = parser.parse_args()
+
+    project_root = Path(args.project_root)
+    config_file = Path(args.config) if args.config else project_root / "config.yaml"
+    # Without a config the outputs are in the default output directory
+    config = load_config(config_file) if config_file.is_file() else {'output': {}}
+
+    if args.command == 'check':
+        errors, warnings = check_outputs(project_root, config)
+        return 1 if errors else 0
+
+    if args.command == 'release':
+        print(f"📦 Creating release {args.name}...")
+        try:
+            release_dir = create_release(project_root, config, args.name)
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 1
+        print(f"✅ Release written to {release_dir}")
+        return 0
+
+    lines = history_lines(project_root, config)
+    print('\n'.join(lines) if lines else "No artifacts recorded")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+Single command-line entry point for the build tools.
+The generate scripts call this once per step group instead of starting
+a separate interpreter for every helper: the config is loaded once per
+call, and each command imports its tool module (and heavy dependencies
+such as python-docx or ElementTree) only when it runs. A script makes
+three calls per build: `config --check-cache --prepare` (settings, build
+cache state, image derivatives, font subsets and the Word reference
+document), `assemble` (feeding pandoc through a pipe) and a chain that
+post-processes and records the output once pandoc has finished.
+
+Several commands can run in one process by separating them with '+'.
+Every command in a chain runs; the exit status is the first non-zero
+one. With --trace, each command is recorded as a stage in the build
+trace (see build_trace.py) without a wrapper process.
+
+Usage: book.py [--project DIR] [--config FILE] [--trace FILE] <command> [args] [+ <command> [args]]...
+
+Commands:
+    config <format> [--check-cache] [--prepare [--force]]
+                                      Print shell assignments for a generate script (--check-cache:
+                                      also UP_TO_DATE and the INPUTS_HASH to pass to cache record;
+                                      --prepare: also make the format's images, fonts and Word
+                                      reference document unless up to date, and print COVER_PATH,
+                                      FONT_CSS, FONT_FILES or REFERENCE_DOC)
+    detect                            List chapter files in reading order
+    sanitize [title]                  Print a title as a safe filename
+    assemble <format> [--optimize-images] [--ast]
+                                      Stream the format's manuscript (Markdown, or pandoc JSON) to stdout
+    images [--formats F] [--cover]    Make image derivatives (--cover: print the EPUB cover)
+    fonts <format>                    Subset the stylesheet's fonts; print FONT_CSS/FONT_FILES assignments
+    word-reference                    Print the path of the compiled reference.docx
+    fix-epub <book.epub>              Fix EPUB navigation and package files in place
+    format-word <document.docx>       Apply print formatting to a Word document
+    validate <book.epub> [--epubcheck]
+                                      Validate an EPUB
+    lint [--strict]                   Check the manuscript's links, images, ids and headings
+    cache check|record <format> <output_file> [--inputs-hash H]
+                                      Check or record a build in the build cache (and artifact store)
+"""
+
+import os
+import sys
+import time
+import shlex
+import argparse
+from contextlib import contextmanager
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, FORMATS, load_config, output_dir, output_filename
+
+# Separates chained commands on the command line
+CHAIN_SEPARATOR = '+'
+
+class Book:
+    """Project paths plus the config, loaded on first use and shared by chained commands"""
+
+    def __init__(self, project_root, config_file=None, trace_file=None):
+        self.project_root = Path(project_root)
+        self.config_file = Path(config_file) if config_file else self.project_root / "config.yaml"
+        self.trace_file = trace_file
+        self._config = None
+        self._tracer = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = load_config(self.config_file)
+        return self._config
+
+    def chapters(self):
+        from detect_chapters import detect_chapters
+        return detect_chapters(str(self.project_root / "book_content" / "chapters"))
+
+    def manuscript(self):
+        from manuscript import load_manuscript
+        return load_manuscript(self.project_root, self.config)
+
+    @property
+    def tracer(self):
+        """One Tracer for the whole chain, so nested stages measure their peaks correctly"""
+        if self._tracer is None:
+            from build_trace import Tracer
+            self._tracer = Tracer()
+        return self._tracer
+
+    @contextmanager
+    def stage(self, name):
+        """Trace a step of a command as its own stage (when tracing)"""
+        if self.trace_file is None:
+            yield
+            return
+        from build_trace import append_record
+        with self.tracer.stage(name, category='process') as record:
+            yield
+        append_record(self.trace_file, record)
+
+def shell_assignments(values):
+    """NAME='value' lines that are safe to eval in bash"""
+    return [f"{name}={shlex.quote(str(value))}" for name, value in values.items()]
+
+def cmd_config(book, args):
+    """Everything a generate script reads from the config, as shell assignments"""
+    config = book.config
+    info, structure, styles = config['book'], config['structure'], config['styles']
+    out_dir = output_dir(book.project_root, config)
+
+    values = {
+        'BOOK_TITLE': info.get('title', ''),
+        'BOOK_SUBTITLE': info.get('subtitle', ''),
+        'BOOK_AUTHOR': info.get('author', ''),
+        'BOOK_PUBLISHER': info.get('publisher', ''),
+        'BOOK_DATE': info.get('date', ''),
+        'BOOK_LANGUAGE': info.get('language', 'en-US'),
+        'BOOK_DESCRIPTION': info.get('description', ''),
+        'BOOK_RIGHTS': info.get('rights', ''),
+        'HAS_CONCLUSION': structure.get('has_conclusion', False),
+        'COVER_IMAGE': structure.get('cover_image', '') or '',
+        'EPUB_CSS': styles.get('epub_css', 'styles/ebook_styles.css'),
+        'PRINT_CSS': styles.get('print_css', 'styles/print_styles.css'),
+        'WORD_TEMPLATE': styles.get('word_template', 'styles/word_template.docx'),
+        'OUTPUT_DIR': config['output'].get('output_dir', 'output'),
+        'OUTPUT_PATH': out_dir,
+        'OUTPUT_FILE': out_dir / output_filename(config, args.format),
+        'CHAPTER_COUNT': len(book.chapters()),
+    }
+    if args.check_cache:
+        from build_cache import format_inputs, inputs_digest, is_up_to_date
+        variant = os.environ.get('BUILD_VARIANT') or None
+        # Hashed before the build; cache record stores this digest, not one taken after rendering
+        digest = inputs_digest(format_inputs(book.project_root, config, args.format, variant))
+        fresh = is_up_to_date(book.project_root, config, args.format, values['OUTPUT_FILE'], variant, digest)
+        values['UP_TO_DATE'] = 'true' if fresh else 'false'
+        values['INPUTS_HASH'] = digest
+
+    font_files = None
+    if args.prepare and (args.force or values.get('UP_TO_DATE') != 'true'):
+        prepared, font_files = prepare_format(book, args.format)
+        values.update(prepared)
+
+    print('\n'.join(shell_assignments(values)))
+    if font_files is not None:
+        print(f"FONT_FILES=({' '.join(shlex.quote(str(path)) for path in font_files)})")
+    return 0
+
+def prepare_format(book, fmt):
+    """
+    Make what a format's pandoc run needs besides the manuscript.
+
+    Progress and failures go to stderr; a failed step leaves its value
+    empty so the script falls back to the originals.
+
+    Returns:
+        Tuple of (shell values, font files or None if the format embeds none)
+    """
+    from subset_fonts import STYLESHEETS
+
+    log = lambda message: print(message, file=sys.stderr)
+    values = {}
+    font_files = None
+    if fmt == 'epub':
+        values['COVER_PATH'] = ''
+    if fmt in STYLESHEETS:
+        values['FONT_CSS'] = ''
+        font_files = []
+    if fmt == 'word':
+        values['REFERENCE_DOC'] = ''
+
+    try:
+        manuscript = book.manuscript()
+    except FileNotFoundError:
+        # The script reports the missing chapters
+        return values, font_files
+
+    log("   → Optimizing images...")
+    with book.stage('images'):
+        from optimize_images import apply_images, prepare_images
+        try:
+            derivatives = prepare_images(book.project_root, book.config, manuscript, [fmt], log=log)
+        except Exception as e:
+            log(f"   ⚠️  Image optimization failed ({e}); using original images")
+            derivatives = {}
+    if fmt == 'epub':
+        config, _ = apply_images(book.config, manuscript, derivatives.get('epub'))
+        values['COVER_PATH'] = config['structure'].get('cover_image', '') or ''
+
+    if fmt in STYLESHEETS:
+        with book.stage('fonts'):
+            from subset_fonts import prepare_fonts
+            try:
+                stylesheet, font_files = prepare_fonts(book.project_root, book.config, manuscript, [fmt],
+                                                       log=log).get(fmt, ('', []))
+                values['FONT_CSS'] = stylesheet
+            except Exception as e:
+                log(f"   ⚠️  Font subsetting failed ({e}); using the stylesheet as is")
+
+    if fmt == 'word':
+        with book.stage('word_reference'):
+            from word_reference import reference_doc
+            try:
+                values['REFERENCE_DOC'] = reference_doc(book.project_root, book.config, log=log) or ''
+            except Exception as e:
+                log(f"❌ Error compiling Word reference document: {e}")
+
+    return values, font_files
+
+def cmd_detect(book, args):
+    chapters = book.chapters()
+    if not chapters:
+        print("No chapters found", file=sys.stderr)
+        return 1
+    print('\n'.join(chapters))
+    return 0
+
+def cmd_sanitize(book, args):
+    from sanitize_filename import sanitize_filename
+    title = ' '.join(args.title) if args.title else sys.stdin.read().strip()
+    print(sanitize_filename(title))
+    return 0
+
+def cmd_assemble(book, args):
+    from manuscript import STREAMS, write_stream
+
+    try:
+        manuscript = book.manuscript()
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    config = book.config
+    derivatives = None
+    if args.optimize_images:
+        # The generate scripts report on the images in their own stage first
+        from optimize_images import prepare_images
+        derivatives = prepare_images(book.project_root, config, manuscript, [args.format],
+                                     log=lambda message: None).get(args.format)
+
+    if args.ast:
+        from pandoc_ast import iter_ast, parse_manuscript
+        try:
+            parsed = parse_manuscript(book.project_root, config, manuscript, log=lambda message: None)
+        except (OSError, RuntimeError) as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 1
+        chunks = iter_ast(args.format, parsed, derivatives[0] if derivatives else None)
+    else:
+        from optimize_images import apply_images
+        config, manuscript = apply_images(config, manuscript, derivatives)
+        chunks = STREAMS[args.format](manuscript, config)
+
+    try:
+        write_stream(chunks, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        # The reader (pandoc) exited early; it reports its own error
+        return 1
+    return 0
+
+def cmd_images(book, args):
+    from optimize_images import apply_images, prepare_images
+
+    formats = args.formats
+    if args.cover:
+        # stdout is the cover path; progress goes to stderr
+        formats = formats or ['epub']
+        log = lambda message: print(message, file=sys.stderr)
+    else:
+        formats = formats or list(FORMATS)
+        log = print
+
+    try:
+        manuscript = book.manuscript()
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    derivatives = prepare_images(book.project_root, book.config, manuscript, formats, args.jobs, log=log)
+    if args.cover:
+        config, _ = apply_images(book.config, manuscript, derivatives.get('epub'))
+        print(config['structure'].get('cover_image', '') or '')
+    return 0
+
+def cmd_fonts(book, args):
+    from subset_fonts import prepare_fonts
+
+    try:
+        manuscript = book.manuscript()
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    # stdout is shell assignments; progress goes to stderr
+    fonts = prepare_fonts(book.project_root, book.config, manuscript, [args.format], args.jobs,
+                          log=lambda message: print(message, file=sys.stderr))
+    stylesheet, files = fonts.get(args.format, ('', []))
+    print('\n'.join(shell_assignments({'FONT_CSS': stylesheet})))
+    print(f"FONT_FILES=({' '.join(shlex.quote(str(path)) for path in files)})")
+    return 0
+
+def cmd_word_reference(book, args):
+    from word_reference import reference_doc
+
+    try:
+        path = reference_doc(book.project_root, book.config,
+                             log=lambda message: print(message, file=sys.stderr))
+    except Exception as e:
+        print(f"❌ Error compiling Word reference document: {e}", file=sys.stderr)
+        return 1
+
+    if path is None:
+        return 1
+    print(path)
+    return 0
+
+def cmd_fix_epub(book, args):
+    from epub_archive import deflate_level
+    from fix_epub_links import rewrite_epub
+
+    if not args.epub.exists():
+        print(f"❌ EPUB file not found: {args.epub}")
+        return 1
+    rewrite_epub(args.epub, level=deflate_level(book.config))
+    return 0
+
+def cmd_format_word(book, args):
+    from importlib.util import find_spec
+    if find_spec('docx') is None:
+        print("❌ python-docx not installed. Install with: pip install python-docx", file=sys.stderr)
+        return 1
+    from format_word import format_word_document, load_rules
+
+    config = book.config if book.config_file.is_file() else None
+    return format_word_document(str(args.document), load_rules(config), stream=args.stream)
+
+def cmd_validate(book, args):
+    from validate_epub import validate_epub
+    return validate_epub(args.epub, epubcheck=args.epubcheck, use_cache=not args.no_cache)
+
+def cmd_lint(book, args):
+    from lint_manuscript import lint_manuscript
+
+    print("🔎 Linting manuscript...")
+    try:
+        issues = lint_manuscript(book.project_root, book.config, args.jobs, use_cache=not args.no_cache)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 1 if any(issue[0] == 'error' or args.strict for issue in issues) else 0
+
+def cmd_cache(book, args):
+    from build_cache import format_inputs, inputs_digest, is_up_to_date, record_build
+
+    variant = os.environ.get('BUILD_VARIANT') or None
+    if args.action == 'check':
+        return 0 if is_up_to_date(book.project_root, book.config, args.format, args.output_file, variant) else 1
+
+    from artifact_store import record_artifact
+    from build_trace import load_records
+
+    inputs = format_inputs(book.project_root, book.config, args.format, variant)
+    inputs_hash = record_build(book.project_root, book.config, args.format, args.output_file, inputs,
+                               inputs_hash=args.inputs_hash)
+    if inputs_hash != inputs_digest(inputs):
+        print("   ⚠️  Inputs changed during the build; the next build will redo it")
+    # The script's stages so far are this build's timings
+    stages = load_records(book.trace_file) if book.trace_file else []
+    elapsed = time.time() - min(stage['start'] for stage in stages) if stages else None
+    record_artifact(book.project_root, book.config, args.format, args.output_file,
+                    inputs_hash=inputs_hash, elapsed=elapsed, stages=stages)
+    return 0
+
+def parse_formats(value):
+    """Parse a comma-separated format list"""
+    formats = [fmt.strip() for fmt in value.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown format(s): {', '.join(unknown)}")
+    return formats
+
+def command_parser():
+    """Parser for one command of a chain"""
+    parser = argparse.ArgumentParser(prog="book.py", add_help=False)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def command(name, handler, stage, help):
+        sub = subparsers.add_parser(name, help=help)
+        sub.set_defaults(handler=handler, stage=stage)
+        return sub
+
+    sub = command('config', cmd_config, 'config', "Print shell assignments for a generate script")
+    sub.add_argument('format', choices=FORMATS)
+    sub.add_argument('--check-cache', action='store_true',
+                     help="Also set UP_TO_DATE and INPUTS_HASH from the build cache")
+    sub.add_argument('--prepare', action='store_true',
+                     help="Also make the format's images, fonts and Word reference document (unless up to date)")
+    sub.add_argument('--force', action='store_true',
+                     help="With --prepare, prepare even if the build cache says the format is up to date")
+
+    command('detect', cmd_detect, 'detect_chapters', "List chapter files in reading order")
+
+    sub = command('sanitize', cmd_sanitize, 'sanitize', "Print a title as a safe filename")
+    sub.add_argument('title', nargs='*', help="Title (default: read from stdin)")
+
+    sub = command('assemble', cmd_assemble, 'manuscript', "Stream the manuscript to stdout")
+    sub.add_argument('format', choices=FORMATS)
+    sub.add_argument('--optimize-images', action='store_true',
+                     help="Point image references at the format's optimized derivatives")
+    sub.add_argument('--ast', action='store_true',
+                     help="Write pandoc's JSON AST, parsed once per file and cached, for pandoc --from=json")
+
+    sub = command('images', cmd_images, 'images', "Make the image derivatives for each format")
+    sub.add_argument('--formats', type=parse_formats, default=None,
+                     help="Comma-separated formats (default: epub,pdf,word; epub with --cover)")
+    sub.add_argument('--jobs', '-j', type=int, default=None,
+                     help="Number of worker processes (default: CPU count)")
+    sub.add_argument('--cover', action='store_true',
+                     help="Print the EPUB cover to use (the derivative, or the original)")
+
+    sub = command('fonts', cmd_fonts, 'fonts', "Subset the fonts a format's stylesheet embeds")
+    sub.add_argument('format', choices=('epub', 'pdf'))
+    sub.add_argument('--jobs', '-j', type=int, default=None,
+                     help="Number of worker processes (default: CPU count)")
+
+    command('word-reference', cmd_word_reference, 'word_reference',
+            "Print the path of the compiled reference.docx")
+
+    sub = command('fix-epub', cmd_fix_epub, 'fix_epub_links', "Fix EPUB navigation and package files")
+    sub.add_argument('epub', type=Path)
+
+    sub = command('format-word', cmd_format_word, 'format_word', "Apply print formatting to a Word document")
+    sub.add_argument('document', type=Path)
+    sub.add_argument('--stream', dest='stream', action='store_true', default=None,
+                     help="Stream the document body instead of loading it whole (default: only for huge documents)")
+    sub.add_argument('--no-stream', dest='stream', action='store_false',
+                     help="Always load the whole document")
+
+    sub = command('validate', cmd_validate, 'validate_epub', "Validate an EPUB")
+    sub.add_argument('epub', type=Path)
+    sub.add_argument('--epubcheck', action='store_true',
+                     help="Also run epubcheck as a deep check (if installed)")
+    sub.add_argument('--no-cache', action='store_true',
+                     help="Validate even if this exact file was validated before")
+
+    sub = command('lint', cmd_lint, 'lint', "Check the manuscript's links, images, ids and headings")
+    sub.add_argument('--jobs', '-j', type=int, default=None,
+                     help="Number of worker processes (default: CPU count)")
+    sub.add_argument('--no-cache', action='store_true', help="Scan every file even if unchanged")
+    sub.add_argument('--strict', action='store_true', help="Exit non-zero on warnings too")
+
+    sub = command('cache', cmd_cache, None, "Check or record a build in the build cache")
+    sub.add_argument('action', choices=('check', 'record'))
+    sub.add_argument('format', choices=FORMATS)
+    sub.add_argument('output_file', type=Path)
+    sub.add_argument('--inputs-hash', default=None,
+                     help="Inputs digest taken before the build (INPUTS_HASH from config --check-cache)")
+
+    return parser
+
+def split_chain(argv):
+    """Split a command line into one argument list per chained command"""
+    chain = [[]]
+    for arg in argv:
+        if arg == CHAIN_SEPARATOR:
+            chain.append([])
+        else:
+            chain[-1].append(arg)
+    return chain
+
+def _run(book, args):
+    """Run a command's handler, turning errors into an exit code like a separate process would"""
+    try:
+        return args.handler(book, args)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(f"❌ {args.command}: {e}", file=sys.stderr)
+        return 1
+
+def run_command(book, args, trace_file=None):
+    """
+    Run one parsed command, recording it as a trace stage if trace_file is set.
+
+    Returns:
+        The command's exit code
+    """
+    if trace_file is None:
+        return _run(book, args)
+
+    from build_trace import append_record
+
+    stage = args.stage or f"build cache {args.action}"
+    with book.tracer.stage(stage, category='process') as record:
+        status = _run(book, args)
+        record['exit_code'] = status
+    append_record(trace_file, record)
+    return status
+
+def main(argv=None):
+    """CLI interface"""
+    parser = argparse.ArgumentParser(
+        description="Book build tools. Chain commands with '+' to run them in one process.",
+        usage="%(prog)s [--project DIR] [--config FILE] [--trace FILE] <command> [args] [+ <command> [args]]...",
+        epilog="commands: config, detect, sanitize, assemble, images, fonts, word-reference, "
+               "fix-epub, format-word, validate, lint, cache (book.py <command> --help for details)")
+    parser.add_argument('--project', default=str(PROJECT_ROOT),
+                        help="Project root (default: the engine directory)")
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project>/config.yaml)")
+    parser.add_argument('--trace', default=None,
+                        help="Append a stage record per command to this JSON-lines trace")
+    parser.add_argument('commands', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    if not args.commands:
+        parser.error("no command given")
+
+    # Parse the whole chain up front so a typo fails before anything runs
+    commands = command_parser()
+    chain = []
+    for command_args in split_chain(args.commands):
+        if not command_args:
+            parser.error(f"empty command in chain (stray '{CHAIN_SEPARATOR}')")
+        chain.append(commands.parse_args(command_args))
+
+    book = Book(args.project, args.config, args.trace)
+    status = 0
+    for command in chain:
+        result = run_command(book, command, args.trace)
+        status = status or result
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
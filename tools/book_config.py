@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Shared config loading and output naming for the Python build tools.
+"""
+
+import os
+from pathlib import Path
+
+import yaml
+
+from sanitize_filename import sanitize_filename
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+FORMATS = ('epub', 'pdf', 'word')
+
+FORMAT_LABELS = {
+    'epub': 'EPUB',
+    'pdf': 'PDF',
+    'word': 'Word',
+}
+
+# Suffix appended to the sanitized title when no filename is configured
+FILENAME_SUFFIXES = {
+    'epub': '_Professional.epub',
+    'pdf': '_Print_Professional.pdf',
+    'word': '_Print_Professional.docx',
+}
+
+FRONT_MATTER_FILES = [
+    'title_page.md',
+    'copyright_page.md',
+    'dedication.md',
+    'table_of_contents.md',
+    'preface.md',
+]
+
+def load_config(config_file):
+    """
+    Load config.yaml.
+
+    Args:
+        config_file: Path to config file
+
+    Returns:
+        Config dictionary (empty sections default to {})
+    """
+    with open(config_file, 'r') as f:
+        config = yaml.safe_load(f) or {}
+
+    for section in ('book', 'structure', 'output', 'styles', 'word_format', 'images', 'fonts'):
+        if not config.get(section):
+            config[section] = {}
+
+    return config
+
+def output_filename(config, fmt):
+    """
+    Get output filename for a format from config or generate from title.
+
+    Args:
+        config: Config dictionary
+        fmt: One of FORMATS
+
+    Returns:
+        Output filename (no directory)
+    """
+    configured = config['output'].get(f'{fmt}_filename', '')
+    if configured and configured != '""':
+        return os.path.basename(str(configured))
+
+    return sanitize_filename(str(config['book'].get('title', ''))) + FILENAME_SUFFIXES[fmt]
+
+def output_dir(project_root, config):
+    """Output directory for a project"""
+    return Path(project_root) / config['output'].get('output_dir', 'output')
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+Build EPUB, PDF and Word outputs concurrently.
+Loads config and assembles the manuscript once, then renders each
+format in its own worker process.
+"""
+
+import os
+import sys
+import time
+import argparse
+import shutil
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from book_config import (PROJECT_ROOT, FORMATS, FORMAT_LABELS,
+                         load_config, output_filename, output_dir)
+from artifact_store import record_artifact
+from build_cache import format_inputs, inputs_digest, is_up_to_date, record_build
+from build_epub import build_epub
+from build_pdf import build_pdf, missing_dependencies
+from build_trace import Tracer, trace_path, wait_process
+from epub_archive import deflate_level
+from lint_manuscript import lint_manuscript
+from manuscript import STREAMS, load_manuscript, manuscript_texts, write_stream
+from optimize_images import apply_images, prepare_images
+from pandoc_ast import iter_ast, parse_manuscript
+from subset_fonts import prepare_fonts
+from validate_epub import validate_epub
+from word_reference import reference_doc
+
+# Post-processing tools run from the engine, not from the book project
+TOOLS_DIR = Path(__file__).resolve().parent
+
+def _metadata_args(book, keys):
+    """Build pandoc --metadata arguments"""
+    args = []
+    for key in keys:
+        value = book.get(key, 'en-US' if key == 'language' else '')
+        args += ['--metadata', f'{key}={value}']
+    return args
+
+def _source(fmt, manuscript, config, options):
+    """pandoc reader and input: the shared AST when it was parsed, else the assembled Markdown"""
+    if options.get('ast'):
+        return '--from=json', iter_ast(fmt, options['ast'], options.get('image_references'))
+    return '--from=markdown', STREAMS[fmt](manuscript, config)
+
+def _run(cmd, log, chunks=None, tracer=None, stage=None):
+    """
+    Run a command, appending its output to log.
+
+    Args:
+        cmd: Command and arguments
+        log: List collecting output lines
+        chunks: Optional iterable of text streamed to the command's stdin
+        tracer: Tracer that records the command's wall/CPU time, RSS and I/O
+        stage: Stage name for the trace (default: the command name)
+
+    Returns:
+        Exit code
+    """
+    start = time.time()
+    wall_start = time.perf_counter()
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE if chunks is not None else subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except FileNotFoundError:
+        log.append(f"❌ Command not found: {cmd[0]}")
+        return 127
+
+    # Drain output in the background so a chatty command cannot block our writes
+    output = []
+    reader = threading.Thread(target=lambda: output.append(process.stdout.read()))
+    reader.start()
+
+    if chunks is not None:
+        try:
+            write_stream(chunks, process.stdin)
+        except BrokenPipeError:
+            pass  # The command exited early; its exit code says why
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    reader.join()
+    returncode, usage = wait_process(process)
+    if tracer is not None:
+        tracer.record(stage or os.path.basename(cmd[0]), start, time.perf_counter() - wall_start,
+                      usage, pid=process.pid, exit_code=returncode)
+
+    text = b''.join(output).decode('utf-8', errors='replace').rstrip()
+    if text:
+        log.append(text)
+    return returncode
+
+def _run_if_available(command, args, log, message, tracer=None):
+    """Run an optional tool. Returns None if it is not installed."""
+    if shutil.which(command) is None:
+        return None
+    log.append(message)
+    return _run([command] + args, log, tracer=tracer)
+
+def _validate_epub(output_file, log, options):
+    """Native structural check (cached by content hash), plus epubcheck if requested"""
+    log.append("   → Validating EPUB...")
+    with options['tracer'].stage('validate_epub') as stage:
+        stage['bytes_in'] = os.path.getsize(output_file)
+        status = validate_epub(output_file, epubcheck=options.get('epubcheck', False),
+                               log=lambda message: log.append(f"   {message}"))
+    if status != 0:
+        log.append("   ⚠️  Validation found issues")
+
+def render_epub(project_root, config, manuscript, output_file, work_dir, log, options):
+    """Convert assembled Markdown to EPUB, then fix links and validate"""
+    tracer = options['tracer']
+    if options.get('per_chapter'):
+        # Sections come from the per-chapter cache; the package needs no link fixing
+        log.append("   → Converting sections to EPUB...")
+        with tracer.stage('build_epub') as stage:
+            build_epub(project_root, config, output_file, manuscript, log=log.append,
+                       fonts=options.get('fonts'))
+            stage['bytes_out'] = os.path.getsize(output_file)
+        _validate_epub(output_file, log, options)
+        return True
+
+    book = config['book']
+    reader, chunks = _source('epub', manuscript, config, options)
+    # Images are referenced relative to the project, whatever the working directory
+    cmd = ['pandoc', reader, '-o', str(output_file), f'--resource-path={project_root}']
+
+    cover_image = config['structure'].get('cover_image', '')
+    if cover_image and cover_image != '""' and (project_root / cover_image).is_file():
+        cmd.append(f'--epub-cover-image={project_root / cover_image}')
+
+    css_path = project_root / config['styles'].get('epub_css', 'styles/ebook_styles.css')
+    if options.get('fonts'):
+        # The stylesheet copy whose @font-face rules point at the embedded subsets
+        css_path, fonts = options['fonts']
+        cmd += [f'--epub-embed-font={font}' for font in fonts]
+    cmd += [f'--css={css_path}', '--toc', '--toc-depth=3', '--epub-chapter-level=2']
+    cmd += _metadata_args(book, ['title', 'subtitle', 'publisher', 'date',
+                                 'language', 'description', 'rights'])
+
+    log.append("   → Converting to EPUB...")
+    if _run(cmd, log, chunks, tracer, 'pandoc') != 0:
+        return False
+
+    fix_tool = TOOLS_DIR / "fix_epub_links.py"
+    if fix_tool.is_file():
+        log.append("   → Fixing EPUB links...")
+        if _run([sys.executable, str(fix_tool), str(output_file), '--level', str(deflate_level(config))],
+                log, tracer=tracer, stage='fix_epub_links') != 0:
+            log.append("   ⚠️  Link fixing failed (continuing...)")
+
+    _validate_epub(output_file, log, options)
+
+    return True
+
+def render_pdf(project_root, config, manuscript, output_file, work_dir, log, options):
+    """Convert assembled Markdown to HTML, then to PDF with WeasyPrint"""
+    # The stylesheet copy whose @font-face rules point at the font subsets
+    stylesheet = options['fonts'][0] if options.get('fonts') else None
+    if options.get('per_chapter'):
+        missing = missing_dependencies()
+        if not missing:
+            # Chapters are laid out in parallel and stitched into one PDF
+            log.append("   → Rendering chapters to PDF...")
+            with options['tracer'].stage('build_pdf') as stage:
+                build_pdf(project_root, config, output_file, manuscript, log=log.append,
+                          stylesheet=stylesheet)
+                stage['bytes_out'] = os.path.getsize(output_file)
+            return True
+        log.append(f"   ⚠️  Chunked PDF rendering needs {', '.join(missing)}; rendering in one pass")
+
+    # Only the one-pass path runs the weasyprint command
+    if shutil.which('weasyprint') is None:
+        log.append("❌ WeasyPrint not found. Install with: pip install weasyprint")
+        return False
+
+    book = config['book']
+    html_file = Path(work_dir) / "temp_book.html"
+    css_path = stylesheet or project_root / config['styles'].get('print_css', 'styles/print_styles.css')
+
+    log.append("   → Converting to PDF...")
+    reader, chunks = _source('pdf', manuscript, config, options)
+    cmd = ['pandoc', reader, '-o', str(html_file), '--standalone']
+    cmd += _metadata_args(book, ['title', 'subtitle', 'publisher'])
+    if _run(cmd, log, chunks, options['tracer'], 'pandoc') != 0:
+        return False
+
+    # Resolve relative image paths against the project, not the scratch directory
+    cmd = ['weasyprint', str(html_file), str(output_file), '--base-url', f'{project_root}/',
+           '--stylesheet', str(css_path), '--presentational-hints']
+    return _run(cmd, log, tracer=options['tracer'], stage='weasyprint') == 0
+
+def render_word(project_root, config, manuscript, output_file, work_dir, log, options):
+    """
+    Convert assembled Markdown to DOCX.
+
+    The formatting rules are compiled into a cached reference.docx so
+    pandoc's output is final; format_word.py only runs as a fallback
+    when the reference document cannot be built.
+    """
+    book = config['book']
+    reader, chunks = _source('word', manuscript, config, options)
+    cmd = ['pandoc', reader, '-o', str(output_file), f'--resource-path={project_root}']
+
+    tracer = options['tracer']
+    try:
+        with tracer.stage('word_reference'):
+            reference = reference_doc(project_root, config, log=log.append)
+    except Exception as e:
+        log.append(f"⚠️  Could not compile Word reference document: {e}")
+        reference = None
+
+    if reference is not None:
+        cmd.append(f'--reference-doc={reference}')
+    else:
+        template_path = project_root / config['styles'].get('word_template', 'styles/word_template.docx')
+        if template_path.is_file():
+            cmd.append(f'--reference-doc={template_path}')
+        else:
+            log.append(f"⚠️  Word template not found: {template_path}")
+            log.append("   Continuing without template...")
+
+    cmd += ['--toc', '--toc-depth=3']
+    cmd += _metadata_args(book, ['title', 'subtitle', 'publisher', 'date'])
+
+    log.append("   → Converting to Word...")
+    if _run(cmd, log, chunks, tracer, 'pandoc') != 0:
+        return False
+
+    format_tool = TOOLS_DIR / "format_word.py"
+    if reference is None and format_tool.is_file():
+        log.append("   → Formatting Word document...")
+        cmd = [sys.executable, str(format_tool), str(output_file)]
+        if options.get('config_file'):
+            cmd += ['--config', str(options['config_file'])]
+        if _run(cmd, log, tracer=tracer, stage='format_word') != 0:
+            log.append("   ⚠️  Formatting failed (continuing...)")
+
+    return True
+
+RENDERERS = {
+    'epub': render_epub,
+    'pdf': render_pdf,
+    'word': render_word,
+}
+
+def build_format(fmt, project_root, config, manuscript, options):
+    """
+    Render a single format. Runs inside a worker process.
+
+    Args:
+        fmt: One of FORMATS
+        project_root: Project root directory
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript()
+        options: Build options (e.g. 'per_chapter'; 'ast' and
+            'image_references' to write from parse_manuscript()'s AST;
+            'fonts' from prepare_fonts())
+
+    Returns:
+        Tuple of (fmt, success, log lines, output path, elapsed seconds,
+        trace records)
+    """
+    start = time.monotonic()
+    project_root = Path(project_root)
+    log = []
+    tracer = Tracer(format=fmt)
+    options = dict(options, tracer=tracer)
+
+    out_dir = output_dir(project_root, config)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    output_file = out_dir / output_filename(config, fmt)
+
+    try:
+        # Each job gets its own scratch directory so formats never share temp files
+        with tempfile.TemporaryDirectory(prefix=f"book_{fmt}_") as work_dir:
+            success = RENDERERS[fmt](project_root, config, manuscript, output_file, work_dir, log, options)
+    except Exception as e:
+        log.append(f"❌ {e}")
+        success = False
+
+    return fmt, success, log, str(output_file), time.monotonic() - start, tracer.events
+
+def plan_formats(project_root, config, formats, force=False, per_chapter=False):
+    """
+    Split formats into up-to-date and stale ones.
+
+    Inputs are hashed before rendering so edits made mid-build invalidate
+    the cache.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        formats: Iterable of FORMATS
+        force: Treat every format as stale
+        per_chapter: The EPUB and PDF are built one chapter at a time
+
+    Returns:
+        Tuple of (up-to-date formats, {stale format: input hashes})
+    """
+    variants = {'epub': 'per-chapter', 'pdf': 'per-chapter'} if per_chapter else {}
+    fresh = []
+    inputs = {}
+    for fmt in formats:
+        output_file = output_dir(project_root, config) / output_filename(config, fmt)
+        # Hashed once: the digest decides freshness and is recorded after the build
+        fmt_inputs = format_inputs(project_root, config, fmt, variants.get(fmt))
+        if not force and is_up_to_date(project_root, config, fmt, output_file, variants.get(fmt),
+                                       inputs_digest(fmt_inputs)):
+            fresh.append(fmt)
+        else:
+            inputs[fmt] = fmt_inputs
+    return fresh, inputs
+
+def build(formats, jobs=None, project_root=PROJECT_ROOT, config_file=None, force=False,
+          per_chapter=False, tracer=None, epubcheck=False, lint=False):
+    """
+    Render the requested formats in a process pool.
+
+    Formats whose inputs are unchanged since the last recorded build are
+    skipped unless force is set.
+
+    Args:
+        formats: Iterable of FORMATS to build
+        jobs: Number of worker processes (default: one per format)
+        project_root: Project root directory
+        config_file: Path to config file (default: <project_root>/config.yaml)
+        force: Rebuild even if the build cache says a format is up to date
+        per_chapter: Build the EPUB from per-chapter cached conversions and
+            render the PDF one chapter at a time in parallel
+        tracer: Tracer collecting per-stage timings (default: not traced)
+        epubcheck: Also validate the EPUB with epubcheck (if installed)
+        lint: Lint the manuscript first and build nothing if it has errors
+
+    Returns:
+        Dictionary mapping format to success flag
+    """
+    tracer = tracer or Tracer()
+    project_root = Path(project_root)
+    config_file = Path(config_file) if config_file else project_root / "config.yaml"
+
+    if not config_file.exists():
+        print(f"❌ Config file not found: {config_file}", file=sys.stderr)
+        return {fmt: False for fmt in formats}
+
+    with tracer.stage('config') as stage:
+        config = load_config(config_file)
+        stage['bytes_in'] = config_file.stat().st_size
+    results = {}
+
+    with tracer.stage('build cache check'):
+        fresh, inputs = plan_formats(project_root, config, formats, force, per_chapter)
+    for fmt in fresh:
+        output_file = output_dir(project_root, config) / output_filename(config, fmt)
+        print(f"✅ {FORMAT_LABELS[fmt]} is up to date: {output_file}")
+        results[fmt] = True
+    formats = [fmt for fmt in formats if fmt in inputs]
+
+    if not formats:
+        return results
+    print()
+
+    if lint:
+        print("   → Linting manuscript...")
+        try:
+            with tracer.stage('lint'):
+                issues = lint_manuscript(project_root, config, jobs)
+        except FileNotFoundError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            issues = [('error', None, 0, str(e))]
+        if any(issue[0] == 'error' for issue in issues):
+            print("❌ Manuscript has errors; fix them or build without --lint", file=sys.stderr)
+            results.update({fmt: False for fmt in formats})
+            return results
+
+    print("   → Assembling manuscript...")
+    try:
+        with tracer.stage('manuscript') as stage:
+            manuscript = load_manuscript(project_root, config)
+            stage['bytes_in'] = sum(len(text.encode('utf-8')) for text in manuscript_texts(manuscript))
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        results.update({fmt: False for fmt in formats})
+        return results
+    print(f"   ✅ Found {len(manuscript['chapters'])} chapter(s)")
+
+    jobs = jobs or min(len(formats), os.cpu_count() or 1)
+    options = {'per_chapter': per_chapter, 'config_file': str(config_file),
+               'epubcheck': epubcheck}
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results.update(build_formats(executor, project_root, config, manuscript, inputs, options, tracer))
+
+    return results
+
+def build_formats(executor, project_root, config, manuscript, inputs, options, tracer):
+    """
+    Render formats on an existing process pool and record the successes.
+
+    Args:
+        executor: ProcessPoolExecutor to render in
+        project_root: Project root directory
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript()
+        inputs: {format to build: input hashes} from plan_formats()
+        options: Build options (e.g. 'per_chapter')
+        tracer: Tracer collecting per-stage timings
+
+    Returns:
+        Dictionary mapping format to success flag
+    """
+    project_root = Path(project_root)
+    formats = [fmt for fmt in FORMATS if fmt in inputs]
+    results = {}
+
+    # Each format gets its own resized images (and EPUB cover)
+    print("   → Optimizing images...")
+    with tracer.stage('images'):
+        derivatives = prepare_images(project_root, config, manuscript, formats)
+
+    # Fonts are subset once for every format that embeds them
+    fonts = {}
+    if any(fmt in ('epub', 'pdf') for fmt in formats):
+        with tracer.stage('fonts'):
+            fonts = prepare_fonts(project_root, config, manuscript, formats)
+
+    # pandoc reads each file once for every writer (per-chapter EPUB/PDF builds convert their own sections)
+    parsed = None
+    if any(fmt == 'word' or not options.get('per_chapter') for fmt in formats):
+        print("   → Parsing manuscript...")
+        try:
+            with tracer.stage('parse') as stage:
+                parsed = parse_manuscript(project_root, config, manuscript)
+                stage['bytes_in'] = sum(len(text.encode('utf-8')) for text in manuscript_texts(manuscript))
+        except (OSError, RuntimeError) as e:
+            print(f"   ⚠️  Could not parse the manuscript once for every format ({e}); "
+                  f"each format reads the Markdown itself")
+    print()
+
+    futures = []
+    for fmt in formats:
+        references = (derivatives.get(fmt) or ({}, None))[0]
+        futures.append(executor.submit(build_format, fmt, str(project_root),
+                                       *apply_images(config, manuscript, derivatives.get(fmt)),
+                                       dict(options, ast=parsed, image_references=references,
+                                            fonts=fonts.get(fmt))))
+    for future in as_completed(futures):
+        fmt, success, log, output_file, elapsed, events = future.result()
+        results[fmt] = success
+        tracer.extend(events)
+
+        label = FORMAT_LABELS[fmt]
+        print(f"━━━ {label} ━━━")
+        for line in log:
+            print(line)
+        if success:
+            record_build(project_root, config, fmt, output_file, inputs[fmt])
+            size_kb = os.path.getsize(output_file) // 1024 if os.path.exists(output_file) else 0
+            print(f"✅ {label} generation successful: {output_file} ({size_kb}KB, {elapsed:.1f}s)")
+            record_artifact(project_root, config, fmt, output_file, inputs_digest(inputs[fmt]),
+                            elapsed, events)
+        else:
+            print(f"❌ {label} generation failed ({elapsed:.1f}s)")
+        print()
+
+    return results
+
+def print_summary(results):
+    """Print per-format results. Returns exit code (0 unless every format failed)."""
+    print("📊 Generation Summary")
+    for fmt in FORMATS:
+        if fmt not in results:
+            continue
+        label = FORMAT_LABELS[fmt]
+        if results[fmt]:
+            print(f"✅ {label}: Generated successfully")
+        else:
+            print(f"❌ {label}: Generation failed")
+    print()
+
+    if results and all(results.values()):
+        print("🎉 All formats generated successfully!")
+        return 0
+    elif any(results.values()):
+        print("⚠️  Some formats generated successfully, but some failed")
+        return 0  # Partial success
+    else:
+        print("❌ All format generation failed")
+        return 1
+
+def parse_formats(value):
+    """Parse a comma-separated format list"""
+    formats = []
+    for fmt in value.split(','):
+        fmt = fmt.strip().lower()
+        if fmt == 'docx':
+            fmt = 'word'
+        if fmt not in FORMATS:
+            raise argparse.ArgumentTypeError(f"unknown format: {fmt} (choose from {', '.join(FORMATS)})")
+        if fmt not in formats:
+            formats.append(fmt)
+    return formats
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Build EPUB, PDF and Word outputs concurrently.")
+    parser.add_argument('--formats', type=parse_formats, default=list(FORMATS),
+                        help="Comma-separated formats to build (default: epub,pdf,word)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of worker processes (default: one per format)")
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild formats even if their inputs are unchanged")
+    parser.add_argument('--per-chapter', action='store_true',
+                        help="Build the EPUB and PDF one chapter at a time (cached, parallel)")
+    parser.add_argument('--epubcheck', action='store_true',
+                        help="Also validate the EPUB with epubcheck (slow; needs Java)")
+    parser.add_argument('--lint', action='store_true',
+                        help="Lint the manuscript first and stop on errors")
+    parser.add_argument('--chrome-trace', action='store_true',
+                        help="Also write the stage trace in Chrome trace format")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    tracer = Tracer()
+    results = build(args.formats, jobs=args.jobs, config_file=args.config, force=args.force,
+                    per_chapter=args.per_chapter, tracer=tracer, epubcheck=args.epubcheck,
+                    lint=args.lint)
+    exit_code = print_summary(results)
+
+    if tracer.events:
+        config_file = Path(args.config) if args.config else PROJECT_ROOT / "config.yaml"
+        out_dir = output_dir(PROJECT_ROOT, load_config(config_file))
+        trace_file = trace_path(out_dir, 'build')
+        tracer.write(trace_file, formats=args.formats)
+        if args.chrome_trace:
+            tracer.write(trace_path(out_dir, 'build', chrome=True), chrome=True)
+
+        print()
+        print("⏱️  Stage Timing")
+        for line in tracer.summary_lines():
+            print(line)
+        print(f"📋 Trace written to {trace_file}")
+
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
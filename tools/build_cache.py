@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Content-hash build cache.
+Records hashes of every input that feeds each output format in
+<output_dir>/.build-cache.json so unchanged formats can be skipped.
+"""
+
+import os
+import ast
+import sys
+import json
+import hashlib
+import functools
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from book_config import PROJECT_ROOT, FORMATS, FRONT_MATTER_FILES, load_config, output_dir
+from detect_chapters import detect_chapters
+from file_hash import hash_file
+from optimize_images import find_images, resolve_image
+from subset_fonts import stylesheet_fonts
+
+CACHE_FILENAME = ".build-cache.json"
+CACHE_VERSION = 1
+
+# Config fields read by each generate script
+CONFIG_FIELDS = {
+    'epub': [
+        ('book', 'title'), ('book', 'subtitle'), ('book', 'publisher'),
+        ('book', 'date'), ('book', 'language'), ('book', 'description'),
+        ('book', 'rights'), ('structure', 'has_conclusion'),
+        ('structure', 'appendices'), ('structure', 'cover_image'), ('output', 'output_dir'),
+        ('output', 'epub_filename'), ('output', 'epub_deflate_level'),
+        ('styles', 'epub_css'),
+        ('images', 'optimize'), ('images', 'epub_max_width'),
+        ('images', 'epub_max_height'), ('images', 'epub_quality'),
+        ('images', 'cover_max_width'), ('images', 'cover_max_height'),
+        ('images', 'cover_quality'), ('fonts', 'subset'),
+    ],
+    'pdf': [
+        ('book', 'title'), ('book', 'subtitle'), ('book', 'publisher'),
+        ('book', 'date'), ('structure', 'has_conclusion'),
+        ('structure', 'appendices'),
+        ('output', 'output_dir'), ('output', 'pdf_filename'),
+        ('styles', 'print_css'), ('images', 'optimize'),
+        ('images', 'print_dpi'), ('images', 'print_width'),
+        ('images', 'print_quality'), ('fonts', 'subset'),
+    ],
+    'word': [
+        ('book', 'title'), ('book', 'subtitle'), ('book', 'publisher'),
+        ('book', 'date'), ('structure', 'has_conclusion'),
+        ('structure', 'appendices'),
+        ('output', 'output_dir'), ('output', 'word_filename'),
+        ('styles', 'word_template'), ('word_format', 'page'),
+        ('word_format', 'styles'), ('word_format', 'first_paragraph_style'),
+        ('word_format', 'body_styles'), ('word_format', 'blockquote_style'),
+        ('images', 'optimize'),
+        ('images', 'print_dpi'), ('images', 'print_width'),
+        ('images', 'print_quality'),
+    ],
+}
+
+# Entry points each format is built through (in tools/); they and every tools/
+# module they import, directly or not, are the format's tools (see format_tools())
+FORMAT_ENTRY_POINTS = {
+    'epub': ['book.py', 'build_book.py', 'build_epub.py', 'fix_epub_links.py'],
+    'pdf': ['book.py', 'build_book.py', 'build_pdf.py'],
+    'word': ['book.py', 'build_book.py', 'format_word.py'],
+}
+
+def _local_imports(path):
+    """Top-level names of the modules a Python file imports, inside functions too"""
+    tree = ast.parse(Path(path).read_text(encoding='utf-8'), filename=str(path))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    return names
+
+@functools.lru_cache(maxsize=None)
+def format_tools(fmt):
+    """
+    List the engine files whose code shapes an output format.
+
+    The format's generate script, its entry points and every tools/ module
+    they import, followed through the imports (including the lazy ones
+    inside functions), so a tool is never left out of the build cache.
+
+    Args:
+        fmt: One of FORMATS
+
+    Returns:
+        Tuple of paths relative to the engine root
+    """
+    tools_dir = PROJECT_ROOT / "tools"
+    found = set()
+    todo = list(FORMAT_ENTRY_POINTS[fmt])
+    while todo:
+        name = todo.pop()
+        if name in found or not (tools_dir / name).is_file():
+            continue
+        found.add(name)
+        todo += [f"{module}.py" for module in _local_imports(tools_dir / name)]
+    return (f"scripts/generate_{fmt}.sh",) + tuple(f"tools/{name}" for name in sorted(found))
+
+def format_input_files(project_root, config, fmt):
+    """
+    List the files that feed an output format.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        fmt: One of FORMATS
+
+    Returns:
+        List of paths relative to project_root, in build order
+    """
+    project_root = Path(project_root)
+    structure = config['structure']
+    styles = config['styles']
+
+    files = [f"book_content/front_matter/{name}" for name in FRONT_MATTER_FILES]
+
+    for chapter in detect_chapters(str(project_root / "book_content" / "chapters")):
+        files.append(os.path.relpath(chapter, project_root))
+
+    files.append("book_content/chapters/conclusion.md")
+    files.append("book_content/back_matter/acknowledgments.md")
+    for name in structure.get('appendices') or []:
+        files.append(f"book_content/back_matter/{name}")
+
+    # Images the content references
+    for path in list(files):
+        try:
+            text = (project_root / path).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        for reference in find_images(text):
+            image = resolve_image(project_root, reference)
+            if image is not None and os.path.relpath(image, project_root) not in files:
+                files.append(os.path.relpath(image, project_root))
+
+    if fmt == 'epub':
+        files.append(styles.get('epub_css', 'styles/ebook_styles.css'))
+        cover_image = structure.get('cover_image', '')
+        if cover_image and cover_image != '""':
+            files.append(cover_image)
+    elif fmt == 'pdf':
+        files.append(styles.get('print_css', 'styles/print_styles.css'))
+    elif fmt == 'word':
+        files.append(styles.get('word_template', 'styles/word_template.docx'))
+
+    # Fonts the stylesheet embeds
+    for font in stylesheet_fonts(project_root, config, fmt):
+        if os.path.relpath(font, project_root) not in files:
+            files.append(os.path.relpath(font, project_root))
+
+    return files
+
+def config_digest(config, fmt):
+    """Hash the config fields an output format depends on"""
+    values = {}
+    for section, key in CONFIG_FIELDS[fmt]:
+        values[f"{section}.{key}"] = config[section].get(key)
+    encoded = json.dumps(values, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def format_inputs(project_root, config, fmt, variant=None):
+    """
+    Hash every input of an output format.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        fmt: One of FORMATS
+        variant: Build mode that changes the output (e.g. 'per-chapter')
+
+    Returns:
+        Dictionary mapping input name to content hash (None if missing)
+    """
+    project_root = Path(project_root)
+    inputs = {path: hash_file(project_root / path)
+              for path in format_input_files(project_root, config, fmt)}
+    # Tools come from the engine, which may be shared by many book projects
+    for path in format_tools(fmt):
+        inputs[path] = hash_file(PROJECT_ROOT / path)
+    inputs['config.yaml'] = config_digest(config, fmt)
+    if variant:
+        inputs['variant'] = variant
+    return inputs
+
+def inputs_digest(inputs):
+    """Combine per-input hashes into a single digest"""
+    encoded = json.dumps(inputs, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def cache_path(project_root, config):
+    """Path of the build manifest for a project"""
+    return output_dir(project_root, config) / CACHE_FILENAME
+
+def load_manifest(path):
+    """Load the build manifest, or an empty one if missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'version': CACHE_VERSION, 'formats': {}}
+
+    if manifest.get('version') != CACHE_VERSION:
+        return {'version': CACHE_VERSION, 'formats': {}}
+    manifest.setdefault('formats', {})
+    return manifest
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock on <path>.lock while a file is read and rewritten.
+
+    Builds of different formats can run at once and each rewrites the
+    whole file, so the load and save must not interleave. Without fcntl
+    (Windows) this does not lock.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(path.with_name(path.name + ".lock"), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def save_manifest(path, manifest):
+    """Write the build manifest atomically"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(temp_path, path)
+
+def is_up_to_date(project_root, config, fmt, output_file, variant=None, inputs_hash=None):
+    """
+    Check whether an output was built from the current inputs.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        fmt: One of FORMATS
+        output_file: Path to the generated output
+        variant: Build mode that changes the output (e.g. 'per-chapter')
+        inputs_hash: Digest of the current inputs, if already taken
+
+    Returns:
+        True if the output exists and no input changed since it was recorded
+    """
+    entry = load_manifest(cache_path(project_root, config))['formats'].get(fmt)
+    if not entry:
+        return False
+
+    # Cheap checks first: the output must still be the file we recorded
+    try:
+        stat = os.stat(output_file)
+    except FileNotFoundError:
+        return False
+    if entry.get('output') != os.path.basename(output_file):
+        return False
+    if entry.get('output_size') != stat.st_size or entry.get('output_mtime_ns') != stat.st_mtime_ns:
+        return False
+
+    if inputs_hash is None:
+        inputs_hash = inputs_digest(format_inputs(project_root, config, fmt, variant))
+    return entry.get('inputs_hash') == inputs_hash
+
+def record_build(project_root, config, fmt, output_file, inputs=None, variant=None, inputs_hash=None):
+    """
+    Record a successful build in the manifest.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        fmt: One of FORMATS
+        output_file: Path to the generated output
+        inputs: Input hashes taken before the build (default: hash now)
+        variant: Build mode that changes the output (e.g. 'per-chapter')
+        inputs_hash: Digest of the inputs taken before the build, when
+            only the digest was kept (the generate scripts); an input
+            edited during the build then leaves the output stale
+
+    Returns:
+        The recorded inputs digest
+    """
+    if inputs is None:
+        inputs = format_inputs(project_root, config, fmt, variant)
+    if inputs_hash is None:
+        inputs_hash = inputs_digest(inputs)
+
+    path = cache_path(project_root, config)
+    stat = os.stat(output_file)
+    with locked(path):
+        manifest = load_manifest(path)
+        manifest['formats'][fmt] = {
+            'output': os.path.basename(output_file),
+            'output_size': stat.st_size,
+            'output_mtime_ns': stat.st_mtime_ns,
+            'inputs_hash': inputs_hash,
+            'inputs': inputs,
+            'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        save_manifest(path, manifest)
+    return inputs_hash
+
+def main():
+    """
+    CLI interface:
+        build_cache.py check <format> <output_file>   exit 0 if up to date, 1 if stale
+        build_cache.py record <format> <output_file>  record a successful build
+
+    Set BUILD_VARIANT (e.g. per-chapter) when the build mode changes the output,
+    and INPUTS_HASH to the digest taken before the build when recording.
+    """
+    if len(sys.argv) < 4 or sys.argv[1] not in ('check', 'record') or sys.argv[2] not in FORMATS:
+        print("Usage: build_cache.py check|record <epub|pdf|word> <output_file> [project_root]",
+              file=sys.stderr)
+        return 2
+
+    command, fmt, output_file = sys.argv[1:4]
+    project_root = Path(sys.argv[4]) if len(sys.argv) > 4 else PROJECT_ROOT
+    config = load_config(project_root / "config.yaml")
+
+    variant = os.environ.get('BUILD_VARIANT') or None
+
+    if command == 'check':
+        return 0 if is_up_to_date(project_root, config, fmt, output_file, variant) else 1
+
+    record_build(project_root, config, fmt, output_file, variant=variant,
+                 inputs_hash=os.environ.get('INPUTS_HASH') or None)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Build many book projects at once.
+Schedules every (book, format) job across one process pool. Each job
+renders in its own scratch directory, and a JSON summary records the
+status, timing and output size of every job.
+
+Usage: build_catalog.py <project>... [--formats epub,pdf] [--jobs N] [--summary file]
+
+Each <project> is a book project (a directory with config.yaml), a
+directory whose subdirectories are book projects, or a text file listing
+project directories one per line.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from book_config import FORMATS, FORMAT_LABELS, load_config, output_filename, output_dir
+from build_book import build_format, parse_formats, plan_formats
+from artifact_store import record_artifact
+from build_cache import inputs_digest, record_build
+from manuscript import load_manuscript
+from optimize_images import apply_images, prepare_images
+from pandoc_ast import parse_manuscript
+from subset_fonts import prepare_fonts
+
+SUMMARY_FILENAME = "catalog-summary.json"
+
+def find_projects(paths):
+    """
+    Expand command-line paths into book project directories.
+
+    Args:
+        paths: Project directories, catalog directories or list files
+
+    Returns:
+        List of resolved project directories, without duplicates
+    """
+    projects = []
+
+    def add(path):
+        path = path.resolve()
+        if path not in projects:
+            projects.append(path)
+
+    for path in map(Path, paths):
+        if path.is_file():
+            base = path.parent
+            for line in path.read_text(encoding='utf-8').splitlines():
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    add(base / line)
+        elif (path / "config.yaml").is_file():
+            add(path)
+        elif path.is_dir():
+            for child in sorted(path.iterdir()):
+                if (child / "config.yaml").is_file():
+                    add(child)
+        else:
+            print(f"⚠️  Not a book project: {path}", file=sys.stderr)
+
+    return projects
+
+def _job_record(project_root, config, fmt, status, elapsed=0.0, output_file=None):
+    """Summary entry for one (book, format) job"""
+    output_file = output_file or output_dir(project_root, config) / output_filename(config, fmt)
+    return {
+        'book': str(project_root),
+        'title': str(config['book'].get('title', '')),
+        'format': fmt,
+        'status': status,
+        'elapsed': round(elapsed, 3),
+        'output': str(output_file),
+        'output_size': os.path.getsize(output_file) if status != 'failed' and os.path.exists(output_file) else None,
+    }
+
+def build_catalog(projects, formats, jobs=None, force=False, per_chapter=False, epubcheck=False):
+    """
+    Build every format of every project in one process pool.
+
+    Args:
+        projects: List of project directories
+        formats: Formats to build for each project
+        jobs: Number of worker processes (default: CPU count)
+        force: Rebuild even if the build cache says a format is up to date
+        per_chapter: Build EPUBs and PDFs one chapter at a time
+        epubcheck: Also validate EPUBs with epubcheck (if installed)
+
+    Returns:
+        List of job summary dictionaries
+    """
+    records = []
+    pending = []
+
+    # Planning reads configs and manuscripts in this process; rendering runs in workers
+    for project_root in projects:
+        config_file = project_root / "config.yaml"
+        try:
+            config = load_config(config_file)
+        except Exception as e:
+            print(f"❌ {project_root}: could not load config: {e}", file=sys.stderr)
+            records += [{'book': str(project_root), 'title': '', 'format': fmt, 'status': 'failed',
+                         'elapsed': 0.0, 'output': None, 'output_size': None} for fmt in formats]
+            continue
+
+        fresh, inputs = plan_formats(project_root, config, formats, force, per_chapter)
+        records += [_job_record(project_root, config, fmt, 'skipped') for fmt in fresh]
+        if not inputs:
+            continue
+
+        try:
+            manuscript = load_manuscript(project_root, config)
+        except FileNotFoundError as e:
+            print(f"❌ {project_root}: {e}", file=sys.stderr)
+            records += [_job_record(project_root, config, fmt, 'failed') for fmt in inputs]
+            continue
+
+        derivatives = prepare_images(project_root, config, manuscript, list(inputs),
+                                     log=lambda message: print(f"   {project_root.name}: {message.strip()}"))
+        fonts = prepare_fonts(project_root, config, manuscript, list(inputs),
+                              log=lambda message: print(f"   {project_root.name}: {message.strip()}"))
+
+        # One pandoc read of each file, shared by the book's formats
+        parsed = None
+        if any(fmt == 'word' or not per_chapter for fmt in inputs):
+            try:
+                parsed = parse_manuscript(project_root, config, manuscript,
+                                          log=lambda message: print(f"   {project_root.name}: {message.strip()}"))
+            except (OSError, RuntimeError) as e:
+                print(f"⚠️  {project_root}: could not parse the manuscript once ({e})", file=sys.stderr)
+
+        options = {'per_chapter': per_chapter, 'config_file': str(config_file),
+                   'epubcheck': epubcheck, 'ast': parsed}
+        for fmt in formats:
+            if fmt in inputs:
+                references = (derivatives.get(fmt) or ({}, None))[0]
+                pending.append((project_root, config, *apply_images(config, manuscript, derivatives.get(fmt)),
+                                dict(options, image_references=references, fonts=fonts.get(fmt)),
+                                fmt, inputs[fmt]))
+
+    if not pending:
+        return records
+
+    jobs = jobs or min(len(pending), os.cpu_count() or 1)
+    print(f"   → Building {len(pending)} job(s) across {len(projects)} book(s) with {jobs} worker(s)")
+    print()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(build_format, fmt, str(project_root), fmt_config, manuscript, options):
+                (project_root, config, inputs)
+            for project_root, config, fmt_config, manuscript, options, fmt, inputs in pending
+        }
+        for future in as_completed(futures):
+            project_root, config, inputs = futures[future]
+            fmt, success, log, output_file, elapsed, events = future.result()
+
+            title = config['book'].get('title', '') or project_root.name
+            label = FORMAT_LABELS[fmt]
+            print(f"━━━ {title} · {label} ━━━")
+            for line in log:
+                print(line)
+            if success:
+                record_build(project_root, config, fmt, output_file, inputs)
+                print(f"✅ {label} generation successful: {output_file} ({elapsed:.1f}s)")
+                record_artifact(project_root, config, fmt, output_file, inputs_digest(inputs), elapsed, events)
+            else:
+                print(f"❌ {label} generation failed ({elapsed:.1f}s)")
+            print()
+
+            record = _job_record(project_root, config, fmt, 'built' if success else 'failed',
+                                 elapsed, output_file)
+            record['stages'] = {event['name']: round(event['wall'], 3) for event in events}
+            records.append(record)
+
+    return records
+
+def write_summary(records, summary_file, started, elapsed):
+    """Write the job summaries as JSON"""
+    summary = {
+        'started_at': started,
+        'elapsed': round(elapsed, 3),
+        'jobs': sorted(records, key=lambda r: (r['book'], FORMATS.index(r['format']))),
+    }
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+        f.write('\n')
+
+def print_summary(records):
+    """Print per-job results. Returns exit code (0 unless every job failed)."""
+    print("📊 Catalog Summary")
+    for record in sorted(records, key=lambda r: (r['book'], FORMATS.index(r['format']))):
+        name = record['title'] or record['book']
+        label = FORMAT_LABELS[record['format']]
+        if record['status'] == 'failed':
+            print(f"❌ {name} · {label}: Generation failed")
+        else:
+            size_kb = (record['output_size'] or 0) // 1024
+            action = "Up to date" if record['status'] == 'skipped' else f"Built in {record['elapsed']:.1f}s"
+            print(f"✅ {name} · {label}: {action} ({size_kb}KB)")
+    print()
+
+    failed = sum(1 for record in records if record['status'] == 'failed')
+    if not failed:
+        print(f"🎉 All {len(records)} job(s) succeeded!")
+        return 0
+    elif failed < len(records):
+        print(f"⚠️  {failed} of {len(records)} job(s) failed")
+        return 0  # Partial success
+    else:
+        print("❌ All jobs failed")
+        return 1
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Build EPUB, PDF and Word outputs for many books.")
+    parser.add_argument('projects', nargs='+',
+                        help="Book project directories, catalog directories or list files")
+    parser.add_argument('--formats', type=parse_formats, default=list(FORMATS),
+                        help="Comma-separated formats to build (default: epub,pdf,word)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild formats even if their inputs are unchanged")
+    parser.add_argument('--per-chapter', action='store_true',
+                        help="Build EPUBs and PDFs one chapter at a time (cached, parallel)")
+    parser.add_argument('--epubcheck', action='store_true',
+                        help="Also validate EPUBs with epubcheck (slow; needs Java)")
+    parser.add_argument('--summary', default=SUMMARY_FILENAME,
+                        help=f"Where to write the JSON job summary (default: {SUMMARY_FILENAME})")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    projects = find_projects(args.projects)
+    if not projects:
+        print("❌ No book projects found", file=sys.stderr)
+        return 1
+
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    start = time.monotonic()
+    records = build_catalog(projects, args.formats, jobs=args.jobs, force=args.force,
+                            per_chapter=args.per_chapter, epubcheck=args.epubcheck)
+    write_summary(records, args.summary, started, time.monotonic() - start)
+
+    exit_code = print_summary(records)
+    print(f"📋 Job summary written to {args.summary}")
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Build an EPUB one section at a time.
+Each front matter section and chapter is converted to XHTML by pandoc
+separately and cached by content hash, then the package (content.opf,
+toc.ncx, nav.xhtml) is assembled from the cached pieces. Editing one
+chapter only costs one pandoc conversion.
+"""
+
+import os
+import re
+import sys
+import uuid
+import hashlib
+import mimetypes
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from book_config import PROJECT_ROOT, load_config, output_filename, output_dir
+from epub_archive import deflate_level, source_date_epoch, write_epub
+from epub_package import render_nav_xhtml
+from manuscript import load_manuscript, epub_matter, epub_sections, wrap
+from optimize_images import optimized
+from subset_fonts import MEDIA_TYPES, prepare_fonts
+
+CACHE_DIRNAME = ".epub-cache"
+CACHE_VERSION = 2
+
+# pandoc has no XHTML writer: its HTML5 markup is already well-formed XML, and
+# fragments whose raw HTML is not are re-serialized by xhtml_fragment()
+PANDOC_ARGS = ['--from=markdown', '--to=html5']
+
+# Elements written as <tag /> in XHTML
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+# Matches --toc-depth=3 in generate_epub.sh
+TOC_DEPTH = 3
+
+HEADING_RE = re.compile(r'<h([1-6])\b([^>]*)>(.*?)</h\1>', re.DOTALL)
+ID_RE = re.compile(r'\bid="([^"]+)"')
+TAG_RE = re.compile(r'<[^>]+>')
+LOCAL_HREF_RE = re.compile(r'href="#([^"]+)"')
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*\bsrc=")([^"]+)(")')
+
+def pandoc_version():
+    """Return pandoc's version line, used in cache keys"""
+    result = subprocess.run(['pandoc', '--version'], capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()[0] if result.stdout else ''
+
+def section_key(markdown, version, args=PANDOC_ARGS):
+    """Cache key for one section's conversion"""
+    h = hashlib.sha256()
+    for part in (str(CACHE_VERSION), version, ' '.join(args), markdown):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def convert_section(markdown, cache_dir, version, args=PANDOC_ARGS, suffix='.xhtml', postprocess=None):
+    """
+    Convert one section to an XHTML body fragment, using the cache.
+
+    Args:
+        markdown: Wrapped Markdown for the section
+        cache_dir: Directory holding cached fragments
+        version: pandoc version line
+        args: pandoc arguments (default: HTML5 body fragment)
+        suffix: Suffix of the cached files
+        postprocess: Function applied to pandoc's output before it is cached
+
+    Returns:
+        Tuple of (cache key, fragment, cache hit)
+    """
+    key = section_key(markdown, version, args)
+    cached = Path(cache_dir) / f"{key}{suffix}"
+    if cached.exists():
+        return key, cached.read_text(encoding='utf-8'), True
+
+    result = subprocess.run(['pandoc'] + list(args), input=markdown,
+                            capture_output=True, text=True, encoding='utf-8')
+    if result.returncode != 0:
+        raise RuntimeError(f"pandoc failed: {result.stderr.strip()}")
+    output = postprocess(result.stdout) if postprocess else result.stdout
+
+    # Write via a temp name so concurrent builds never read a partial file
+    temp_path = cached.with_name(cached.name + f".{os.getpid()}.tmp")
+    temp_path.write_text(output, encoding='utf-8')
+    os.replace(temp_path, cached)
+    return key, output, False
+
+class _XhtmlWriter(HTMLParser):
+    """Re-serialize HTML as XHTML: void elements closed, open elements closed, text escaped"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open = []
+
+    def _start(self, tag, attrs, void):
+        names = set()
+        rendered = ''
+        for name, value in attrs:
+            if name not in names:
+                names.add(name)
+                rendered += f' {name}={quoteattr(name if value is None else value)}'
+        self.parts.append(f'<{tag}{rendered} />' if void else f'<{tag}{rendered}>')
+
+    def handle_starttag(self, tag, attrs):
+        void = tag in VOID_ELEMENTS
+        self._start(tag, attrs, void)
+        if not void:
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        # End tags with no open element are dropped; ones that skip open elements close them
+        if tag in self.open:
+            while True:
+                name = self.open.pop()
+                self.parts.append(f'</{name}>')
+                if name == tag:
+                    break
+
+    def handle_data(self, data):
+        self.parts.append(escape(data))
+
+    def handle_comment(self, data):
+        self.parts.append(f'<!--{data.replace("--", "- -")}-->')
+
+    def result(self):
+        self.close()
+        return ''.join(self.parts) + ''.join(f'</{name}>' for name in reversed(self.open))
+
+def xhtml_fragment(fragment):
+    """
+    Make a body fragment well-formed XHTML.
+
+    pandoc's own markup already is; raw HTML from the manuscript is passed
+    through as written (<br>, <img ...>, &nbsp;, unclosed <p>), so a fragment
+    that does not parse as XML is re-serialized.
+
+    Returns:
+        The fragment, unchanged if it was already well-formed
+    """
+    try:
+        ElementTree.fromstring('<div xmlns="http://www.w3.org/1999/xhtml" '
+                               f'xmlns:epub="http://www.idpf.org/2007/ops">{fragment}</div>')
+        return fragment
+    except ElementTree.ParseError:
+        writer = _XhtmlWriter()
+        writer.feed(fragment)
+        return writer.result()
+
+def _plain_text(html):
+    """Strip tags and collapse whitespace"""
+    text = TAG_RE.sub('', html)
+    for entity, char in (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&#39;', "'"), ('&amp;', '&')):
+        text = text.replace(entity, char)
+    return ' '.join(text.split())
+
+def extract_headings(fragment, href):
+    """
+    Find TOC headings in a fragment.
+
+    Returns:
+        List of (level, title, href) for headings up to TOC_DEPTH
+    """
+    headings = []
+    for match in HEADING_RE.finditer(fragment):
+        level = int(match.group(1))
+        if level > TOC_DEPTH:
+            continue
+        id_match = ID_RE.search(match.group(2))
+        target = f"{href}#{id_match.group(1)}" if id_match else href
+        headings.append((level, _plain_text(match.group(3)), target))
+    return headings
+
+def build_toc_tree(headings):
+    """
+    Nest a flat heading list.
+
+    Returns:
+        List of nodes: {'label', 'href', 'children'}
+    """
+    root = []
+    stack = [(0, root)]
+    for level, title, href in headings:
+        while stack[-1][0] >= level:
+            stack.pop()
+        node = {'label': title, 'href': href, 'children': []}
+        stack[-1][1].append(node)
+        stack.append((level, node['children']))
+    return root
+
+def render_ncx(tree, title, identifier):
+    """Serialize the TOC tree as an EPUB 2 NCX document"""
+    play_order = 0
+
+    def depth(nodes):
+        return 1 + max((depth(n['children']) for n in nodes), default=0) if nodes else 0
+
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<ncx version="2005-1" xmlns="http://www.daisy.org/z3986/2005/ncx/">',
+        '  <head>',
+        f'    <meta name="dtb:uid" content={quoteattr(identifier)} />',
+        f'    <meta name="dtb:depth" content="{max(depth(tree), 1)}" />',
+        '    <meta name="dtb:totalPageCount" content="0" />',
+        '    <meta name="dtb:maxPageNumber" content="0" />',
+        '  </head>',
+        '  <docTitle>',
+        f'    <text>{escape(title)}</text>',
+        '  </docTitle>',
+        '  <navMap>',
+    ]
+
+    def render_points(nodes, indent):
+        nonlocal play_order
+        for node in nodes:
+            play_order += 1
+            lines.append(f'{indent}<navPoint id="navPoint-{play_order}">')
+            lines.append(f'{indent}  <navLabel>')
+            lines.append(f'{indent}    <text>{escape(node["label"])}</text>')
+            lines.append(f'{indent}  </navLabel>')
+            lines.append(f'{indent}  <content src={quoteattr(node["href"])} />')
+            render_points(node['children'], indent + '  ')
+            lines.append(f'{indent}</navPoint>')
+
+    render_points(tree, '    ')
+    lines += ['  </navMap>', '</ncx>', '']
+    return '\n'.join(lines)
+
+def render_document(fragment, title, language, matter='bodymatter'):
+    """Wrap a body fragment in an XHTML document of the given book division"""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE html>\n'
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+        f'xml:lang={quoteattr(language)} lang={quoteattr(language)}>\n'
+        '<head>\n'
+        '  <meta charset="utf-8" />\n'
+        f'  <title>{escape(title)}</title>\n'
+        '  <link rel="stylesheet" type="text/css" href="../styles/stylesheet1.css" />\n'
+        '</head>\n'
+        f'<body epub:type="{matter}">\n'
+        f'{fragment}'
+        '</body>\n'
+        '</html>\n'
+    )
+
+def render_cover(image_href, title):
+    """Cover page document"""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+        '<head>\n'
+        '  <meta charset="utf-8" />\n'
+        f'  <title>{escape(title)}</title>\n'
+        '  <link rel="stylesheet" type="text/css" href="../styles/stylesheet1.css" />\n'
+        '</head>\n'
+        '<body id="cover" epub:type="cover">\n'
+        f'  <div id="cover-image"><img src={quoteattr("../" + image_href)} alt={quoteattr(title)} /></div>\n'
+        '</body>\n'
+        '</html>\n'
+    )
+
+def render_opf(config, identifier, manifest, spine, cover_id):
+    """
+    Serialize content.opf.
+
+    Args:
+        config: Config dictionary
+        identifier: Book identifier (urn:uuid:...)
+        manifest: List of (id, href, media type, properties)
+        spine: List of (idref, linear)
+        cover_id: Manifest id of the cover image, or None
+    """
+    book = config['book']
+    # SOURCE_DATE_EPOCH pins the date, as it does for pandoc, for byte-identical rebuilds
+    modified = (source_date_epoch() or datetime.now(timezone.utc)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<package version="3.0" xmlns="http://www.idpf.org/2007/opf" unique-identifier="epub-id-1">',
+        '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">',
+        f'    <dc:identifier id="epub-id-1">{escape(identifier)}</dc:identifier>',
+        f'    <dc:title id="epub-title-1">{escape(str(book.get("title", "")))}</dc:title>',
+        '    <meta refines="#epub-title-1" property="title-type">main</meta>',
+    ]
+    if book.get('subtitle'):
+        lines.append(f'    <dc:title id="epub-title-2">{escape(str(book["subtitle"]))}</dc:title>')
+        lines.append('    <meta refines="#epub-title-2" property="title-type">subtitle</meta>')
+    lines.append(f'    <dc:language>{escape(str(book.get("language", "en-US")))}</dc:language>')
+    for key in ('author', 'publisher', 'date', 'description', 'rights'):
+        if book.get(key):
+            element = 'creator' if key == 'author' else key
+            lines.append(f'    <dc:{element}>{escape(str(book[key]))}</dc:{element}>')
+    lines.append(f'    <meta property="dcterms:modified">{modified}</meta>')
+    if cover_id:
+        lines.append(f'    <meta name="cover" content="{cover_id}" />')
+    lines.append('  </metadata>')
+
+    lines.append('  <manifest>')
+    for item_id, href, media_type, properties in manifest:
+        props = f' properties="{properties}"' if properties else ''
+        lines.append(f'    <item id="{item_id}" href={quoteattr(href)} media-type="{media_type}"{props} />')
+    lines.append('  </manifest>')
+
+    lines.append('  <spine toc="ncx">')
+    for idref, linear in spine:
+        attr = '' if linear else ' linear="no"'
+        lines.append(f'    <itemref idref="{idref}"{attr} />')
+    lines.append('  </spine>')
+    lines += ['</package>', '']
+    return '\n'.join(lines)
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml" />
+  </rootfiles>
+</container>
+'''
+
+def _media_type(path):
+    """Guess a manifest media type from a filename"""
+    return mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+
+def link_sections(documents):
+    """
+    Make ids unique across the documents and point #anchor links at them.
+
+    Sections are converted one at a time, so pandoc cannot number a heading
+    id that an earlier section already used (two chapters with a "Summary"
+    heading both get id="summary"). The later ones are renamed with pandoc's
+    -1, -2, ... suffixes, in reading order as in the one-pass build, so
+    #summary and #summary-1 reach the same headings in both builds.
+
+    Args:
+        documents: List of (href, HTML) in reading order
+
+    Returns:
+        List of (href, HTML) with links to another document's anchors
+        rewritten as href="<href>#anchor"
+    """
+    taken = {anchor for _, fragment in documents for anchor in ID_RE.findall(fragment)}
+    anchors = {}
+    renamed = []
+    for href, fragment in documents:
+        names = {}
+        for anchor in ID_RE.findall(fragment):
+            if anchor in names:
+                continue
+            name = anchor
+            if anchor in anchors:
+                number = 1
+                while f"{anchor}-{number}" in taken:
+                    number += 1
+                name = f"{anchor}-{number}"
+                taken.add(name)
+            names[anchor] = name
+            anchors[name] = href
+        renamed.append((href, ID_RE.sub(lambda match, n=names: f'id="{n[match.group(1)]}"', fragment)))
+
+    linked = []
+    for href, fragment in renamed:
+        def retarget(match):
+            anchor = match.group(1)
+            if anchors.get(anchor, href) == href:
+                return match.group(0)
+            return f'href="{anchors[anchor]}#{anchor}"'
+
+        linked.append((href, LOCAL_HREF_RE.sub(retarget, fragment)))
+    return linked
+
+def build_epub(project_root, config, output_file, manuscript=None, log=print, fonts=None):
+    """
+    Build an EPUB from per-section cached conversions.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        output_file: Path to write the EPUB
+        manuscript: Manuscript from load_manuscript() (loaded if None)
+        log: Function called with progress lines
+        fonts: (stylesheet path, font file paths) from prepare_fonts(),
+            embedded in EPUB/fonts/ with that stylesheet (None: the
+            configured stylesheet and no fonts)
+
+    Returns:
+        Number of sections converted (cache misses)
+    """
+    project_root = Path(project_root)
+    book = config['book']
+    title = str(book.get('title', ''))
+    language = str(book.get('language', 'en-US'))
+
+    if manuscript is None:
+        manuscript = load_manuscript(project_root, config)
+
+    cache_dir = output_dir(project_root, config) / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    version = pandoc_version()
+
+    sections = [wrap(opening, text, closing) for opening, text, closing in epub_sections(manuscript)]
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        converted = list(executor.map(
+            lambda md: convert_section(md, cache_dir, version, postprocess=xhtml_fragment), sections))
+
+    misses = sum(1 for _, _, hit in converted if not hit)
+    log(f"   ✅ Converted {misses} of {len(converted)} section(s) ({len(converted) - misses} cached)")
+
+    # Drop fragments no section uses any more
+    used = {f"{key}.xhtml" for key, _, _ in converted}
+    for entry in cache_dir.iterdir():
+        if entry.suffix == '.xhtml' and entry.name not in used:
+            entry.unlink()
+
+    documents = link_sections([(f"ch{num:03d}.xhtml", fragment)
+                                for num, (_, fragment, _) in enumerate(converted, 1)])
+
+    manifest = [
+        ('ncx', 'toc.ncx', 'application/x-dtbncx+xml', None),
+        ('nav', 'nav.xhtml', 'application/xhtml+xml', 'nav'),
+        ('stylesheet1', 'styles/stylesheet1.css', 'text/css', None),
+    ]
+    spine = []
+    files = {}
+
+    css_path = project_root / config['styles'].get('epub_css', 'styles/ebook_styles.css')
+    if fonts:
+        # The stylesheet copy's @font-face rules point at ../fonts/
+        css_path, font_paths = Path(fonts[0]), fonts[1]
+        for number, font_path in enumerate(font_paths, 1):
+            font_path = Path(font_path)
+            files[f'EPUB/fonts/{font_path.name}'] = font_path.read_bytes()
+            manifest.append((f'font{number}', f'fonts/{font_path.name}',
+                             MEDIA_TYPES.get(font_path.suffix.lower(), _media_type(font_path)), None))
+    files['EPUB/styles/stylesheet1.css'] = css_path.read_bytes() if css_path.is_file() else b''
+
+    cover_id = None
+    cover_image = config['structure'].get('cover_image', '')
+    if cover_image and cover_image != '""' and (project_root / cover_image).is_file():
+        cover_path = project_root / cover_image
+        cover_href = f"media/cover{cover_path.suffix.lower()}"
+        cover_id = 'cover_image'
+        files[f'EPUB/{cover_href}'] = cover_path.read_bytes()
+        files['EPUB/text/cover.xhtml'] = render_cover(cover_href, title).encode('utf-8')
+        manifest.append((cover_id, cover_href, _media_type(cover_path), 'cover-image'))
+        manifest.append(('cover_xhtml', 'text/cover.xhtml', 'application/xhtml+xml', None))
+        spine.append(('cover_xhtml', True))
+
+    media = {}
+    chapters_dir = project_root / "book_content" / "chapters"
+    headings = []
+    for (href, fragment), matter in zip(documents, epub_matter(manuscript)):
+        def embed(match):
+            src = match.group(2)
+            if re.match(r'^[a-z][a-z0-9+.-]*:', src, re.IGNORECASE):
+                return match.group(0)
+            for base in (project_root, chapters_dir):
+                image_path = (base / src).resolve()
+                if image_path.is_file():
+                    break
+            else:
+                return match.group(0)
+            if image_path not in media:
+                media[image_path] = f"media/file{len(media)}{image_path.suffix.lower()}"
+            return f'{match.group(1)}../{media[image_path]}{match.group(3)}'
+
+        fragment = IMG_SRC_RE.sub(embed, fragment)
+        doc_headings = extract_headings(fragment, f'text/{href}')
+        headings += doc_headings
+        doc_title = doc_headings[0][1] if doc_headings else title
+
+        item_id = href.replace('.', '_')
+        files[f'EPUB/text/{href}'] = render_document(fragment, doc_title, language, matter).encode('utf-8')
+        manifest.append((item_id, f'text/{href}', 'application/xhtml+xml', None))
+        spine.append((item_id, True))
+
+    for image_path, href in media.items():
+        files[f'EPUB/{href}'] = image_path.read_bytes()
+        manifest.append((Path(href).stem, href, _media_type(image_path), None))
+
+    spine.append(('nav', False))
+
+    # Stable identifier so rebuilds of the same book keep their uid
+    identifier = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, title + '|' + str(book.get('publisher', '')))}"
+    tree = build_toc_tree(headings)
+    files['EPUB/nav.xhtml'] = render_nav_xhtml(tree, title).encode('utf-8')
+    files['EPUB/toc.ncx'] = render_ncx(tree, title, identifier).encode('utf-8')
+    files['EPUB/content.opf'] = render_opf(config, identifier, manifest, spine, cover_id).encode('utf-8')
+
+    files['META-INF/container.xml'] = CONTAINER_XML.encode('utf-8')
+    write_epub(output_file, files, deflate_level(config))
+
+    return misses
+
+def main():
+    """CLI interface"""
+    project_root = PROJECT_ROOT
+    config = load_config(project_root / "config.yaml")
+
+    if len(sys.argv) > 1:
+        output_file = Path(sys.argv[1])
+    else:
+        output_file = output_dir(project_root, config) / output_filename(config, 'epub')
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    print("📖 Building EPUB from cached sections...")
+    try:
+        manuscript = load_manuscript(project_root, config)
+        fonts = prepare_fonts(project_root, config, manuscript, ['epub']).get('epub')
+        config, manuscript = optimized(project_root, config, manuscript, 'epub')
+        build_epub(project_root, config, output_file, manuscript, fonts=fonts)
+    except (FileNotFoundError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    print(f"✅ EPUB created: {output_file}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Render a PDF one chapter at a time.
+The front matter and each chapter are converted to HTML by pandoc
+separately, laid out by WeasyPrint's Python API in a process pool (each
+worker parses the print stylesheet once) and stitched into one PDF with
+pypdf. Render time scales with core count and peak memory is bounded by
+the largest chapter instead of the whole book.
+
+Each chunk is laid out once, knowing the page it starts on, so running
+page numbers and left/right page styles match a single-pass render. A
+chunk's start depends on the page counts of the chunks before it, which
+are cached by content: a chunk is rendered as soon as every earlier
+count is known. The first build therefore lays chapters out in order;
+later builds know every count up front and render changed chapters (and
+those whose starting page moved) in parallel. Counts are also keyed by
+the starting side when the stylesheet gives left and right pages
+different areas or breaks to one side (a recto chapter start, whose blank
+page WeasyPrint lays out as in a single pass). The outline and links
+between chapters are carried into the merged PDF.
+
+Needs the weasyprint and pypdf Python packages.
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+import importlib
+from importlib import metadata
+from pathlib import Path
+from urllib.parse import unquote
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from book_config import PROJECT_ROOT, load_config, output_filename, output_dir
+from build_epub import convert_section, link_sections, pandoc_version
+from manuscript import load_manuscript, pdf_chunks
+from optimize_images import optimized
+from subset_fonts import prepare_fonts
+
+CACHE_DIRNAME = ".pdf-cache"
+CACHE_VERSION = 2
+INDEX_FILENAME = "pages.json"
+
+DEPENDENCIES = ('weasyprint', 'pypdf')
+
+PANDOC_ARGS = ['--from=markdown', '--to=html5', '--standalone']
+
+# Links to another chunk are rendered as URIs with this scheme, then turned
+# into named-destination links once the chunks are merged
+CHUNK_SCHEME = "book-chunk:"
+
+BODY_RE = re.compile(r'<body\b[^>]*>')
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+SIDE_BREAK_RE = re.compile(r'\b(?:page-)?break-(?:before|after)\s*:\s*(?:left|right|recto|verso)\b')
+PAGE_RULE_RE = re.compile(r'@page\b([^{]*)\{((?:[^{}]|\{[^{}]*\})*)\}')
+MARGIN_BOX_RE = re.compile(r'@[\w-]+\s*\{[^{}]*\}')
+PAGE_AREA_RE = re.compile(r'(?:^|[;\s])(?:size|margin|padding|border|bleed)[\w-]*\s*:')
+
+def missing_dependencies():
+    """Python packages chunked rendering needs that are not installed or do not import"""
+    missing = []
+    for name in DEPENDENCIES:
+        try:
+            importlib.import_module(name)
+        except (ImportError, OSError):  # OSError: WeasyPrint without its system libraries
+            missing.append(name)
+    return missing
+
+def sides_differ(css_text):
+    """
+    True if a chunk's page count can depend on the side it starts on: @page
+    :left/:right rules change the page area, or something breaks to a left
+    or right page (a recto chapter start adds a blank page on one side only)
+    """
+    css_text = COMMENT_RE.sub('', css_text)
+    if SIDE_BREAK_RE.search(css_text):
+        return True
+    for selector, body in PAGE_RULE_RE.findall(css_text):
+        if (':left' in selector or ':right' in selector) and PAGE_AREA_RE.search(MARGIN_BOX_RE.sub('', body)):
+            return True
+    return False
+
+def layout_key(html, css_text, version, side=None):
+    """Cache key for a chunk's layout (side: page parity, when left and right pages differ)"""
+    h = hashlib.sha256()
+    for part in (str(CACHE_VERSION), version, css_text, html, str(side)):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def plan_pages(count, pages_for):
+    """
+    Work out where each chunk starts, as far as page counts are known.
+
+    Args:
+        count: Number of chunks
+        pages_for: Function (chunk index, start page) -> page count, or
+            None if it is not known yet
+
+    Returns:
+        Start page of each chunk up to and including the first one whose
+        page count is not known
+    """
+    starts = []
+    page = 1
+    for index in range(count):
+        starts.append(page)
+        pages = pages_for(index, page)
+        if pages is None:
+            break
+        page += pages
+    return starts
+
+_worker = {}
+
+def _init_worker(css_path, base_url):
+    """Parse the print stylesheet once per worker process"""
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    _worker['font_config'] = font_config
+    _worker['stylesheets'] = [CSS(filename=css_path, font_config=font_config)] if css_path else []
+    _worker['base_url'] = base_url
+
+def render_chunk(html, start_page, output_path):
+    """
+    Lay out one chunk and write it as a PDF. Runs inside a worker process.
+
+    Args:
+        html: Standalone HTML for the chunk
+        start_page: Book page number of the chunk's first page
+        output_path: Where to write the chunk's PDF
+
+    Returns:
+        Number of pages in the chunk
+    """
+    from weasyprint import CSS, HTML
+
+    stylesheets = _worker['stylesheets']
+    lead = 0
+    if start_page > 1:
+        # Later chunks open with throwaway pages that take the page counter
+        # reset and any @page :first styles, and bring the first real page
+        # onto the same side (left/right) as in the whole book
+        lead = 1 + start_page % 2
+        side = 'right' if start_page % 2 else 'left'
+        html = BODY_RE.sub(lambda m: m.group(0) + f'<div style="break-after: {side}"></div>', html, count=1)
+        stylesheets = stylesheets + [CSS(string=f'@page :first {{ counter-reset: page {start_page - lead} }}')]
+
+    document = HTML(string=html, base_url=_worker['base_url']).render(
+        stylesheets=stylesheets, font_config=_worker['font_config'], presentational_hints=True)
+    if lead:
+        document = document.copy(document.pages[lead:])
+
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    document.write_pdf(temp_path)
+    os.replace(temp_path, output_path)
+    return len(document.pages)
+
+def link_chunks(writer):
+    """
+    Point links to other chunks at the merged PDF's named destinations.
+
+    WeasyPrint names a destination after every id in a chunk and pypdf keeps
+    them when appending, so a link rendered as <CHUNK_SCHEME>N#anchor only
+    needs its URI action replaced by a /Dest naming the anchor.
+
+    Args:
+        writer: PdfWriter holding the merged chunks
+
+    Returns:
+        Number of links rewritten
+    """
+    from pypdf.generic import NameObject, TextStringObject
+
+    linked = 0
+    for page in writer.pages:
+        for annotation in page.get('/Annots') or []:
+            annotation = annotation.get_object()
+            action = annotation.get('/A')
+            uri = action.get_object().get('/URI') if action is not None else None
+            if not (uri and str(uri).startswith(CHUNK_SCHEME) and '#' in uri):
+                continue
+            del annotation['/A']
+            annotation[NameObject('/Dest')] = TextStringObject(unquote(str(uri).split('#', 1)[1]))
+            linked += 1
+    return linked
+
+def _load_index(index_file):
+    try:
+        with open(index_file, encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return index.get('pages', {}) if index.get('version') == CACHE_VERSION else {}
+
+def _save_index(index_file, pages):
+    temp_path = index_file.with_name(index_file.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'pages': pages}, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(temp_path, index_file)
+
+def build_pdf(project_root, config, output_file, manuscript=None, jobs=None, log=print, stylesheet=None):
+    """
+    Build a PDF from chunks rendered in parallel.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        output_file: Path to write the PDF
+        manuscript: Manuscript from load_manuscript() (loaded if None)
+        jobs: Number of render processes (default: CPU count)
+        log: Function called with progress lines
+        stylesheet: Print stylesheet to use instead of the configured one
+            (e.g. prepare_fonts()'s copy pointing at font subsets)
+
+    Returns:
+        Number of chunks laid out (cache misses)
+
+    Raises:
+        RuntimeError: If weasyprint or pypdf is missing, or a conversion fails
+    """
+    missing = missing_dependencies()
+    if missing:
+        raise RuntimeError(f"Chunked PDF rendering needs {', '.join(missing)} "
+                           f"(pip install {' '.join(missing)})")
+    from pypdf import PdfWriter
+
+    project_root = Path(project_root)
+    book = config['book']
+    title = str(book.get('title', ''))
+
+    if manuscript is None:
+        manuscript = load_manuscript(project_root, config)
+
+    cache_dir = output_dir(project_root, config) / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    css_path = project_root / config['styles'].get('print_css', 'styles/print_styles.css')
+    if stylesheet:
+        css_path = Path(stylesheet)
+    css_text = css_path.read_text(encoding='utf-8') if css_path.is_file() else ''
+    version = f"{pandoc_version()}|weasyprint {metadata.version('weasyprint')}"
+
+    # The front matter carries the title block; chapters only need a page title
+    chunks = pdf_chunks(manuscript, config)
+    chapter_args = PANDOC_ARGS + ['--metadata', f'pagetitle={title}']
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        converted = list(executor.map(
+            lambda item: convert_section(item[1], cache_dir, version,
+                                         PANDOC_ARGS if item[0] == 0 else chapter_args, suffix='.html'),
+            enumerate(chunks)))
+    misses = sum(1 for _, _, hit in converted if not hit)
+    log(f"   ✅ Converted {misses} of {len(chunks)} chunk(s) ({len(chunks) - misses} cached)")
+
+    # Ids are made unique across chunks and links to another chunk's anchors
+    # point at it through CHUNK_SCHEME, so link_chunks() can reconnect them
+    html = [fragment for _, fragment in link_sections(
+        [(f"{CHUNK_SCHEME}{index}", fragment) for index, (_, fragment, _) in enumerate(converted)])]
+
+    sided = sides_differ(css_text)
+    keys = {}
+
+    def chunk_key(index, start):
+        side = start % 2 if sided else None
+        if (index, side) not in keys:
+            keys[index, side] = layout_key(html[index], css_text, version, side)
+        return keys[index, side]
+
+    def chunk_pdf(index, start):
+        return cache_dir / f"{chunk_key(index, start)}-p{start}.pdf"
+
+    index_file = cache_dir / INDEX_FILENAME
+    known = _load_index(index_file)
+    measured = set()  # layout keys whose count this build produced
+    rendered = {}  # chunk index -> start page of its PDF
+
+    def pages_for(index, start):
+        return known.get(chunk_key(index, start))
+
+    laid_out = 0
+    jobs = jobs or min(len(chunks), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(str(css_path) if css_text else None, f'{project_root}/')) as executor:
+        # A chunk is submitted once every earlier page count is known, so each
+        # one is laid out at its final start page; a finished chunk's count
+        # settles the start of the next
+        pending = {}  # future -> (chunk index, start page)
+        while True:
+            starts = plan_pages(len(chunks), pages_for)
+            for index, start in enumerate(starts):
+                if rendered.get(index) == start or (index, start) in pending.values():
+                    continue
+                if chunk_key(index, start) in known and chunk_pdf(index, start).exists():
+                    rendered[index] = start
+                    continue
+                future = executor.submit(render_chunk, html[index], start, str(chunk_pdf(index, start)))
+                pending[future] = (index, start)
+
+            if len(starts) == len(chunks) and all(rendered.get(index) == start
+                                                   for index, start in enumerate(starts)):
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, start = pending.pop(future)
+                key = chunk_key(index, start)
+                count = future.result()
+                if known.get(key, count) != count:
+                    # A recorded count was wrong, so the later starts it gave
+                    # are too; stop trusting counts this build has not measured
+                    known = {measured_key: known[measured_key] for measured_key in measured}
+                known[key] = count
+                measured.add(key)
+                rendered[index] = start
+                laid_out += 1
+
+    total = starts[-1] + known[chunk_key(len(chunks) - 1, starts[-1])] - 1
+    log(f"   ✅ Laid out {laid_out} chunk(s) with {jobs} worker(s), {total} page(s)")
+
+    writer = PdfWriter()
+    for index, start in enumerate(starts):
+        writer.append(str(chunk_pdf(index, start)))
+    linked = link_chunks(writer)
+    if linked:
+        log(f"   ✅ Linked {linked} cross-chapter reference(s)")
+    metadata_fields = {'/Title': title}
+    if book.get('author'):
+        metadata_fields['/Author'] = str(book['author'])
+    writer.add_metadata(metadata_fields)
+
+    output_file = Path(output_file)
+    temp_file = output_file.with_name(output_file.name + f".{os.getpid()}.tmp")
+    with open(temp_file, 'wb') as f:
+        writer.write(f)
+    os.replace(temp_file, output_file)
+
+    # Keep only what this build used
+    used = {chunk_pdf(index, start).name for index, start in enumerate(starts)}
+    used |= {f"{key}.html" for key, _, _ in converted}
+    for entry in cache_dir.iterdir():
+        if entry.suffix in ('.pdf', '.html') and entry.name not in used:
+            entry.unlink()
+    used_keys = {chunk_key(index, start) for index, start in enumerate(starts)}
+    _save_index(index_file, {key: count for key, count in known.items() if key in used_keys})
+
+    return laid_out
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Render the PDF one chapter at a time.")
+    parser.add_argument('output', nargs='?', default=None, help="PDF to write (default: configured name)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of render processes (default: CPU count)")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    project_root = PROJECT_ROOT
+    config = load_config(project_root / "config.yaml")
+
+    if args.output:
+        output_file = Path(args.output)
+    else:
+        output_file = output_dir(project_root, config) / output_filename(config, 'pdf')
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    print("📄 Rendering PDF chapter by chapter...")
+    try:
+        manuscript = load_manuscript(project_root, config)
+        fonts = prepare_fonts(project_root, config, manuscript, ['pdf']).get('pdf')
+        config, manuscript = optimized(project_root, config, manuscript, 'pdf')
+        build_pdf(project_root, config, output_file, manuscript, jobs=args.jobs,
+                  stylesheet=fonts[0] if fonts else None)
+    except (FileNotFoundError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    print(f"✅ PDF created: {output_file}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
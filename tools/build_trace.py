@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and resource tracing for generation runs.
+
+Every stage records wall time, CPU time (user + system, including the
+child processes it waited for, such as pandoc), peak RSS and the bytes it
+read and wrote. Python stages are measured in-process; on Linux their
+peak RSS is the stage's own, measured by resetting the process's
+high-water mark when the stage starts, and elsewhere only the process
+peak so far is known (recorded as process_peak_rss_kb). External
+commands are measured from their rusage on exit and, on Linux, from
+/proc/<pid>/io. Traces are written as JSON, or in Chrome trace format
+for chrome://tracing and Perfetto.
+
+CLI (used by the generate scripts):
+    build_trace.py run <trace.jsonl> <stage> [--category C] -- <command>...
+    build_trace.py finish <trace.jsonl> <trace.json> [--chrome] [--label L]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TRACE_VERSION = 1
+
+# ru_maxrss is kilobytes on Linux, bytes on macOS
+_RSS_DIVISOR = 1024 if sys.platform == 'darwin' else 1
+
+def _peak_rss_kb(who):
+    """High-water RSS in KB for RUSAGE_SELF or RUSAGE_CHILDREN"""
+    if resource is None:
+        return None
+    return resource.getrusage(who).ru_maxrss // _RSS_DIVISOR
+
+def _reset_peak_rss():
+    """Reset this process's RSS high-water mark (Linux); False where unsupported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _current_peak_rss_kb():
+    """VmHWM from /proc/self/status in KB, or None where unavailable"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _proc_io(pid):
+    """rchar/wchar from /proc/<pid>/io, or (None, None) where unavailable"""
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def wait_process(process):
+    """
+    Reap a subprocess.Popen and collect its resource usage.
+
+    Args:
+        process: Running subprocess.Popen
+
+    Returns:
+        Tuple of (exit code, usage dict with cpu_user, cpu_system,
+        peak_rss_kb, bytes_in, bytes_out)
+    """
+    bytes_in = bytes_out = None
+    if hasattr(os, 'waitid') and hasattr(os, 'WNOWAIT'):
+        # Wait without reaping so /proc/<pid>/io is still readable
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            bytes_in, bytes_out = _proc_io(process.pid)
+        except ChildProcessError:
+            pass
+
+    if not hasattr(os, 'wait4'):
+        return process.wait(), {'cpu_user': None, 'cpu_system': None, 'peak_rss_kb': None,
+                                'bytes_in': bytes_in, 'bytes_out': bytes_out}
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, {
+        'cpu_user': usage.ru_utime,
+        'cpu_system': usage.ru_stime,
+        'peak_rss_kb': usage.ru_maxrss // _RSS_DIVISOR,
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+    }
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+class Tracer:
+    """
+    Collects stage records for one run.
+
+    Each record has name, category, start (epoch seconds), wall, cpu_user,
+    cpu_system, peak_rss_kb, bytes_in, bytes_out, pid and any extra args
+    (plus process_peak_rss_kb where a stage's own peak cannot be measured).
+    """
+
+    def __init__(self, **defaults):
+        """
+        Args:
+            defaults: Fields added to every record (e.g. format='epub')
+        """
+        self.defaults = defaults
+        self.events = []
+        # Stages still running, so a nested stage's reset does not hide its parent's peak
+        self._open = []
+
+    @contextmanager
+    def stage(self, name, category='python', **args):
+        """
+        Time an in-process stage. The yielded record can be updated with
+        bytes_in/bytes_out or other details before the block ends.
+        """
+        record = dict(self.defaults, name=name, category=category, pid=os.getpid(),
+                      bytes_in=None, bytes_out=None, **args)
+        record['start'] = time.time()
+        for parent in self._open:
+            # The high-water mark is about to be reset; keep what the parent has reached
+            parent['peak_rss_kb'] = max(parent['peak_rss_kb'] or 0, _current_peak_rss_kb() or 0) or None
+        per_stage = _reset_peak_rss()
+        record['peak_rss_kb'] = None
+        self._open.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = os.times()
+        try:
+            yield record
+        finally:
+            cpu_end = os.times()
+            self._open.remove(record)
+            record['wall'] = time.perf_counter() - wall_start
+            # Children (pandoc, worker processes) count once they have been waited for
+            record['cpu_user'] = (cpu_end.user - cpu_start.user
+                                  + cpu_end.children_user - cpu_start.children_user)
+            record['cpu_system'] = (cpu_end.system - cpu_start.system
+                                    + cpu_end.children_system - cpu_start.children_system)
+            if per_stage:
+                peak = max(record['peak_rss_kb'] or 0, _current_peak_rss_kb() or 0) or None
+                record['peak_rss_kb'] = peak
+                for parent in self._open:
+                    parent['peak_rss_kb'] = max(parent['peak_rss_kb'] or 0, peak or 0) or None
+            else:
+                record['peak_rss_kb'] = None
+                record['process_peak_rss_kb'] = _peak_rss_kb(resource.RUSAGE_SELF) if resource else None
+            self.events.append(record)
+
+    def record(self, name, start, wall, usage, category='process', **args):
+        """Add a record for an external command measured by wait_process()"""
+        record = dict(self.defaults, name=name, category=category, start=start, wall=wall, **usage)
+        record.update(args)
+        self.events.append(record)
+        return record
+
+    def extend(self, events, **overrides):
+        """Merge records collected elsewhere (e.g. in a worker process)"""
+        for event in events:
+            self.events.append(dict(event, **overrides))
+
+    def to_json(self, **meta):
+        """Trace document: metadata plus records sorted by start time"""
+        return dict(meta, version=TRACE_VERSION, stages=sorted(self.events, key=lambda e: e['start']))
+
+    def to_chrome(self):
+        """Chrome trace format: one complete ('X') event per stage"""
+        origin = min((event['start'] for event in self.events), default=0)
+        trace_events = []
+        for event in sorted(self.events, key=lambda e: e['start']):
+            args = {key: value for key, value in event.items()
+                    if key not in ('name', 'category', 'start', 'wall', 'pid') and value is not None}
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['category'],
+                'ph': 'X',
+                'ts': round((event['start'] - origin) * 1e6),
+                'dur': round(event['wall'] * 1e6),
+                'pid': event.get('pid', 0),
+                'tid': event.get('format') or event['category'],
+                'args': args,
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path, chrome=False, **meta):
+        """Write the trace atomically"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        document = self.to_chrome() if chrome else self.to_json(**meta)
+        temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+            f.write('\n')
+        os.replace(temp_path, path)
+
+    def summary_lines(self):
+        """Human-readable per-stage table, slowest first"""
+        lines = []
+        for event in sorted(self.events, key=lambda e: e['wall'], reverse=True):
+            name = f"{event['format']}: {event['name']}" if event.get('format') else event['name']
+            cpu = (event.get('cpu_user') or 0) + (event.get('cpu_system') or 0)
+            parts = [f"{name:<32}", f"{event['wall']:7.2f}s", f"cpu {cpu:6.2f}s"]
+            if event.get('peak_rss_kb'):
+                parts.append(f"rss {event['peak_rss_kb'] / 1024:6.1f}MB")
+            elif event.get('process_peak_rss_kb'):
+                parts.append(f"process rss {event['process_peak_rss_kb'] / 1024:6.1f}MB")
+            if event.get('bytes_in') is not None:
+                parts.append(f"in {_format_bytes(event['bytes_in'])}")
+            if event.get('bytes_out') is not None:
+                parts.append(f"out {_format_bytes(event['bytes_out'])}")
+            lines.append("   " + "  ".join(parts))
+        return lines
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB'):
+        if count < 1024:
+            return f"{count:.0f}{unit}"
+        count /= 1024
+    return f"{count:.1f}GB"
+
+def trace_path(out_dir, label, chrome=False):
+    """Where a run's trace goes under the output directory"""
+    return Path(out_dir) / f"{label}-trace{'.chrome' if chrome else ''}.json"
+
+def run_command(trace_file, stage, command, category='process'):
+    """
+    Run a command with inherited stdio and append its record to a JSON-lines trace.
+
+    Returns:
+        The command's exit code
+    """
+    start = time.time()
+    wall_start = time.perf_counter()
+    try:
+        process = subprocess.Popen(command)
+    except FileNotFoundError:
+        print(f"❌ Command not found: {command[0]}", file=sys.stderr)
+        return 127
+
+    returncode, usage = wait_process(process)
+    append_record(trace_file, dict(name=stage, category=category, start=start,
+                                   wall=time.perf_counter() - wall_start,
+                                   pid=process.pid, exit_code=returncode, **usage))
+    return returncode
+
+def append_record(trace_file, record):
+    """Add one stage record to a JSON-lines trace"""
+    # One short O_APPEND write per record, so pipeline members can share the file
+    with open(trace_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+def load_records(trace_file):
+    """Read a JSON-lines trace"""
+    records = []
+    try:
+        with open(trace_file, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return records
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Per-stage build tracing.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="Run a command as a traced stage")
+    run.add_argument('trace_file')
+    run.add_argument('stage')
+    run.add_argument('--category', default='process')
+    run.add_argument('cmd', nargs=argparse.REMAINDER)
+
+    finish = subparsers.add_parser('finish', help="Write the trace and print a summary")
+    finish.add_argument('trace_file')
+    finish.add_argument('output')
+    finish.add_argument('--chrome', action='store_true', help="Also write a Chrome trace")
+    finish.add_argument('--label', default=None, help="Format label added to every stage")
+    finish.add_argument('--quiet', action='store_true')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+        if not cmd:
+            parser.error("run needs a command after --")
+        return run_command(args.trace_file, args.stage, cmd, args.category)
+
+    tracer = Tracer()
+    overrides = {'format': args.label} if args.label else {}
+    tracer.extend(load_records(args.trace_file), **overrides)
+    if not tracer.events:
+        return 0
+
+    tracer.write(args.output)
+    if args.chrome:
+        tracer.write(Path(args.output).with_suffix('.chrome.json'), chrome=True)
+    os.remove(args.trace_file)
+
+    if not args.quiet:
+        print("⏱️  Stage Timing")
+        for line in tracer.summary_lines():
+            print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,77 +2,171 @@
 """
 Detect chapter files in the chapters directory with flexible naming.
 Supports multiple naming patterns and returns sorted list.
+
+Directory listings are cached in-process and reused until the directory's
+mtime changes, so build tools, the watcher and batch tools that ask for
+the same book's chapters many times scan each directory once. A directory
+modified within RACY_WINDOW_NS of its last scan is rescanned and its
+listing compared instead, since a coarse mtime can hide a second change.
 """
 
 import os
-import sys
 import re
+import sys
+import time
 from pathlib import Path
 
+# Tried in order; the first that matches gives the chapter number
+CHAPTER_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'chapter[_\s]*(\d+)',  # chapter_1, chapter_01, chapter 1
+    r'ch[_\s]*(\d+)',       # ch1, ch_1, ch 1
+    r'^(\d+)\.md$',         # 01.md, 1.md
+    r'^(\d+)_',             # 01_title.md
+))
+
+# Filesystems with coarse timestamps can change a directory twice within one mtime tick
+RACY_WINDOW_NS = 2_000_000_000
+
+# Absolute directory path -> {'mtime_ns', 'scanned_ns', 'files', 'chapters'}
+_directories = {}
+
+def chapter_number(filename):
+    """
+    Chapter number from a filename.
+
+    Args:
+        filename: File name (without directory)
+
+    Returns:
+        Chapter number, or None if the file is not a chapter
+    """
+    name = filename.lower()
+
+    # Skip conclusion and non-markdown files
+    if 'conclusion' in name or not name.endswith('.md'):
+        return None
+
+    for pattern in CHAPTER_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            return int(match.group(1))
+    return None
+
+def scan_directory(directory):
+    """
+    List the files in a directory, reusing the last listing while it is unchanged.
+
+    Args:
+        directory: Directory path
+
+    Returns:
+        Index dictionary whose 'files' is a sorted tuple of file names,
+        or None if the directory does not exist
+    """
+    key = os.path.abspath(directory)
+    try:
+        mtime_ns = os.stat(key).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        _directories.pop(key, None)
+        return None
+
+    entry = _directories.get(key)
+    if entry is not None and entry['mtime_ns'] == mtime_ns and entry['scanned_ns'] - mtime_ns > RACY_WINDOW_NS:
+        return entry
+
+    scanned_ns = time.time_ns()
+    with os.scandir(key) as entries:
+        files = tuple(sorted(item.name for item in entries if item.is_file()))
+
+    if entry is not None and entry['files'] == files:
+        # Same listing (e.g. a file was saved via rename): keep the derived chapter order
+        entry.update(mtime_ns=mtime_ns, scanned_ns=scanned_ns)
+        return entry
+
+    entry = {'mtime_ns': mtime_ns, 'scanned_ns': scanned_ns, 'files': files, 'chapters': None}
+    _directories[key] = entry
+    return entry
+
+def _chapter_names(entry):
+    """Chapter file names of a scanned directory, sorted by chapter number"""
+    if entry['chapters'] is None:
+        numbered = []
+        for name in entry['files']:
+            number = chapter_number(name)
+            if number is not None:
+                numbered.append((number, name))
+        # Stable sort over the sorted listing, so equal numbers keep a fixed order
+        numbered.sort(key=lambda item: item[0])
+        entry['chapters'] = tuple(name for _, name in numbered)
+    return entry['chapters']
+
+def clear_cache():
+    """Forget every cached directory listing"""
+    _directories.clear()
+
 def detect_chapters(chapters_dir="book_content/chapters"):
     """
     Auto-detect chapter files with flexible naming patterns.
-    
+
     Supported patterns:
     - chapter_1.md, chapter_2.md
     - chapter_01.md, chapter_02.md
     - ch1.md, ch2.md
     - chapter_1_draft.md
     - 01.md, 02.md
-    
+
     Args:
         chapters_dir: Path to chapters directory
-        
+
     Returns:
         List of chapter file paths, sorted by chapter number
     """
-    chapters_path = Path(chapters_dir)
-    
-    if not chapters_path.exists():
+    entry = scan_directory(chapters_dir)
+    if entry is None:
         return []
-    
-    chapters = []
-    
-    # Pattern to extract chapter number from filename
-    patterns = [
-        (r'chapter[_\s]*(\d+)', 1),  # chapter_1, chapter_01, chapter 1
-        (r'ch[_\s]*(\d+)', 1),       # ch1, ch_1, ch 1
-        (r'^(\d+)\.md$', 1),         # 01.md, 1.md
-        (r'^(\d+)_', 1),             # 01_title.md
-    ]
-    
-    for file_path in chapters_path.iterdir():
-        if not file_path.is_file():
-            continue
-        
-        filename = file_path.name.lower()
-        
-        # Skip conclusion and non-markdown files
-        if 'conclusion' in filename:
-            continue
-        
-        if not filename.endswith('.md'):
-            continue
-        
-        # Try to extract chapter number
-        chapter_num = None
-        for pattern, group in patterns:
-            match = re.search(pattern, filename)
-            if match:
-                try:
-                    chapter_num = int(match.group(group))
-                    break
-                except (ValueError, IndexError):
-                    continue
-        
-        if chapter_num is not None:
-            chapters.append((chapter_num, str(file_path)))
-    
-    # Sort by chapter number
-    chapters.sort(key=lambda x: x[0])
-    
-    # Return just the file paths
-    return [path for _, path in chapters]
+    chapters_path = Path(chapters_dir)
+    return [str(chapters_path / name) for name in _chapter_names(entry)]
+
+def chapter_manifest(project_root, config=None):
+    """
+    List a book project's body files in reading order, without a subprocess.
+
+    Cheap to call repeatedly and across many projects: each directory is
+    scanned once and rescanned only after it changes.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary (None includes a conclusion whenever
+            one exists and no appendices)
+
+    Returns:
+        Dictionary with 'chapters' (list of paths), 'conclusion' (path
+        or None; only if structure.has_conclusion is set) and
+        'appendices' (paths of the structure.appendices files that exist
+        in book_content/back_matter, in config order)
+    """
+    content_dir = Path(project_root) / "book_content"
+    structure = (config or {}).get('structure') or {}
+
+    chapters_dir = content_dir / "chapters"
+    chapters = detect_chapters(chapters_dir)
+
+    conclusion = None
+    entry = scan_directory(chapters_dir)
+    if entry is not None and 'conclusion.md' in entry['files'] and structure.get('has_conclusion', config is None):
+        conclusion = str(chapters_dir / "conclusion.md")
+
+    appendices = []
+    back_matter_dir = content_dir / "back_matter"
+    entry = scan_directory(back_matter_dir)
+    for name in structure.get('appendices') or []:
+        name = str(name)
+        path = back_matter_dir / name
+        # Appendices in subdirectories are not in the back matter listing
+        if (entry is not None and name in entry['files']) or ('/' in name and path.is_file()):
+            appendices.append(str(path))
+
+    return {'chapters': chapters, 'conclusion': conclusion, 'appendices': appendices}
 
 def main():
     """CLI interface"""
@@ -80,9 +174,9 @@ def main():
         chapters_dir = sys.argv[1]
     else:
         chapters_dir = "book_content/chapters"
-    
+
     chapters = detect_chapters(chapters_dir)
-    
+
     if chapters:
         for chapter in chapters:
             print(chapter)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Reproducible EPUB (zip) packaging.
+Entries are written in a fixed order (mimetype, META-INF/, then the rest
+by name) with normalized timestamps and permissions, so the same content
+always produces the same bytes. Media that is already compressed
+(images, WOFF fonts, audio, video) is stored; everything else is
+DEFLATEd at a configurable level.
+
+Timestamps come from SOURCE_DATE_EPOCH when it is set, otherwise they
+are fixed at 1980-01-01 (the earliest date a zip can hold).
+"""
+
+import os
+import sys
+import struct
+import zipfile
+import posixpath
+from datetime import datetime, timezone
+from pathlib import Path
+
+MIMETYPE = b"application/epub+zip"
+
+# Formats with their own compression; DEFLATE only costs time on these
+STORED_SUFFIXES = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif',
+    '.woff', '.woff2',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.mp4', '.m4v', '.webm',
+    '.zip', '.gz',
+})
+
+DEFAULT_LEVEL = 6
+
+# Earliest timestamp a zip entry can hold
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+# Regular file, rw-r--r--
+FILE_ATTRIBUTES = 0o100644 << 16
+
+# Python versions whose zipfile internals _write_raw_entry() was checked
+# against; other versions recompress copied entries instead
+RAW_COPY_VERSIONS = ((3, 8), (3, 13))
+
+# The private ZipFile attributes _write_raw_entry() uses
+RAW_COPY_ATTRIBUTES = ('fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify')
+
+def source_date_epoch():
+    """SOURCE_DATE_EPOCH as an aware datetime, or None if unset or invalid"""
+    value = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    if not value.isdigit():
+        return None
+    return datetime.fromtimestamp(int(value), timezone.utc)
+
+def zip_date_time():
+    """Timestamp written on every entry"""
+    when = source_date_epoch()
+    if when is None:
+        return ZIP_EPOCH
+    return max(ZIP_EPOCH, when.timetuple()[:6])
+
+def deflate_level(config):
+    """
+    DEFLATE level for text entries from the config.
+
+    Args:
+        config: Config dictionary (or None for the default)
+
+    Returns:
+        Level from 0 (no compression) to 9 (smallest)
+    """
+    level = ((config or {}).get('output') or {}).get('epub_deflate_level', DEFAULT_LEVEL)
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        return DEFAULT_LEVEL
+    return min(max(level, 0), 9)
+
+def compress_type(name):
+    """Compression for an entry: stored for compressed media, DEFLATE otherwise"""
+    if name == 'mimetype' or posixpath.splitext(name)[1].lower() in STORED_SUFFIXES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def entry_order(name):
+    """Sort key: mimetype first, then META-INF/, then everything else by name"""
+    if name == 'mimetype':
+        return (0, name)
+    if name.startswith('META-INF/'):
+        return (1, name)
+    return (2, name)
+
+def _entry_info(name, date_time, compression):
+    info = zipfile.ZipInfo(name, date_time)
+    info.compress_type = compression
+    info.create_system = 3  # Unix, whatever platform builds the file
+    info.external_attr = FILE_ATTRIBUTES
+    return info
+
+def read_raw_entry(raw_file, info):
+    """Read an entry's compressed bytes without decompressing them"""
+    raw_file.seek(info.header_offset)
+    header = raw_file.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    raw_file.seek(info.header_offset + 30 + name_len + extra_len)
+    return raw_file.read(info.compress_size)
+
+def raw_copy_supported(zipf):
+    """Whether _write_raw_entry() can be used on this ZipFile and Python version"""
+    low, high = RAW_COPY_VERSIONS
+    return (low <= sys.version_info[:2] <= high
+            and all(hasattr(zipf, name) for name in RAW_COPY_ATTRIBUTES))
+
+def _write_raw_entry(zipf, info, data, date_time):
+    """
+    Append an entry's compressed bytes to a ZipFile opened for writing.
+
+    zipfile has no public API for copying compressed data, so this writes
+    the local header itself and registers the entry for the central
+    directory the same way ZipFile.write() does. Only called when
+    raw_copy_supported() says these internals are the known ones.
+    """
+    new_info = _entry_info(info.filename, date_time, info.compress_type)
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    # Sizes are known, so no trailing data descriptor is written
+    new_info.flag_bits = info.flag_bits & ~0x08
+    new_info.header_offset = zipf.fp.tell()
+
+    zipf.fp.write(new_info.FileHeader())
+    zipf.fp.write(data)
+    zipf.filelist.append(new_info)
+    zipf.NameToInfo[new_info.filename] = new_info
+    zipf.start_dir = zipf.fp.tell()
+    zipf._didModify = True
+
+def copy_entry(zipf, src, raw_file, info, date_time, compresslevel=None):
+    """
+    Copy an entry of another zip into a ZipFile opened for writing.
+
+    The compressed bytes are copied as they are where zipfile's internals
+    are known (see RAW_COPY_VERSIONS); elsewhere the entry is decompressed
+    and compressed again with the same method.
+
+    Args:
+        zipf: ZipFile being written
+        src: ZipFile the entry comes from
+        raw_file: The same zip opened as a binary file
+        info: The entry's ZipInfo in src
+        date_time: Timestamp for the copy
+        compresslevel: Level used if the entry is recompressed
+
+    Returns:
+        True if the entry was copied without recompression
+    """
+    if raw_copy_supported(zipf):
+        _write_raw_entry(zipf, info, read_raw_entry(raw_file, info), date_time)
+        return True
+    zipf.writestr(_entry_info(info.filename, date_time, info.compress_type), src.read(info),
+                  compress_type=info.compress_type, compresslevel=compresslevel)
+    return False
+
+def write_epub(output_path, entries, level=DEFAULT_LEVEL, source=None):
+    """
+    Write an EPUB reproducibly, replacing output_path atomically.
+
+    Args:
+        output_path: EPUB to write
+        entries: Dictionary mapping zip path to bytes, or to a ZipInfo
+            of source whose data is copied (without recompression when
+            its compression already matches)
+        level: DEFLATE level for compressible entries
+        source: Path of the zip the ZipInfo entries come from
+
+    Returns:
+        Number of entries copied without recompression
+    """
+    output_path = Path(output_path)
+    temp_path = output_path.with_name(output_path.name + f".{os.getpid()}.tmp")
+    date_time = zip_date_time()
+    entries = dict(entries)
+    entries.setdefault('mimetype', MIMETYPE)
+
+    src = raw_file = None
+    if source is not None:
+        src = zipfile.ZipFile(source, 'r')
+        raw_file = open(source, 'rb')
+
+    copied = 0
+    try:
+        with zipfile.ZipFile(temp_path, 'w') as zipf:
+            for name in sorted(entries, key=entry_order):
+                data = entries[name]
+                compression = compress_type(name)
+                if isinstance(data, zipfile.ZipInfo):
+                    if data.compress_type == compression and name != 'mimetype':
+                        copied += copy_entry(zipf, src, raw_file, data, date_time, level)
+                        continue
+                    data = src.read(data)
+                zipf.writestr(_entry_info(name, date_time, compression), data,
+                              compress_type=compression, compresslevel=level)
+        os.replace(temp_path, output_path)
+    finally:
+        if src is not None:
+            src.close()
+            raw_file.close()
+        # Only left behind if writing failed
+        temp_path.unlink(missing_ok=True)
+
+    return copied
+
+def read_directory(directory):
+    """Every file under an extracted EPUB, as entries for write_epub()"""
+    directory = Path(directory)
+    return {path.relative_to(directory).as_posix(): path.read_bytes()
+            for path in directory.rglob('*') if path.is_file()}
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+In-memory EPUB package model.
+Parses container.xml, the OPF (manifest and spine) and toc.ncx once,
+keeps indexed lookups over them and serializes the derived artifacts
+(toc.ncx, content.opf, nav.xhtml) from that single model.
+"""
+
+import posixpath
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+CONTAINER_PATH = "META-INF/container.xml"
+
+NS = {
+    'container': 'urn:oasis:names:tc:opendocument:xmlns:container',
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'ncx': 'http://www.daisy.org/z3986/2005/ncx/',
+}
+
+NCX_MEDIA_TYPE = 'application/x-dtbncx+xml'
+XHTML_MEDIA_TYPE = 'application/xhtml+xml'
+
+def _namespace(element):
+    """Namespace prefix for find() calls, e.g. '{uri}' or ''"""
+    return element.tag[:element.tag.index('}') + 1] if element.tag.startswith('{') else ''
+
+def resolve_href(base_dir, href):
+    """Resolve an href relative to a directory inside the zip"""
+    path = href.split('#', 1)[0]
+    return posixpath.normpath(posixpath.join(base_dir, path)) if path else ''
+
+def render_nav_xhtml(nodes, title="Table of Contents"):
+    """
+    Serialize a TOC tree as a nested EPUB 3 nav document.
+
+    Args:
+        nodes: List of {'label', 'href', 'children'} dictionaries
+        title: Document and heading title
+
+    Returns:
+        nav.xhtml text
+    """
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<!DOCTYPE html>',
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">',
+        '<head>',
+        f'    <title>{escape(title)}</title>',
+        '    <meta charset="utf-8"/>',
+        '</head>',
+        '<body>',
+        '    <nav epub:type="toc" id="toc">',
+        '        <h1>Table of Contents</h1>',
+    ]
+
+    def render_list(items, indent):
+        lines.append(f'{indent}<ol>')
+        for node in items:
+            link = f'<a href={quoteattr(node["href"])}>{escape(node["label"])}</a>'
+            if node['children']:
+                lines.append(f'{indent}    <li>{link}')
+                render_list(node['children'], indent + '        ')
+                lines.append(f'{indent}    </li>')
+            else:
+                lines.append(f'{indent}    <li>{link}</li>')
+        lines.append(f'{indent}</ol>')
+
+    if nodes:
+        render_list(nodes, '        ')
+    lines += ['    </nav>', '</body>', '</html>', '']
+    return '\n'.join(lines)
+
+class EpubPackage:
+    """
+    Parsed OPF, spine and NCX of an EPUB.
+
+    Attributes:
+        names: Set of every entry name in the archive
+        opf_path: Zip path of the OPF
+        items_by_id: Manifest id -> item dict
+        items_by_href: Resolved zip path -> item dict
+        spine: List of manifest ids in reading order
+        xhtml_files: Set of zip paths of existing XHTML content documents
+        ncx_path: Zip path of toc.ncx, or None
+        nav_points: Nested list of {'label', 'src', 'path', 'children', 'element'}
+    """
+
+    def __init__(self, names, read):
+        """
+        Args:
+            names: Iterable of entry names in the archive
+            read: Function returning an entry's bytes by name
+        """
+        self.names = set(names)
+        self.opf_path = self._find_opf(read)
+        self.opf_dir = posixpath.dirname(self.opf_path)
+        self.opf_root = ET.fromstring(read(self.opf_path))
+        self._opf_ns = _namespace(self.opf_root)
+
+        self.manifest = self.opf_root.find(f'{self._opf_ns}manifest')
+        self.items_by_id = {}
+        self.items_by_href = {}
+        if self.manifest is not None:
+            for element in self.manifest.findall(f'{self._opf_ns}item'):
+                href = element.get('href', '')
+                item = {
+                    'id': element.get('id', ''),
+                    'href': href,
+                    'path': resolve_href(self.opf_dir, href),
+                    'media_type': element.get('media-type', ''),
+                    'properties': set((element.get('properties') or '').split()),
+                    'element': element,
+                }
+                self.items_by_id[item['id']] = item
+                self.items_by_href[item['path']] = item
+
+        spine = self.opf_root.find(f'{self._opf_ns}spine')
+        self.spine = [] if spine is None else [
+            itemref.get('idref') for itemref in spine.findall(f'{self._opf_ns}itemref')
+        ]
+
+        # Content documents actually present in the archive
+        self.xhtml_files = {name for name in self.names if name.endswith('.xhtml')}
+
+        self.ncx_path = self._find_ncx(spine)
+        self.ncx_root = None
+        self.nav_map = None
+        self.nav_points = []
+        if self.ncx_path and self.ncx_path in self.names:
+            self.ncx_root = ET.fromstring(read(self.ncx_path))
+            self._ncx_ns = _namespace(self.ncx_root)
+            self.nav_map = self.ncx_root.find(f'{self._ncx_ns}navMap')
+            if self.nav_map is not None:
+                self.nav_points = self._parse_nav_points(self.nav_map)
+
+    @classmethod
+    def from_zip(cls, zipf):
+        """Build the model from an open zipfile.ZipFile"""
+        return cls(zipf.namelist(), zipf.read)
+
+    def _find_opf(self, read):
+        """Resolve the OPF through container.xml, falling back to EPUB/content.opf"""
+        if CONTAINER_PATH in self.names:
+            container = ET.fromstring(read(CONTAINER_PATH))
+            rootfile = container.find('.//{%s}rootfile' % NS['container'])
+            if rootfile is None:
+                rootfile = container.find('.//rootfile')
+            if rootfile is not None and rootfile.get('full-path') in self.names:
+                return rootfile.get('full-path')
+        return "EPUB/content.opf"
+
+    def _find_ncx(self, spine):
+        """Locate toc.ncx via spine@toc or the manifest media type"""
+        if spine is not None and spine.get('toc') in self.items_by_id:
+            return self.items_by_id[spine.get('toc')]['path']
+        for item in self.items_by_id.values():
+            if item['media_type'] == NCX_MEDIA_TYPE:
+                return item['path']
+        return None
+
+    def _parse_nav_points(self, parent):
+        """Walk navPoints once into a nested node list"""
+        ncx_dir = posixpath.dirname(self.ncx_path)
+        nodes = []
+        for element in parent.findall(f'{self._ncx_ns}navPoint'):
+            text = element.find(f'{self._ncx_ns}navLabel/{self._ncx_ns}text')
+            content = element.find(f'{self._ncx_ns}content')
+            src = content.get('src', '') if content is not None else ''
+            nodes.append({
+                'label': (text.text or '') if text is not None else '',
+                'src': src,
+                'path': resolve_href(ncx_dir, src),
+                'children': self._parse_nav_points(element),
+                'element': element,
+            })
+        return nodes
+
+    @property
+    def nav_item(self):
+        """Manifest item of the EPUB 3 nav document, or None"""
+        for item in self.items_by_id.values():
+            if 'nav' in item['properties'] or item['href'].endswith('nav.xhtml'):
+                return item
+        return None
+
+    @property
+    def nav_path(self):
+        """Zip path where nav.xhtml lives (or will be written)"""
+        item = self.nav_item
+        return item['path'] if item else posixpath.join(self.opf_dir, 'nav.xhtml')
+
+    def prune_broken_nav_points(self):
+        """
+        Remove navPoints whose target document does not exist.
+
+        Returns:
+            Number of navPoints removed (nested ones go with their parent)
+        """
+        removed = 0
+
+        def prune(parent_element, nodes):
+            nonlocal removed
+            kept = []
+            for node in nodes:
+                if node['src'] and node['path'] not in self.xhtml_files:
+                    parent_element.remove(node['element'])
+                    removed += 1
+                    continue
+                node['children'] = prune(node['element'], node['children'])
+                kept.append(node)
+            return kept
+
+        if self.nav_map is not None:
+            self.nav_points = prune(self.nav_map, self.nav_points)
+        return removed
+
+    def ensure_nav_item(self):
+        """
+        Add nav.xhtml to the manifest if missing.
+
+        Returns:
+            True if the item was added
+        """
+        if self.manifest is None or self.nav_item is not None:
+            return False
+
+        element = ET.SubElement(self.manifest, f'{self._opf_ns}item')
+        element.set('id', 'nav')
+        element.set('href', 'nav.xhtml')
+        element.set('media-type', XHTML_MEDIA_TYPE)
+        element.set('properties', 'nav')
+        item = {
+            'id': 'nav',
+            'href': 'nav.xhtml',
+            'path': resolve_href(self.opf_dir, 'nav.xhtml'),
+            'media_type': XHTML_MEDIA_TYPE,
+            'properties': {'nav'},
+            'element': element,
+        }
+        self.items_by_id['nav'] = item
+        self.items_by_href[item['path']] = item
+        return True
+
+    def remove_empty_guide(self):
+        """
+        Drop an empty <guide> (EPUB 3 uses the nav document instead).
+
+        Returns:
+            True if a guide was removed
+        """
+        guide = self.opf_root.find(f'{self._opf_ns}guide')
+        if guide is not None and len(guide) == 0:
+            self.opf_root.remove(guide)
+            return True
+        return False
+
+    def serialize_ncx(self):
+        """toc.ncx bytes from the model"""
+        ET.register_namespace('', NS['ncx'])
+        return ET.tostring(self.ncx_root, encoding='utf-8', xml_declaration=True)
+
+    def serialize_opf(self):
+        """content.opf bytes from the model"""
+        ET.register_namespace('opf', NS['opf'])
+        ET.register_namespace('dc', NS['dc'])
+        return ET.tostring(self.opf_root, encoding='utf-8', xml_declaration=True)
+
+    def render_nav(self):
+        """Nested nav.xhtml text built from the NCX navPoints"""
+        nav_dir = posixpath.dirname(self.nav_path)
+
+        def convert(nodes):
+            converted = []
+            for node in nodes:
+                if not node['src']:
+                    continue
+                fragment = node['src'].split('#', 1)[1] if '#' in node['src'] else ''
+                href = posixpath.relpath(node['path'], nav_dir or '.')
+                converted.append({
+                    'label': node['label'],
+                    'href': f"{href}#{fragment}" if fragment else href,
+                    'children': convert(node['children']),
+                })
+            return converted
+
+        return render_nav_xhtml(convert(self.nav_points))
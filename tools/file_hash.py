@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Content hashes of files.
+Kept apart from build_cache.py so tools that only need a file's hash
+(validate_epub.py, word_reference.py, artifact_store.py) do not import
+the build cache and everything it depends on.
+"""
+
+import hashlib
+
+def hash_file(path):
+    """
+    Hash a file's contents.
+
+    Args:
+        path: Path to file
+
+    Returns:
+        SHA-256 hex digest, or None if the file does not exist
+    """
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+    return h.hexdigest()
@@ -2,132 +2,290 @@
 """
 Post-process Word document formatting.
 Applies professional formatting including page size, margins, and styles.
+
+Typography is written into the paragraph style definitions (Normal,
+Heading 1-3, Body Text, First Paragraph, Block Text, Quote and any other
+"...blockquote..." style) instead of onto every run, and the document
+body is walked once. Direct formatting is only written for
+paragraphs that cannot be restyled. Rules come from the `word_format`
+section of config.yaml, merged over DEFAULT_RULES.
+
+Documents whose body XML is larger than STREAM_THRESHOLD are not loaded
+whole: word_stream.py applies the same rules while streaming the body
+from the old zip into the new one.
 """
 
 import sys
 import os
+import copy
+import argparse
 from pathlib import Path
 
 try:
     from docx import Document
-    from docx.shared import Pt, Inches, RGBColor
-    from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
-    from docx.enum.section import WD_SECTION
+    from docx.shared import Pt, Inches
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.enum.text import WD_LINE_SPACING
 except ImportError:
     print("❌ python-docx not installed. Install with: pip install python-docx", file=sys.stderr)
     sys.exit(1)
 
-def format_word_document(doc_path):
+from book_config import PROJECT_ROOT, load_config
+
+# Sizes and spacing in points, indents and page dimensions in inches
+DEFAULT_RULES = {
+    'page': {
+        'width': 6,             # KDP Print 6x9
+        'height': 9,
+        'top_margin': 0.25,
+        'bottom_margin': 0.25,
+        'inside_margin': 0.375,  # Gutter
+        'outside_margin': 0.25,
+        'mirror_margins': True,
+    },
+    'styles': {
+        # Every paragraph that is not a heading (titles, TOC entries, captions, ...)
+        # is built on Normal; headings reset its indent and line spacing
+        'Normal': {'font': 'Georgia', 'size': 10, 'line_spacing': 1.45,
+                   'first_line_indent': 0.15, 'space_after': 3},
+        'Heading 1': {'font': 'Arial', 'size': 22, 'bold': True,
+                      'line_spacing': 1.0, 'first_line_indent': 0,
+                      'space_before': 0, 'space_after': 12, 'page_break_before': True},
+        'Heading 2': {'font': 'Arial', 'size': 15, 'bold': True,
+                      'line_spacing': 1.0, 'first_line_indent': 0,
+                      'space_before': 12, 'space_after': 6},
+        'Heading 3': {'font': 'Arial', 'size': 13, 'bold': True,
+                      'line_spacing': 1.0, 'first_line_indent': 0,
+                      'space_before': 10, 'space_after': 5},
+        'Body Text': {'font': 'Georgia', 'size': 10, 'line_spacing': 1.45,
+                      'first_line_indent': 0.15, 'space_after': 3},
+        'First Paragraph': {'base': 'Body Text', 'size': 10.5,
+                            'first_line_indent': 0, 'space_after': 6},
+        'Block Text': {'font': 'Georgia', 'size': 9.5, 'italic': True,
+                       'left_indent': 0.5, 'right_indent': 0.3, 'first_line_indent': 0,
+                       'space_before': 8, 'space_after': 8},
+        # Word's own blockquote style, used by many templates
+        'Quote': {'font': 'Georgia', 'size': 9.5, 'italic': True,
+                  'left_indent': 0.5, 'right_indent': 0.3, 'first_line_indent': 0,
+                  'space_before': 8, 'space_after': 8},
+    },
+    # Template styles with this in their name (e.g. "Custom Blockquote") get its rule
+    'blockquote_style': 'Block Text',
+    # Style given to body paragraphs that directly follow a heading
+    'first_paragraph_style': 'First Paragraph',
+    # Styles treated as ordinary body text
+    'body_styles': ['Body Text', 'Normal'],
+}
+
+# Uncompressed size of word/document.xml above which the body is streamed
+STREAM_THRESHOLD = 16 * 1024 * 1024
+
+def load_rules(config):
+    """
+    Merge the config's word_format section over DEFAULT_RULES.
+
+    Args:
+        config: Config dictionary (or None for defaults)
+
+    Returns:
+        Rules dictionary
+    """
+    rules = copy.deepcopy(DEFAULT_RULES)
+    overrides = (config or {}).get('word_format') or {}
+
+    rules['page'].update(overrides.get('page') or {})
+    for name, style_rules in (overrides.get('styles') or {}).items():
+        rules['styles'].setdefault(name, {}).update(style_rules or {})
+    for key in ('first_paragraph_style', 'body_styles', 'blockquote_style'):
+        if overrides.get(key):
+            rules[key] = overrides[key]
+
+    return rules
+
+def apply_page_setup(doc, page):
+    """Set page size and margins on every section"""
+    for section in doc.sections:
+        section.page_width = Inches(page['width'])
+        section.page_height = Inches(page['height'])
+        section.top_margin = Inches(page['top_margin'])
+        section.bottom_margin = Inches(page['bottom_margin'])
+        section.left_margin = Inches(page['inside_margin'])
+        section.right_margin = Inches(page['outside_margin'])
+
+        if page.get('mirror_margins'):
+            # Different margins for odd/even pages
+            section.different_first_page_header_footer = True
+            section.odd_and_even_pages_header_footer = True
+
+def _paragraph_style(doc_styles, name, base=None):
+    """Get a paragraph style, creating it if the template lacks it"""
+    try:
+        return doc_styles[name]
+    except KeyError:
+        style = doc_styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        try:
+            style.base_style = doc_styles[base or 'Normal']
+        except KeyError:
+            pass
+        return style
+
+def apply_style_rules(doc, styles, blockquote_style=None):
+    """
+    Write typography into the paragraph style definitions.
+
+    Args:
+        doc: python-docx Document
+        styles: Mapping of style name to rule dictionary
+        blockquote_style: Rule given to the template's other blockquote styles
+    """
+    write_style_rules(doc.styles, styles, blockquote_style)
+
+def write_style_rules(doc_styles, styles, blockquote_style=None):
+    """
+    Write typography into a python-docx Styles collection.
+
+    Args:
+        doc_styles: python-docx Styles (a document's, or one built from
+            a bare styles.xml part)
+        styles: Mapping of style name to rule dictionary
+        blockquote_style: Rule given to paragraph styles named like
+            "...blockquote..." that have no rule of their own
+    """
+    for name, rule in styles.items():
+        _write_style(_paragraph_style(doc_styles, name, rule.get('base')), rule)
+
+    if blockquote_style in styles:
+        for style in list(doc_styles):
+            if (style.type == WD_STYLE_TYPE.PARAGRAPH and style.name not in styles
+                    and 'blockquote' in style.name.lower()):
+                _write_style(style, styles[blockquote_style])
+
+def _write_style(style, rule):
+    """Write one rule into a style definition"""
+    font = style.font
+    fmt = style.paragraph_format
+
+    if 'font' in rule:
+        font.name = rule['font']
+    if 'size' in rule:
+        font.size = Pt(rule['size'])
+    if 'bold' in rule:
+        font.bold = rule['bold']
+    if 'italic' in rule:
+        font.italic = rule['italic']
+
+    if 'line_spacing' in rule:
+        fmt.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
+        fmt.line_spacing = rule['line_spacing']
+    if 'first_line_indent' in rule:
+        fmt.first_line_indent = Inches(rule['first_line_indent'])
+    if 'left_indent' in rule:
+        fmt.left_indent = Inches(rule['left_indent'])
+    if 'right_indent' in rule:
+        fmt.right_indent = Inches(rule['right_indent'])
+    if 'space_before' in rule:
+        fmt.space_before = Pt(rule['space_before'])
+    if 'space_after' in rule:
+        fmt.space_after = Pt(rule['space_after'])
+    if 'page_break_before' in rule:
+        fmt.page_break_before = rule['page_break_before']
+
+def _is_heading(style_name):
+    return style_name.startswith('Heading')
+
+def format_paragraphs(doc, rules):
+    """
+    Single pass over the body paragraphs.
+
+    Body paragraphs that follow a heading are moved to the first-paragraph
+    style; other paragraphs after a heading only lose their first-line
+    indent. Everything else is left to the style definitions.
+
+    Returns:
+        Number of paragraphs that needed direct formatting
+    """
+    first_style = rules['first_paragraph_style']
+    body_styles = set(rules['body_styles'])
+    has_first_style = first_style in rules['styles']
+    direct = 0
+
+    after_heading = False
+    for para in doc.paragraphs:
+        style_name = para.style.name if para.style is not None else 'Normal'
+
+        if _is_heading(style_name):
+            after_heading = True
+            continue
+
+        if after_heading and para.text.strip():
+            if has_first_style and style_name in body_styles:
+                para.style = doc.styles[first_style]
+            elif style_name != first_style:
+                para.paragraph_format.first_line_indent = Inches(0)
+                direct += 1
+            after_heading = False
+
+    return direct
+
+def format_word_document(doc_path, rules=None, stream=None):
     """
     Apply professional formatting to Word document.
-    
+
     Args:
         doc_path: Path to Word document
+        rules: Formatting rules (default: DEFAULT_RULES)
+        stream: Stream the document body instead of loading it whole
+            (default: only above STREAM_THRESHOLD)
     """
     if not os.path.exists(doc_path):
         print(f"❌ File not found: {doc_path}", file=sys.stderr)
         return 1
-    
+
+    rules = rules or load_rules(None)
+
     try:
+        # Imported here: word_stream uses this module's style writer
+        from word_stream import document_size, stream_format
+
+        if stream is None:
+            stream = document_size(doc_path) > STREAM_THRESHOLD
+        if stream:
+            direct = stream_format(doc_path, rules)
+            print(f"✅ Word document formatted (streamed): {doc_path} ({direct} direct override(s))")
+            return 0
+
         doc = Document(doc_path)
-        
-        # Set page size to 6x9 inches (KDP Print standard)
-        sections = doc.sections
-        for section in sections:
-            # Set page size to 6x9 inches
-            section.page_height = Inches(9)
-            section.page_width = Inches(6)
-            
-            # Set margins: Inside 0.375", Outside 0.25", Top/Bottom 0.25"
-            section.top_margin = Inches(0.25)
-            section.bottom_margin = Inches(0.25)
-            section.left_margin = Inches(0.375)  # Inside (gutter)
-            section.right_margin = Inches(0.25)  # Outside
-            
-            # Different margins for odd/even pages (mirror margins)
-            section.different_first_page_header_footer = True
-            section.odd_and_even_pages_header_footer = True
-        
-        # Apply professional formatting to paragraphs
-        for para in doc.paragraphs:
-            # Skip if empty
-            if not para.text.strip():
-                continue
-            
-            # Check if it's a heading
-            if para.style.name.startswith('Heading'):
-                if para.style.name == 'Heading 1':
-                    # Chapter titles - larger, bold, page break before
-                    para.paragraph_format.page_break_before = True
-                    para.paragraph_format.space_before = Pt(0)
-                    para.paragraph_format.space_after = Pt(12)
-                    if para.runs:
-                        para.runs[0].font.size = Pt(22)
-                        para.runs[0].font.bold = True
-                        para.runs[0].font.name = 'Arial'
-                elif para.style.name == 'Heading 2':
-                    para.paragraph_format.space_before = Pt(12)
-                    para.paragraph_format.space_after = Pt(6)
-                    if para.runs:
-                        para.runs[0].font.size = Pt(15)
-                        para.runs[0].font.bold = True
-                        para.runs[0].font.name = 'Arial'
-                elif para.style.name == 'Heading 3':
-                    para.paragraph_format.space_before = Pt(10)
-                    para.paragraph_format.space_after = Pt(5)
-                    if para.runs:
-                        para.runs[0].font.size = Pt(13)
-                        para.runs[0].font.bold = True
-                        para.runs[0].font.name = 'Arial'
-            else:
-                # Body text - professional formatting
-                para.paragraph_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
-                para.paragraph_format.line_spacing = 1.45
-                para.paragraph_format.first_line_indent = Inches(0.15)
-                para.paragraph_format.space_after = Pt(3)
-                
-                # Set font to Georgia 10pt
-                for run in para.runs:
-                    run.font.name = 'Georgia'
-                    run.font.size = Pt(10)
-        
-        # Format first paragraph after headings (no indent)
-        prev_para = None
-        for para in doc.paragraphs:
-            if prev_para and prev_para.style.name.startswith('Heading'):
-                # First paragraph after heading - no indent, slightly larger
-                para.paragraph_format.first_line_indent = Inches(0)
-                para.paragraph_format.space_after = Pt(6)
-                for run in para.runs:
-                    if run.font.size is None or run.font.size.pt < 10.5:
-                        run.font.size = Pt(10.5)
-            prev_para = para
-        
-        # Format blockquotes
-        for para in doc.paragraphs:
-            if 'blockquote' in para.style.name.lower() or para.style.name == 'Quote':
-                para.paragraph_format.left_indent = Inches(0.5)
-                para.paragraph_format.right_indent = Inches(0.3)
-                para.paragraph_format.space_before = Pt(8)
-                para.paragraph_format.space_after = Pt(8)
-                for run in para.runs:
-                    run.font.italic = True
-                    run.font.size = Pt(9.5)
-                    run.font.name = 'Georgia'
-        
+
+        apply_page_setup(doc, rules['page'])
+        apply_style_rules(doc, rules['styles'], rules.get('blockquote_style'))
+        direct = format_paragraphs(doc, rules)
+
         # Save the formatted document
         doc.save(doc_path)
-        print(f"✅ Word document formatted: {doc_path}")
+        print(f"✅ Word document formatted: {doc_path} ({direct} direct override(s))")
         return 0
-        
+
     except Exception as e:
         print(f"❌ Error formatting Word document: {e}", file=sys.stderr)
         return 1
 
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Apply print formatting to a Word document.")
+    parser.add_argument('doc_path', help="Word document to format in place")
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--stream', dest='stream', action='store_true', default=None,
+                        help="Stream the document body instead of loading it whole "
+                             f"(default: only above {STREAM_THRESHOLD // (1024 * 1024)}MB of body XML)")
+    parser.add_argument('--no-stream', dest='stream', action='store_false',
+                        help="Always load the whole document")
+    args = parser.parse_args()
+
+    config_file = Path(args.config) if args.config else PROJECT_ROOT / "config.yaml"
+    config = load_config(config_file) if config_file.is_file() else None
+
+    return format_word_document(args.doc_path, load_rules(config), stream=args.stream)
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: format_word.py <word_document.docx>", file=sys.stderr)
-        sys.exit(1)
-    
-    doc_path = sys.argv[1]
-    sys.exit(format_word_document(doc_path))
+    sys.exit(main())
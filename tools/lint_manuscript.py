@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Lint the manuscript before building.
+Parses every front matter, chapter and back matter file (in a process
+pool, with results cached by content hash in
+<output_dir>/.lint-cache.json), builds one index of the book's headings,
+anchors, link targets, images and footnotes, and reports what a build
+would trip over:
+
+- links to anchors or files that do not exist
+- images that cannot be found
+- duplicate ids, including headings whose automatic id clashes with the
+  ids the build gives each section (section-chapter-1, section-conclusion, ...)
+- skipped heading levels
+- undefined, duplicated or unused footnotes
+- reference links whose definition is missing or in another file
+
+Heading ids follow pandoc's automatic identifier rules, numbered across
+the whole book the way pandoc sees the assembled manuscript. Footnotes
+and reference-link definitions are checked per file, since pandoc_ast.py
+reads each file on its own and they only resolve within one file.
+
+Usage: lint_manuscript.py [project_root] [--config file] [--jobs N] [--no-cache] [--strict]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from urllib.parse import unquote
+
+from book_config import PROJECT_ROOT, load_config, output_dir
+from manuscript import epub_sections, manuscript_paths
+from optimize_images import IMAGE_PATTERNS, SCHEME_RE, resolve_image
+
+CACHE_FILENAME = ".lint-cache.json"
+LINT_VERSION = 2
+
+# Below this many files to parse, a process pool costs more than it saves
+PARALLEL_MIN_FILES = 8
+
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+ATX_HEADING_RE = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?[ \t]*$')
+SETEXT_RE = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+HEADING_ATTRIBUTES_RE = re.compile(r'\s*\{([^{}]*)\}\s*$')
+CLOSING_HASHES_RE = re.compile(r'\s+#+$')
+ID_ATTRIBUTE_RE = re.compile(r'(?:^|\s)#([^\s}]+)')
+ATTRIBUTE_ANCHOR_RE = re.compile(r'\{[^{}]*?(?<![\w&])#([A-Za-z][\w:.-]*)[^{}]*\}')
+HTML_ID_RE = re.compile(r'<[A-Za-z][^>]*?\bid\s*=\s*["\']([^"\']+)["\']')
+INLINE_LINK_RE = re.compile(r'(?<!!)\[[^\]]*\]\(\s*<?([^)\s>]+)')
+REFERENCE_LINK_RE = re.compile(r'^ {0,3}\[(?!\^)[^\]]+\]:\s*<?(\S+?)>?(?:\s|$)')
+REFERENCE_DEF_RE = re.compile(r'^ {0,3}\[(?!\^)([^\]]+)\]:')
+# [text][label] and [label][]; shortcut [label] only counts where a definition exists
+FULL_REFERENCE_RE = re.compile(r'\[([^\[\]]+)\]\[([^\[\]]*)\]')
+SHORTCUT_REFERENCE_RE = re.compile(r'(?<![\]\\])\[([^\[\]^][^\[\]]*)\](?![\[(:])')
+HTML_HREF_RE = re.compile(r'<a\b[^>]*?\bhref\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+FOOTNOTE_REF_RE = re.compile(r'\[\^([^\]\s]+)\](?!:)')
+FOOTNOTE_DEF_RE = re.compile(r'^ {0,3}\[\^([^\]\s]+)\]:')
+CODE_SPAN_RE = re.compile(r'(`+).+?\1')
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+MARKDOWN_LINK_TEXT_RE = re.compile(r'!?\[([^\]]*)\](?:\([^)]*\)|\[[^\]]*\])')
+
+def auto_identifier(text):
+    """
+    pandoc's automatic identifier for a heading (before numbering duplicates).
+
+    Formatting, links and footnotes are dropped, everything except
+    letters, digits, '_', '-' and '.' is removed, spaces become hyphens,
+    letters are lowercased and anything before the first letter is cut.
+    """
+    text = FOOTNOTE_REF_RE.sub('', text)
+    text = MARKDOWN_LINK_TEXT_RE.sub(r'\1', text)
+    text = HTML_TAG_RE.sub('', text)
+    text = re.sub(r'(?<!\w)[*_~`]+|[*_~`]+(?!\w)', '', text)
+    kept = ''.join(c for c in text.lower() if c.isalnum() or c in '_-.' or c.isspace())
+    identifier = '-'.join(kept.split())
+    for index, c in enumerate(identifier):
+        if c.isalpha():
+            return identifier[index:]
+    return 'section'
+
+def reference_label(label):
+    """Reference link labels match case-insensitively, with whitespace collapsed"""
+    return ' '.join(label.lower().split())
+
+def _heading(level, raw, line):
+    """[line, level, text, id, explicit] for a heading"""
+    explicit = None
+    match = HEADING_ATTRIBUTES_RE.search(raw)
+    if match:
+        id_match = ID_ATTRIBUTE_RE.search(match.group(1))
+        explicit = id_match.group(1) if id_match else None
+        raw = raw[:match.start()]
+    text = raw.strip()
+    return [line, level, text, explicit or auto_identifier(text), explicit is not None]
+
+def scan(text):
+    """
+    Collect the headings, anchors, links, images and footnotes in one file.
+
+    Fenced code blocks and code spans are skipped.
+
+    Args:
+        text: Markdown source
+
+    Returns:
+        Dictionary of [line, ...] lists: 'headings' ([line, level, text,
+        id, explicit]), 'anchors', 'links', 'images', 'footnote_refs',
+        'footnote_defs', 'reference_defs' ([line, value]) and
+        'reference_uses' ([line, label, explicit])
+    """
+    facts = {'headings': [], 'anchors': [], 'links': [], 'images': [],
+             'footnote_refs': [], 'footnote_defs': [], 'reference_defs': [], 'reference_uses': []}
+    fence = None
+    previous = ''
+    before_previous = ''
+    for number, line in enumerate(text.splitlines(), 1):
+        match = FENCE_RE.match(line)
+        if fence:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+            previous, before_previous = '', previous
+            continue
+        if match:
+            fence = match.group(1)
+            previous, before_previous = '', previous
+            continue
+
+        heading = ATX_HEADING_RE.match(line)
+        setext = SETEXT_RE.match(line)
+        if heading:
+            raw = CLOSING_HASHES_RE.sub('', heading.group(2) or '')
+            facts['headings'].append(_heading(len(heading.group(1)), raw, number))
+        elif (setext and previous.strip() and not before_previous.strip()
+              and not ATX_HEADING_RE.match(previous) and not previous.lstrip().startswith(('<', '|', '-', '*', '>'))):
+            facts['headings'].append(_heading(1 if setext.group(1)[0] == '=' else 2, previous, number - 1))
+        else:
+            code_free = CODE_SPAN_RE.sub('', line)
+            for anchor in ATTRIBUTE_ANCHOR_RE.findall(code_free) + HTML_ID_RE.findall(code_free):
+                facts['anchors'].append([number, anchor])
+            for pattern in IMAGE_PATTERNS:
+                for match in pattern.finditer(code_free):
+                    if not SCHEME_RE.match(match.group(2)):
+                        facts['images'].append([number, match.group(2)])
+            image_definition = any(pattern.match(code_free) for pattern in IMAGE_PATTERNS)
+            targets = INLINE_LINK_RE.findall(code_free) + HTML_HREF_RE.findall(code_free)
+            if not image_definition:
+                targets += REFERENCE_LINK_RE.findall(code_free)
+            for target in targets:
+                facts['links'].append([number, target])
+            for label in FOOTNOTE_DEF_RE.findall(code_free):
+                facts['footnote_defs'].append([number, label])
+            for label in FOOTNOTE_REF_RE.findall(code_free):
+                facts['footnote_refs'].append([number, label])
+            definition = REFERENCE_DEF_RE.match(code_free)
+            if definition:
+                facts['reference_defs'].append([number, reference_label(definition.group(1))])
+            else:
+                for text, label in FULL_REFERENCE_RE.findall(code_free):
+                    facts['reference_uses'].append([number, reference_label(label or text), True])
+                for label in SHORTCUT_REFERENCE_RE.findall(FULL_REFERENCE_RE.sub('', code_free)):
+                    facts['reference_uses'].append([number, reference_label(label), False])
+        previous, before_previous = line, previous
+    return facts
+
+def _content_key(text):
+    return hashlib.sha256(f"{LINT_VERSION}\0{text}".encode('utf-8')).hexdigest()
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache.get('files', {}) if cache.get('version') == LINT_VERSION else {}
+
+def _save_cache(cache_file, entries):
+    temp_path = cache_file.with_name(cache_file.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': LINT_VERSION, 'files': entries}, f)
+    os.replace(temp_path, cache_file)
+
+def collect_facts(texts, cache_file=None, jobs=None):
+    """
+    Scan each text, reusing cached results for unchanged content.
+
+    Args:
+        texts: List of Markdown sources
+        cache_file: Cache path (None to disable caching)
+        jobs: Number of worker processes (default: CPU count)
+
+    Returns:
+        Tuple of (list of facts in the order of texts, number scanned)
+    """
+    cache = _load_cache(cache_file) if cache_file else {}
+    keys = [_content_key(text) for text in texts]
+    todo = {key: text for key, text in zip(keys, texts) if key not in cache}
+
+    if len(todo) >= PARALLEL_MIN_FILES and jobs != 1:
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = jobs or min(len(todo), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            scanned = executor.map(scan, todo.values(), chunksize=max(1, len(todo) // (jobs * 4)))
+            cache.update(zip(todo, scanned))
+    else:
+        cache.update((key, scan(text)) for key, text in todo.items())
+
+    if cache_file:
+        _save_cache(cache_file, {key: cache[key] for key in keys})
+    return [cache[key] for key in keys], len(todo)
+
+def section_ids(paths):
+    """Ids the build puts on the section wrapping each component"""
+    sections = epub_sections({
+        'front_matter': [(name, '') for name, _ in paths['front_matter']],
+        'chapters': [''] * len(paths['chapters']),
+        'conclusion': '' if paths['conclusion'] else None,
+        'acknowledgments': '' if paths['acknowledgments'] else None,
+        'appendices': [''] * len(paths['appendices']),
+    })
+    return set(HTML_ID_RE.findall(''.join(opening for opening, _, _ in sections)))
+
+def check_book(project_root, files, facts, reserved_ids=()):
+    """
+    Cross-check the index of every file.
+
+    Args:
+        project_root: Project root directory
+        files: Paths in reading order
+        facts: scan() results for each file
+        reserved_ids: Ids the build adds itself
+
+    Returns:
+        List of (severity, path, line, message) tuples, severity being
+        'error' or 'warning'
+    """
+    project_root = Path(project_root)
+    issues = []
+    names = [os.path.relpath(path, project_root) for path in files]
+
+    # Explicit ids must be unique; automatic ones are numbered like pandoc does
+    explicit = {}
+    for name, file_facts in zip(names, facts):
+        for line, _, _, identifier, is_explicit in file_facts['headings']:
+            if is_explicit:
+                explicit.setdefault(identifier, []).append((name, line))
+        for line, identifier in file_facts['anchors']:
+            explicit.setdefault(identifier, []).append((name, line))
+    for identifier, places in explicit.items():
+        for name, line in places[1:]:
+            first_name, first_line = places[0]
+            issues.append(('error', name, line, f"duplicate id #{identifier} (first used at {first_name}:{first_line})"))
+        if identifier in reserved_ids:
+            name, line = places[0]
+            issues.append(('error', name, line, f"id #{identifier} is also given to a section by the build"))
+
+    anchors = set(explicit) | set(reserved_ids)
+    for name, file_facts in zip(names, facts):
+        previous_level = None
+        for line, level, text, identifier, is_explicit in file_facts['headings']:
+            if not is_explicit:
+                base, number = identifier, 0
+                while identifier in anchors:
+                    number += 1
+                    identifier = f"{base}-{number}"
+                if identifier != base and base in reserved_ids:
+                    issues.append(('warning', name, line,
+                                   f"heading \"{text}\" gets id #{base}, which the build also gives a section "
+                                   f"(duplicate id in the EPUB); add an explicit {{#id}}"))
+                    identifier = base
+            anchors.add(identifier)
+            if previous_level is not None and level > previous_level + 1:
+                issues.append(('warning', name, line, f"heading level skips from h{previous_level} to h{level}"))
+            previous_level = level
+
+    # Footnotes and link references resolve within one file (each is parsed on its own)
+    footnote_files = {}
+    reference_files = {}
+    for name, file_facts in zip(names, facts):
+        for _, label in file_facts['footnote_defs']:
+            footnote_files.setdefault(label, name)
+        for _, label in file_facts['reference_defs']:
+            reference_files.setdefault(label, name)
+
+    for path, name, file_facts in zip(files, names, facts):
+        definitions = {}
+        for line, label in file_facts['footnote_defs']:
+            if label in definitions:
+                issues.append(('warning', name, line, f"footnote [^{label}] is defined again "
+                                                      f"(first at line {definitions[label]}); pandoc keeps one"))
+            else:
+                definitions[label] = line
+        references = {label for _, label in file_facts['footnote_refs']}
+        for label, line in definitions.items():
+            if label not in references:
+                issues.append(('warning', name, line, f"footnote [^{label}] is never referenced in this file"))
+        for line, label in file_facts['footnote_refs']:
+            if label in definitions:
+                continue
+            if label in footnote_files:
+                issues.append(('error', name, line, f"footnote [^{label}] is only defined in "
+                                                    f"{footnote_files[label]}; define it in this file"))
+            else:
+                issues.append(('error', name, line, f"footnote [^{label}] is not defined"))
+
+        link_definitions = {label for _, label in file_facts['reference_defs']}
+        for line, label, explicit in file_facts['reference_uses']:
+            if label in link_definitions:
+                continue
+            if label in reference_files:
+                issues.append(('error', name, line, f"link reference [{label}] is only defined in "
+                                                    f"{reference_files[label]}; it will print as literal text"))
+            elif explicit:
+                issues.append(('warning', name, line, f"link reference [{label}] is not defined"))
+
+        for line, reference in file_facts['images']:
+            if resolve_image(project_root, unquote(reference)) is None:
+                issues.append(('error', name, line, f"image not found: {reference}"))
+
+        for line, target in file_facts['links']:
+            if SCHEME_RE.match(target) or target.startswith('//'):
+                continue
+            target_path, _, fragment = target.partition('#')
+            if not target_path:
+                if unquote(fragment) not in anchors:
+                    issues.append(('error', name, line, f"link to missing anchor #{fragment}"))
+                continue
+            target_path = unquote(target_path)
+            bases = (Path(path).parent, project_root, project_root / "book_content" / "chapters")
+            found = next((base / target_path for base in bases if (base / target_path).exists()), None)
+            if found is None:
+                issues.append(('error', name, line, f"link to missing file: {target_path}"))
+            elif found.suffix == '.md':
+                issues.append(('warning', name, line, f"link to source file {target_path} will not resolve "
+                                                      f"in the built book; link to a heading (#id) instead"))
+
+    order = {name: index for index, name in enumerate(names)}
+    issues.sort(key=lambda issue: (order.get(issue[1], len(order)), issue[2]))
+    return issues
+
+def lint_manuscript(project_root, config, jobs=None, use_cache=True, log=print):
+    """
+    Lint every manuscript file.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        jobs: Number of worker processes (default: CPU count)
+        use_cache: Reuse and update the per-file cache
+        log: Function called with progress lines and each issue
+
+    Returns:
+        List of (severity, path, line, message) tuples
+
+    Raises:
+        FileNotFoundError: If no chapters are found
+    """
+    start = time.perf_counter()
+    project_root = Path(project_root)
+    paths = manuscript_paths(project_root, config)
+
+    issues = []
+    files = []
+    for _, path in paths['front_matter']:
+        if path.is_file():
+            files.append(path)
+        else:
+            issues.append(('error', os.path.relpath(path, project_root), 0, "front matter file is missing"))
+    files += paths['chapters']
+    files += [path for path in (paths['conclusion'], paths['acknowledgments']) if path is not None]
+    files += paths['appendices']
+
+    texts = [path.read_text(encoding='utf-8') for path in files]
+    cache_file = None
+    if use_cache:
+        out_dir = output_dir(project_root, config)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        cache_file = out_dir / CACHE_FILENAME
+    facts, scanned = collect_facts(texts, cache_file, jobs)
+    issues += check_book(project_root, files, facts, section_ids(paths))
+
+    for severity, name, line, message in issues:
+        icon = "❌" if severity == 'error' else "⚠️ "
+        log(f"   {icon} {name}:{line}: {message}" if line else f"   {icon} {name}: {message}")
+
+    errors = sum(1 for issue in issues if issue[0] == 'error')
+    elapsed = (time.perf_counter() - start) * 1000
+    summary = (f"{len(files)} file(s) ({len(files) - scanned} cached): "
+               f"{errors} error(s), {len(issues) - errors} warning(s) in {elapsed:.0f}ms")
+    log(f"   {'❌' if errors else '✅'} Lint: {summary}")
+    return issues
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Check the manuscript for broken links, images, ids and headings.")
+    parser.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--no-cache', action='store_true', help="Scan every file even if unchanged")
+    parser.add_argument('--strict', action='store_true', help="Exit non-zero on warnings too")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    project_root = Path(args.project_root)
+    config = load_config(Path(args.config) if args.config else project_root / "config.yaml")
+
+    print("🔎 Linting manuscript...")
+    try:
+        issues = lint_manuscript(project_root, config, args.jobs, use_cache=not args.no_cache)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    failing = [issue for issue in issues if issue[0] == 'error' or args.strict]
+    return 1 if failing else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
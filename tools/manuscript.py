@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Manuscript model shared by the build tools.
+Reads every book component once and yields the format-specific
+Markdown that the generate scripts stream to pandoc's stdin.
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, FRONT_MATTER_FILES, load_config
+from detect_chapters import chapter_manifest
+
+# EPUB section classes/types for each front matter file
+EPUB_FRONT_MATTER = {
+    'title_page.md': ('title-page', 'titlepage'),
+    'copyright_page.md': ('copyright-page', 'copyright-page'),
+    'dedication.md': ('dedication', 'dedication'),
+    'table_of_contents.md': ('toc', 'frontmatter toc'),
+    'preface.md': ('preface', 'preface'),
+}
+
+# PDF div classes for each front matter file
+PDF_FRONT_MATTER = {
+    'title_page.md': 'title-page',
+    'copyright_page.md': 'copyright-page',
+    'dedication.md': 'dedication',
+    'table_of_contents.md': 'toc',
+    'preface.md': 'preface',
+}
+
+# Book fields each format's metadata block carries
+METADATA_KEYS = {
+    'epub': ['title', 'subtitle', 'publisher', 'date', 'language', 'description', 'rights'],
+    'pdf': ['title', 'subtitle', 'publisher', 'date'],
+    'word': ['title', 'subtitle', 'publisher', 'date'],
+}
+
+def manuscript_paths(project_root, config, chapter_paths=None):
+    """
+    Locate every book component.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        chapter_paths: Chapter files from detect_chapters() (detected if None)
+
+    Returns:
+        Dictionary shaped like load_manuscript()'s, with paths instead of
+        text ('front_matter' paths are listed even if the file is missing)
+
+    Raises:
+        FileNotFoundError: If no chapters are found
+    """
+    content_dir = Path(project_root) / "book_content"
+    manifest = chapter_manifest(project_root, config)
+
+    if chapter_paths is None:
+        chapter_paths = manifest['chapters']
+    if not chapter_paths:
+        raise FileNotFoundError("No chapters found")
+
+    acknowledgments_path = content_dir / "back_matter" / "acknowledgments.md"
+    return {
+        'front_matter': [(name, content_dir / "front_matter" / name) for name in FRONT_MATTER_FILES],
+        'chapters': [Path(path) for path in chapter_paths],
+        'conclusion': Path(manifest['conclusion']) if manifest['conclusion'] else None,
+        'acknowledgments': acknowledgments_path if acknowledgments_path.is_file() else None,
+        'appendices': [Path(path) for path in manifest['appendices']],
+    }
+
+def load_manuscript(project_root, config, chapter_paths=None):
+    """
+    Read every book component once.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        chapter_paths: Chapter files from detect_chapters() (detected if None)
+
+    Returns:
+        Manuscript dictionary with 'front_matter' (list of (name, text)),
+        'chapters' (list of text), 'conclusion' and 'acknowledgments'
+        (text or None) and 'appendices' (list of text, after the
+        acknowledgments)
+
+    Raises:
+        FileNotFoundError: If no chapters or a front matter file is missing
+    """
+    paths = manuscript_paths(project_root, config, chapter_paths)
+
+    def read(path):
+        return None if path is None else path.read_text(encoding='utf-8')
+
+    return {
+        'front_matter': [(name, read(path)) for name, path in paths['front_matter']],
+        'chapters': [read(path) for path in paths['chapters']],
+        'conclusion': read(paths['conclusion']),
+        'acknowledgments': read(paths['acknowledgments']),
+        'appendices': [read(path) for path in paths['appendices']],
+    }
+
+def manuscript_texts(manuscript):
+    """Every component's text in reading order"""
+    texts = [text for _, text in manuscript['front_matter']] + manuscript['chapters']
+    texts += [text for text in (manuscript['conclusion'], manuscript['acknowledgments']) if text is not None]
+    return texts + manuscript['appendices']
+
+def _ensure_newline(text):
+    """Match `cat` followed by `echo` in the shell scripts"""
+    return text if text.endswith('\n') or not text else text + '\n'
+
+def metadata_block(book, keys):
+    """Build the YAML metadata header used by the generate scripts"""
+    lines = ['---']
+    for key in keys:
+        value = book.get(key, 'en-US' if key == 'language' else '')
+        if key == 'language':
+            lines.append(f'{key}: {value}')
+        else:
+            lines.append(f'{key}: "{value}"')
+    lines.append('---')
+    return '\n'.join(lines) + '\n\n'
+
+def wrap(opening, text, closing):
+    """Wrap a component in an HTML element, followed by a blank line"""
+    return f'{opening}\n{_ensure_newline(text)}{closing}\n\n'
+
+def epub_sections(manuscript):
+    """
+    List the EPUB sections in reading order.
+
+    Args:
+        manuscript: Manuscript dictionary from load_manuscript()
+
+    Returns:
+        List of (opening tag, Markdown text, closing tag) tuples; the wrapper
+        ids are prefixed with "section-" so they never repeat a heading's id
+    """
+    sections = []
+
+    for name, text in manuscript['front_matter']:
+        css_class, epub_type = EPUB_FRONT_MATTER[name]
+        sections.append((f'<section class="{css_class}" epub:type="{epub_type}">', text, '</section>'))
+
+    for chapter_num, text in enumerate(manuscript['chapters'], 1):
+        sections.append((f'<section class="chapter" epub:type="chapter" id="section-chapter-{chapter_num}">',
+                         text, '</section>'))
+
+    if manuscript['conclusion'] is not None:
+        sections.append(('<section class="chapter" epub:type="chapter conclusion" id="section-conclusion">',
+                         manuscript['conclusion'], '</section>'))
+
+    if manuscript['acknowledgments'] is not None:
+        sections.append(('<section class="acknowledgments" epub:type="acknowledgments" '
+                         'id="section-acknowledgments">', manuscript['acknowledgments'], '</section>'))
+
+    for appendix_num, text in enumerate(manuscript['appendices'], 1):
+        sections.append((f'<section class="appendix" epub:type="appendix" id="section-appendix-{appendix_num}">',
+                         text, '</section>'))
+
+    return sections
+
+def epub_matter(manuscript):
+    """
+    List the book division of each EPUB section, in epub_sections() order.
+
+    Args:
+        manuscript: Manuscript dictionary from load_manuscript()
+
+    Returns:
+        List of 'frontmatter', 'bodymatter' or 'backmatter'
+    """
+    body = len(manuscript['chapters']) + (manuscript['conclusion'] is not None)
+    back = (manuscript['acknowledgments'] is not None) + len(manuscript['appendices'])
+    return ['frontmatter'] * len(manuscript['front_matter']) + ['bodymatter'] * body + ['backmatter'] * back
+
+def iter_epub(manuscript, config):
+    """Yield the combined Markdown for the EPUB writer, one component at a time"""
+    yield metadata_block(config['book'], METADATA_KEYS['epub'])
+
+    for opening, text, closing in epub_sections(manuscript):
+        yield wrap(opening, text, closing)
+
+def iter_pdf(manuscript, config):
+    """Yield the combined Markdown for the HTML/WeasyPrint path"""
+    yield metadata_block(config['book'], METADATA_KEYS['pdf'])
+
+    for name, text in manuscript['front_matter']:
+        yield wrap(f'<div class="frontmatter {PDF_FRONT_MATTER[name]}">', text, '</div>')
+
+    for text in manuscript['chapters']:
+        yield wrap('<div class="chapter">', text, '</div>')
+
+    if manuscript['conclusion'] is not None:
+        yield wrap('<div class="chapter">', manuscript['conclusion'], '</div>')
+
+    if manuscript['acknowledgments'] is not None:
+        yield wrap('<div class="acknowledgments">', manuscript['acknowledgments'], '</div>')
+
+    for text in manuscript['appendices']:
+        yield wrap('<div class="appendix">', text, '</div>')
+
+def pdf_chunks(manuscript, config):
+    """
+    Split the PDF Markdown at chapter boundaries.
+
+    Args:
+        manuscript: Manuscript dictionary from load_manuscript()
+        config: Config dictionary
+
+    Returns:
+        List of Markdown strings: the metadata block and front matter, then
+        one per chapter (acknowledgments stay with the last chapter) and
+        one per appendix
+    """
+    chunks = []
+    for piece in iter_pdf(manuscript, config):
+        if not chunks or piece.startswith(('<div class="chapter">', '<div class="appendix">')):
+            chunks.append(piece)
+        else:
+            chunks[-1] += piece
+    return chunks
+
+def iter_word(manuscript, config):
+    """Yield the combined Markdown for the DOCX writer"""
+    yield metadata_block(config['book'], METADATA_KEYS['word'])
+
+    body = [text for _, text in manuscript['front_matter']] + manuscript['chapters']
+    if manuscript['conclusion'] is not None:
+        body.append(manuscript['conclusion'])
+
+    # Back matter: a page break between components, none after the last
+    back = [manuscript['acknowledgments']] if manuscript['acknowledgments'] is not None else []
+    back += manuscript['appendices']
+    body += back[:-1]
+
+    for text in body:
+        yield f'{_ensure_newline(text)}\n\\newpage\n\n'
+
+    if back:
+        yield f'{_ensure_newline(back[-1])}\n'
+
+STREAMS = {
+    'epub': iter_epub,
+    'pdf': iter_pdf,
+    'word': iter_word,
+}
+
+def assemble(fmt, manuscript, config):
+    """Assemble the combined Markdown for a format as one string"""
+    return ''.join(STREAMS[fmt](manuscript, config))
+
+def write_stream(chunks, stream):
+    """
+    Write Markdown chunks to a binary stream (e.g. pandoc's stdin).
+
+    Returns:
+        Number of bytes written
+    """
+    written = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        stream.write(data)
+        written += len(data)
+    return written
+
+def main():
+    """
+    CLI interface: stream the combined Markdown for a format to stdout.
+
+    Usage: manuscript.py <epub|pdf|word> [project_root] [--config config.yaml] [--optimize-images]
+    """
+    parser = argparse.ArgumentParser(description="Write the combined manuscript Markdown to stdout.")
+    parser.add_argument('format', choices=sorted(STREAMS))
+    parser.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--optimize-images', action='store_true',
+                        help="Point image references at the format's optimized derivatives")
+    args = parser.parse_args()
+
+    project_root = Path(args.project_root)
+    config = load_config(Path(args.config) if args.config else project_root / "config.yaml")
+
+    try:
+        manuscript = load_manuscript(project_root, config)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    if args.optimize_images:
+        # The generate scripts report on the images in their own stage first
+        from optimize_images import optimized
+        config, manuscript = optimized(project_root, config, manuscript, args.format,
+                                       log=lambda message: None)
+
+    try:
+        write_stream(STREAMS[args.format](manuscript, config), sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        # The reader (pandoc) exited early; it reports its own error
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
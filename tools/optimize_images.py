@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Format-specific image derivatives.
+Finds the images the manuscript references and the configured cover,
+and writes a resized, recompressed copy of each for the formats being
+built: screen-sized for the EPUB (the cover gets its own, larger
+profile) and the print DPI at the text block width for the PDF and Word
+outputs. Images are processed in parallel and cached under
+<output_dir>/.image-cache/ by source hash plus target profile, so
+unchanged images are never reprocessed.
+
+Only JPEG and PNG images are processed; other images, and every image
+when Pillow is not installed, are used as they are. Images are never
+enlarged, and a derivative that would be larger than its source (or
+that Pillow cannot read) is a copy of the source.
+
+Usage: optimize_images.py [project_root] [--formats epub,pdf,word] [--jobs N] [--cover]
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from importlib.util import find_spec
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, FORMATS, load_config, output_dir
+from manuscript import load_manuscript, manuscript_texts
+
+CACHE_DIRNAME = ".image-cache"
+CACHE_VERSION = 1
+INDEX_FILENAME = "sources.json"
+
+# config.yaml `images:` keys and their defaults
+DEFAULTS = {
+    'optimize': True,
+    'epub_max_width': 1600,
+    'epub_max_height': 2400,
+    'epub_quality': 80,
+    'cover_max_width': 1600,
+    'cover_max_height': 2560,
+    'cover_quality': 85,
+    'print_dpi': 300,
+    'print_width': 5.375,  # Text block width in inches (6in trim less the KDP margins)
+    'print_quality': 90,
+}
+
+# Derivative profile used for each output format
+FORMAT_PROFILES = {
+    'epub': 'epub',
+    'pdf': 'print',
+    'word': 'print',
+}
+
+PIL_FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+}
+
+MARKDOWN_IMAGE_RE = re.compile(r'(!\[[^\]]*\]\(\s*<?)([^)\s>]+)(>?(?:\s+(?:"[^"]*"|\'[^\']*\'))?\s*\))')
+HTML_IMAGE_RE = re.compile(r'(<img\b[^>]*?\bsrc\s*=\s*["\'])([^"\']+)(["\'])', re.IGNORECASE)
+REFERENCE_RE = re.compile(r'^( {0,3}\[[^\]]+\]:\s*<?)(\S+?\.(?:jpe?g|png|gif|svg|webp))(>?(?:\s|$))',
+                          re.IGNORECASE | re.MULTILINE)
+SCHEME_RE = re.compile(r'^[a-z][a-z0-9+.-]*:', re.IGNORECASE)
+
+IMAGE_PATTERNS = (MARKDOWN_IMAGE_RE, HTML_IMAGE_RE, REFERENCE_RE)
+
+def image_settings(config):
+    """Image settings from config.yaml merged over DEFAULTS"""
+    return dict(DEFAULTS, **config.get('images', {}))
+
+def image_profiles(settings):
+    """
+    Derivative profiles for the image settings.
+
+    Returns:
+        Dictionary mapping profile name to max_width, max_height (None
+        for no limit), quality and dpi (None to keep the source's)
+    """
+    return {
+        'epub': {'max_width': settings['epub_max_width'], 'max_height': settings['epub_max_height'],
+                 'quality': settings['epub_quality'], 'dpi': None},
+        'cover': {'max_width': settings['cover_max_width'], 'max_height': settings['cover_max_height'],
+                  'quality': settings['cover_quality'], 'dpi': None},
+        'print': {'max_width': round(settings['print_width'] * settings['print_dpi']), 'max_height': None,
+                  'quality': settings['print_quality'], 'dpi': settings['print_dpi']},
+    }
+
+def find_images(text):
+    """
+    List the local image references in Markdown text.
+
+    Args:
+        text: Markdown (inline images, reference definitions and <img> tags)
+
+    Returns:
+        List of references as written, in order, without duplicates
+    """
+    references = []
+    for pattern in IMAGE_PATTERNS:
+        for match in pattern.finditer(text):
+            reference = match.group(2)
+            if not SCHEME_RE.match(reference) and reference not in references:
+                references.append(reference)
+    return references
+
+def resolve_image(project_root, reference):
+    """
+    Find the file an image reference points at.
+
+    References are resolved against the project root, then the chapters
+    directory, like the EPUB and PDF builders do.
+
+    Returns:
+        Path to the image, or None if it does not exist
+    """
+    project_root = Path(project_root)
+    for base in (project_root, project_root / "book_content" / "chapters"):
+        path = base / reference
+        if path.is_file():
+            return path
+    return None
+
+def _load_index(index_file):
+    try:
+        with open(index_file, encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return index.get('sources', {}) if index.get('version') == CACHE_VERSION else {}
+
+def _save_index(index_file, sources):
+    temp_path = index_file.with_name(index_file.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'sources': sources}, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(temp_path, index_file)
+
+def source_hash(path, index):
+    """
+    SHA-256 of an image, reusing the hash recorded in index while the
+    file's size and mtime are unchanged.
+    """
+    stat = os.stat(path)
+    entry = index.get(str(path))
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    index[str(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': h.hexdigest()}
+    return h.hexdigest()
+
+def derivative_name(digest, profile_name, profile, suffix):
+    """Cache filename for a source hash and target profile"""
+    encoded = json.dumps([CACHE_VERSION, profile], sort_keys=True).encode('utf-8')
+    return f"{digest[:24]}-{profile_name}-{hashlib.sha256(encoded).hexdigest()[:8]}{suffix}"
+
+def make_derivative(source, target, profile):
+    """
+    Resize and recompress one image. Runs inside a worker process.
+
+    Args:
+        source: Path to the source image
+        target: Path to write the derivative
+        profile: Profile from image_profiles()
+
+    Returns:
+        Size of the derivative in bytes
+    """
+    from PIL import Image, ImageOps
+
+    pil_format = PIL_FORMATS[Path(source).suffix.lower()]
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        icc_profile = original.info.get('icc_profile')
+
+        width, height = image.size
+        scale = min(1.0, profile['max_width'] / width,
+                    profile['max_height'] / height if profile['max_height'] else 1.0)
+        if scale < 1.0:
+            if image.mode in ('1', 'P'):
+                image = image.convert('RGBA')  # Palette images would be resized without filtering
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                 Image.LANCZOS)
+
+        options = {'optimize': True}
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        if profile['dpi']:
+            options['dpi'] = (profile['dpi'], profile['dpi'])
+        if pil_format == 'JPEG':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            options.update(quality=profile['quality'], progressive=True)
+
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        image.save(temp_path, pil_format, **options)
+
+    # Recompressing an already small image can grow it
+    if scale == 1.0 and os.path.getsize(temp_path) >= os.path.getsize(source):
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, target)
+    return os.path.getsize(target)
+
+def prepare_images(project_root, config, manuscript, formats, jobs=None, log=print):
+    """
+    Create (or reuse) the image derivatives for the formats being built.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript()
+        formats: Formats being built
+        jobs: Number of worker processes (default: CPU count)
+        log: Function called with progress lines
+
+    Returns:
+        Dictionary mapping each format to (derivative path per image
+        reference, derivative path of the cover or None), with paths
+        relative to project_root. Empty if optimization is off or
+        Pillow is not installed.
+    """
+    settings = image_settings(config)
+    if not settings['optimize']:
+        return {}
+    if find_spec('PIL') is None:
+        log("   ⚠️  Pillow not installed; using images as they are (pip install Pillow)")
+        return {}
+
+    project_root = Path(project_root)
+    profiles = image_profiles(settings)
+
+    sources = {}
+    for text in manuscript_texts(manuscript):
+        for reference in find_images(text):
+            path = resolve_image(project_root, reference)
+            if path is not None and path.suffix.lower() in PIL_FORMATS:
+                sources[reference] = path
+
+    cover = None
+    cover_image = config['structure'].get('cover_image', '')
+    if 'epub' in formats and cover_image and cover_image != '""':
+        path = project_root / cover_image
+        if path.is_file() and path.suffix.lower() in PIL_FORMATS:
+            cover = path
+
+    if not sources and cover is None:
+        return {}
+
+    cache_dir = output_dir(project_root, config) / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index_file = cache_dir / INDEX_FILENAME
+    index = _load_index(index_file)
+
+    def derivative(path, profile_name):
+        name = derivative_name(source_hash(path, index), profile_name, profiles[profile_name],
+                               path.suffix.lower())
+        return path, profile_name, cache_dir / name
+
+    planned = {}
+    for fmt in formats:
+        profile_name = FORMAT_PROFILES[fmt]
+        references = {reference: derivative(path, profile_name) for reference, path in sources.items()}
+        planned[fmt] = (references, derivative(cover, 'cover') if fmt == 'epub' and cover else None)
+
+    targets = {}
+    for references, cover_target in planned.values():
+        for item in list(references.values()) + ([cover_target] if cover_target else []):
+            targets[item[2]] = item
+    todo = [item for target, item in targets.items() if not target.exists()]
+
+    if todo:
+        # Only pay for the multiprocessing import when there is work for it
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = jobs or min(len(todo), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {item: executor.submit(make_derivative, str(item[0]), str(item[2]), profiles[item[1]])
+                       for item in todo}
+            for (path, profile_name, target), future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    # Cache the original so an unreadable image is not retried every build
+                    log(f"   ⚠️  Could not optimize {path.relative_to(project_root)} ({profile_name}): {e}")
+                    shutil.copyfile(path, target)
+
+    source_bytes = sum(item[0].stat().st_size for item in targets.values())
+    derivative_bytes = sum(target.stat().st_size for target in targets)
+    log(f"   ✅ Optimized {len(todo)} of {len(targets)} image(s) "
+        f"({len(targets) - len(todo)} cached), {source_bytes / 1048576:.1f}MB → "
+        f"{derivative_bytes / 1048576:.1f}MB")
+
+    # Older derivatives of the profiles just built are stale
+    built_profiles = {item[1] for item in targets.values()}
+    for entry in cache_dir.iterdir():
+        parts = entry.name.split('-')
+        if len(parts) == 3 and parts[1] in built_profiles and entry not in targets:
+            entry.unlink()
+    used_sources = {str(item[0]) for item in targets.values()}
+    _save_index(index_file, {path: entry for path, entry in index.items() if path in used_sources})
+
+    def relative(item):
+        if item is None:
+            return None
+        return Path(os.path.relpath(item[2], project_root)).as_posix()
+
+    derivatives = {}
+    for fmt, (references, cover_target) in planned.items():
+        derivatives[fmt] = ({reference: relative(item) for reference, item in references.items()},
+                            relative(cover_target))
+    return derivatives
+
+def apply_images(config, manuscript, derivatives):
+    """
+    Point a format's image references at its derivatives.
+
+    Args:
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript()
+        derivatives: One format's entry from prepare_images(), or None
+
+    Returns:
+        Tuple of (config, manuscript), copied with cover_image and the
+        references replaced (unchanged if derivatives is None)
+    """
+    if not derivatives:
+        return config, manuscript
+    references, cover = derivatives
+
+    def rewrite(text):
+        if text is None:
+            return None
+        for pattern in IMAGE_PATTERNS:
+            text = pattern.sub(lambda m: m.group(1) + references.get(m.group(2), m.group(2)) + m.group(3), text)
+        return text
+
+    manuscript = dict(manuscript,
+                      front_matter=[(name, rewrite(text)) for name, text in manuscript['front_matter']],
+                      chapters=[rewrite(text) for text in manuscript['chapters']],
+                      conclusion=rewrite(manuscript['conclusion']),
+                      acknowledgments=rewrite(manuscript['acknowledgments']),
+                      appendices=[rewrite(text) for text in manuscript['appendices']])
+    if cover:
+        config = dict(config, structure=dict(config['structure'], cover_image=cover))
+    return config, manuscript
+
+def optimized(project_root, config, manuscript, fmt, log=print):
+    """Config and manuscript for one format with images pointing at their derivatives"""
+    derivatives = prepare_images(project_root, config, manuscript, [fmt], log=log)
+    return apply_images(config, manuscript, derivatives.get(fmt))
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Create the image derivatives for each output format.")
+    parser.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help="Comma-separated formats (default: epub,pdf,word)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--cover', action='store_true',
+                        help="Only print the EPUB cover to use (the derivative, or the original)")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(unknown)}")
+
+    project_root = Path(args.project_root)
+    config = load_config(project_root / "config.yaml")
+
+    if args.cover:
+        cover = {'front_matter': [], 'chapters': [], 'conclusion': None, 'acknowledgments': None, 'appendices': []}
+        derivatives = prepare_images(project_root, config, cover, ['epub'], args.jobs, log=lambda message: None)
+        config, _ = apply_images(config, cover, derivatives.get('epub'))
+        print(config['structure'].get('cover_image', '') or '')
+        return 0
+
+    try:
+        manuscript = load_manuscript(project_root, config)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    prepare_images(project_root, config, manuscript, formats, args.jobs)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
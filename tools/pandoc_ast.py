@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Parse the manuscript into pandoc's JSON AST once for every writer.
+Each front matter file, chapter and back matter file is read by pandoc
+on its own (several at a time) and cached in <output_dir>/.ast-cache/ by
+a hash of its text and the pandoc version, so a build only re-reads the
+files that changed. The EPUB, HTML (for WeasyPrint) and DOCX writers are
+then fed the cached documents with each format's section wrappers, page
+breaks and metadata added as AST nodes, instead of each reading the
+whole assembled Markdown again. Because each file is read separately,
+footnotes and reference links only resolve within their own file
+(lint_manuscript.py checks this).
+
+Automatic heading ids are made unique across the book in reading order,
+as pandoc does when it reads the assembled Markdown (explicit {#id}s are
+kept as written), and image references are pointed at each format's
+derivatives (see optimize_images.py) in the AST.
+
+Usage: pandoc_ast.py <epub|pdf|word> [project_root] [--config config.yaml] [--jobs N]
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, load_config, output_dir
+from build_epub import pandoc_version
+from manuscript import (METADATA_KEYS, PDF_FRONT_MATTER, epub_sections, load_manuscript,
+                        metadata_block, write_stream)
+from optimize_images import HTML_IMAGE_RE
+
+CACHE_DIRNAME = ".ast-cache"
+CACHE_VERSION = 2
+
+READER_ARGS = ['--from=markdown', '--to=json']
+
+# {#id} attributes in Markdown: a heading whose id is not one of its file's
+# was given the id by pandoc
+EXPLICIT_ID_RE = re.compile(r'\{[^{}]*?(?<![\w&])#([^\s{}]+)[^{}]*\}')
+
+# Key-value attribute marking automatic heading ids in the cached ASTs;
+# removed again when the ids are numbered across the book
+AUTO_ID_KEY = 'auto-id'
+
+# Blocks that hold other blocks, and where their children are
+BLOCK_CONTAINERS = {
+    'BlockQuote': lambda c: [c],
+    'Div': lambda c: [c[1]],
+    'BulletList': lambda c: c,
+    'OrderedList': lambda c: c[1],
+    'DefinitionList': lambda c: [blocks for _, definitions in c for blocks in definitions],
+    'Figure': lambda c: [c[2]],
+}
+
+def ast_key(text, version):
+    """Cache key for one file's AST"""
+    h = hashlib.sha256()
+    for part in (str(CACHE_VERSION), version, ' '.join(READER_ARGS), text):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def parse_markdown(text):
+    """
+    Read Markdown with pandoc.
+
+    Returns:
+        pandoc's JSON document as text
+
+    Raises:
+        RuntimeError: If pandoc fails
+    """
+    result = subprocess.run(['pandoc'] + READER_ARGS, input=text,
+                            capture_output=True, text=True, encoding='utf-8')
+    if result.returncode != 0:
+        raise RuntimeError(f"pandoc failed: {result.stderr.strip()}")
+    return result.stdout
+
+def mark_auto_ids(document, text):
+    """
+    Mark the headings whose id pandoc generated from their text.
+
+    Args:
+        document: pandoc's JSON document for one file, as text
+        text: The Markdown it was read from
+
+    Returns:
+        JSON document text with AUTO_ID_KEY on those headings
+    """
+    if '"Header"' not in document:
+        return document
+    blocks = json.loads(document)
+    explicit = set(EXPLICIT_ID_RE.findall(text))
+
+    def mark(block_list):
+        for block in block_list:
+            kind = block.get('t')
+            if kind == 'Header':
+                attr = block['c'][1]
+                if attr[0] and attr[0] not in explicit:
+                    attr[2].append([AUTO_ID_KEY, ''])
+            elif kind in BLOCK_CONTAINERS:
+                for children in BLOCK_CONTAINERS[kind](block['c']):
+                    mark(children)
+
+    mark(blocks['blocks'])
+    return json.dumps(blocks, ensure_ascii=False, separators=(',', ':'))
+
+def parse_manuscript(project_root, config, manuscript, jobs=None, log=print):
+    """
+    Parse every component of the manuscript, using the cache.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript() (original image references)
+        jobs: Number of pandoc processes to run at once (default: CPU count)
+        log: Function called with a progress line
+
+    Returns:
+        Manuscript-shaped dictionary whose texts are replaced by pandoc
+        JSON documents, plus 'meta' (the parsed metadata block)
+
+    Raises:
+        RuntimeError: If pandoc fails on a file
+        OSError: If pandoc is not installed
+    """
+    cache_dir = output_dir(project_root, config) / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    version = pandoc_version()
+
+    # One metadata block with every format's fields; each format keeps its own
+    texts = {'meta': metadata_block(config['book'], METADATA_KEYS['epub'])}
+    for name, text in manuscript['front_matter']:
+        texts[('front_matter', name)] = text
+    for index, text in enumerate(manuscript['chapters']):
+        texts[('chapter', index)] = text
+    for part in ('conclusion', 'acknowledgments'):
+        if manuscript[part] is not None:
+            texts[part] = manuscript[part]
+    for index, text in enumerate(manuscript['appendices']):
+        texts[('appendix', index)] = text
+
+    keys = {part: ast_key(text, version) for part, text in texts.items()}
+    documents = {}
+    todo = {}
+    for part, key in keys.items():
+        cached = cache_dir / f"{key}.json"
+        if cached.exists():
+            documents[part] = cached.read_text(encoding='utf-8')
+        else:
+            todo.setdefault(key, texts[part])
+
+    def parse(key):
+        document = mark_auto_ids(parse_markdown(todo[key]), todo[key])
+        cached = cache_dir / f"{key}.json"
+        # Write via a temp name so concurrent builds never read a partial file
+        temp_path = cached.with_name(cached.name + f".{os.getpid()}.tmp")
+        temp_path.write_text(document, encoding='utf-8')
+        os.replace(temp_path, cached)
+        return document
+
+    if todo:
+        workers = min(len(todo), jobs or os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parsed = dict(zip(todo, executor.map(parse, todo)))
+        for part, key in keys.items():
+            documents.setdefault(part, parsed.get(key))
+
+    # Drop ASTs of text that is no longer in the manuscript
+    in_use = {f"{key}.json" for key in keys.values()}
+    for entry in cache_dir.iterdir():
+        if entry.suffix == '.json' and entry.name not in in_use:
+            entry.unlink()
+
+    log(f"   ✅ Parsed {len(todo)} of {len(texts)} file(s) ({len(texts) - len(todo)} cached)")
+    return {
+        'meta': documents['meta'],
+        'front_matter': [(name, documents[('front_matter', name)]) for name, _ in manuscript['front_matter']],
+        'chapters': [documents[('chapter', index)] for index in range(len(manuscript['chapters']))],
+        'conclusion': documents.get('conclusion'),
+        'acknowledgments': documents.get('acknowledgments'),
+        'appendices': [documents[('appendix', index)] for index in range(len(manuscript['appendices']))],
+    }
+
+def unique_id(identifier, used):
+    """pandoc's numbering for a repeated heading id: intro, intro-1, intro-2..."""
+    candidate, number = identifier, 0
+    while candidate in used:
+        number += 1
+        candidate = f"{identifier}-{number}"
+    used.add(candidate)
+    return candidate
+
+def _number_headings(blocks, used):
+    """Number repeated automatic heading ids; explicit {#id}s are kept as written"""
+    for block in blocks:
+        kind = block.get('t')
+        if kind == 'Header':
+            attr = block['c'][1]
+            auto = [AUTO_ID_KEY, ''] in attr[2]
+            if auto:
+                attr[2].remove([AUTO_ID_KEY, ''])
+                attr[0] = unique_id(attr[0], used)
+            elif attr[0]:
+                used.add(attr[0])
+        elif kind in BLOCK_CONTAINERS:
+            for children in BLOCK_CONTAINERS[kind](block['c']):
+                _number_headings(children, used)
+
+def _point_images(node, references):
+    if isinstance(node, list):
+        for item in node:
+            _point_images(item, references)
+    elif isinstance(node, dict):
+        kind = node.get('t')
+        content = node.get('c')
+        if kind == 'Image':
+            target = content[2]
+            target[0] = references.get(target[0], target[0])
+        elif kind in ('RawBlock', 'RawInline'):
+            if content[0] == 'html':
+                content[1] = HTML_IMAGE_RE.sub(
+                    lambda m: m.group(1) + references.get(m.group(2), m.group(2)) + m.group(3), content[1])
+            return
+        if isinstance(content, (list, dict)):
+            _point_images(content, references)
+
+def _raw_html(text):
+    return {'t': 'RawBlock', 'c': ['html', text]}
+
+def _div(classes, blocks):
+    return [{'t': 'Div', 'c': [['', classes, []], blocks]}]
+
+def _sections(fmt, parsed):
+    """(document, wrap) pairs in reading order, wrap turning blocks into the format's blocks"""
+    if fmt == 'epub':
+        for opening, document, closing in epub_sections(parsed):
+            yield document, lambda blocks, o=opening, c=closing: [_raw_html(o)] + blocks + [_raw_html(c)]
+    elif fmt == 'pdf':
+        for name, document in parsed['front_matter']:
+            yield document, lambda blocks, n=name: _div(['frontmatter', PDF_FRONT_MATTER[n]], blocks)
+        for document in parsed['chapters'] + [parsed['conclusion']]:
+            if document is not None:
+                yield document, lambda blocks: _div(['chapter'], blocks)
+        if parsed['acknowledgments'] is not None:
+            yield parsed['acknowledgments'], lambda blocks: _div(['acknowledgments'], blocks)
+        for document in parsed['appendices']:
+            yield document, lambda blocks: _div(['appendix'], blocks)
+    else:
+        page_break = {'t': 'RawBlock', 'c': ['tex', '\\newpage']}
+        body = [document for _, document in parsed['front_matter']] + parsed['chapters']
+        # Back matter: a page break between components, none after the last
+        back = [document for document in [parsed['acknowledgments']] + parsed['appendices'] if document is not None]
+        for document in body + [parsed['conclusion']] + back[:-1]:
+            if document is not None:
+                yield document, lambda blocks: blocks + [page_break]
+        if back:
+            yield back[-1], lambda blocks: blocks
+
+def iter_ast(fmt, parsed, image_references=None):
+    """
+    Yield one format's pandoc JSON document, a section at a time.
+
+    Args:
+        fmt: 'epub', 'pdf' or 'word'
+        parsed: Result of parse_manuscript()
+        image_references: Map of image reference to the format's
+            derivative (from prepare_images()), or None
+
+    Yields:
+        JSON text to stream to pandoc --from=json
+    """
+    meta_document = json.loads(parsed['meta'])
+    meta = {key: value for key, value in meta_document['meta'].items() if key in METADATA_KEYS[fmt]}
+    yield (f'{{"pandoc-api-version":{json.dumps(meta_document["pandoc-api-version"])},'
+           f'"meta":{json.dumps(meta, ensure_ascii=False)},"blocks":[')
+
+    used = set()
+    first = True
+    for document, wrap in _sections(fmt, parsed):
+        blocks = json.loads(document)['blocks']
+        _number_headings(blocks, used)
+        if image_references and any(reference in document for reference in image_references):
+            _point_images(blocks, image_references)
+        blocks = wrap(blocks)
+        if blocks:
+            text = json.dumps(blocks, ensure_ascii=False, separators=(',', ':'))[1:-1]
+            yield text if first else ',' + text
+            first = False
+    yield ']}'
+
+def main():
+    """CLI interface: stream a format's pandoc JSON document to stdout"""
+    parser = argparse.ArgumentParser(description="Write a format's pandoc JSON AST to stdout.")
+    parser.add_argument('format', choices=sorted(METADATA_KEYS))
+    parser.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of pandoc processes to run at once (default: CPU count)")
+    args = parser.parse_args()
+
+    project_root = Path(args.project_root)
+    config = load_config(Path(args.config) if args.config else project_root / "config.yaml")
+
+    try:
+        manuscript = load_manuscript(project_root, config)
+        parsed = parse_manuscript(project_root, config, manuscript, args.jobs,
+                                  log=lambda message: print(message, file=sys.stderr))
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    try:
+        write_stream(iter_ast(args.format, parsed), sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
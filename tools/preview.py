@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Fast HTML preview of the manuscript.
+Renders each chapter to its own HTML page in-process with Python-Markdown
+(no pandoc, WeasyPrint or EPUB packaging), links the EPUB or print
+stylesheet directly and writes an index built from the chapters'
+headings. Rendered chapters are cached by content hash under
+<output_dir>/.preview-cache/, so after an edit only that chapter is
+converted again.
+
+The preview is for reading, not proofing: Python-Markdown covers the
+Markdown the chapters use (tables, footnotes, attributes, raw HTML) but
+does not match pandoc in every detail.
+
+Usage: preview.py [--style epub|print] [--config file] [--open]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import webbrowser
+from html import escape
+from importlib.util import find_spec
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, load_config, output_dir
+from manuscript import load_manuscript
+from optimize_images import HTML_IMAGE_RE, SCHEME_RE, resolve_image
+
+CACHE_DIRNAME = ".preview-cache"
+CACHE_VERSION = 1
+PREVIEW_DIRNAME = "preview"
+
+EXTENSIONS = ['extra', 'toc', 'sane_lists', 'smarty']
+
+# Stylesheet config key, default path and chapter wrapper for each style
+STYLES = {
+    'epub': ('epub_css', 'styles/ebook_styles.css', '<section class="{}">', '</section>'),
+    'print': ('print_css', 'styles/print_styles.css', '<div class="{}">', '</div>'),
+}
+
+# Deepest heading level listed in the index
+INDEX_DEPTH = 3
+
+# Python-Markdown instance, reused (via reset()) across renders in one process
+_converter = None
+
+def _markdown():
+    global _converter
+    if _converter is None:
+        import markdown
+        _converter = markdown.Markdown(extensions=EXTENSIONS, output_format='xhtml')
+    return _converter
+
+def preview_pages(manuscript):
+    """
+    List the preview pages in reading order.
+
+    Args:
+        manuscript: Manuscript from load_manuscript()
+
+    Returns:
+        List of (filename, wrapper class, Markdown text) tuples
+    """
+    pages = [(f"chapter-{number:02d}.html", 'chapter', text)
+             for number, text in enumerate(manuscript['chapters'], 1)]
+    if manuscript['conclusion'] is not None:
+        pages.append(("conclusion.html", 'chapter', manuscript['conclusion']))
+    if manuscript['acknowledgments'] is not None:
+        pages.append(("acknowledgments.html", 'acknowledgments', manuscript['acknowledgments']))
+    pages += [(f"appendix-{number:02d}.html", 'appendix', text)
+              for number, text in enumerate(manuscript['appendices'], 1)]
+    return pages
+
+def chapter_key(text, version):
+    """Cache key for a rendered chapter"""
+    h = hashlib.sha256()
+    for part in (str(CACHE_VERSION), version, ','.join(EXTENSIONS), text):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def _load_cached(cache_file):
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return entry['html'], entry['toc']
+
+def _write_if_changed(path, text):
+    """Write text unless the file already has it (keeps mtimes stable for the browser)"""
+    try:
+        if path.read_text(encoding='utf-8') == text:
+            return False
+    except FileNotFoundError:
+        pass
+    temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    temp_path.write_text(text, encoding='utf-8')
+    os.replace(temp_path, path)
+    return True
+
+def _toc_list(tokens, href, depth=1):
+    """Nested <ul> of headings from Python-Markdown's toc_tokens"""
+    items = []
+    for token in tokens:
+        children = _toc_list(token['children'], href, depth + 1) if depth < INDEX_DEPTH else ''
+        items.append(f'<li><a href="{href}#{token["id"]}">{token["name"]}</a>{children}</li>')
+    return f"<ul>{''.join(items)}</ul>" if items else ''
+
+def render_page(title, body, css_href, nav):
+    """Standalone HTML page with the book stylesheet and prev/index/next links"""
+    return (
+        '<!DOCTYPE html>\n'
+        '<html>\n<head>\n'
+        '<meta charset="utf-8" />\n'
+        f'<title>{title}</title>\n'
+        f'<link rel="stylesheet" href="{escape(css_href)}" />\n'
+        '</head>\n<body>\n'
+        f'<nav class="preview-nav">{nav}</nav>\n'
+        f'{body}\n'
+        f'<nav class="preview-nav">{nav}</nav>\n'
+        '</body>\n</html>\n'
+    )
+
+def build_preview(project_root, config, manuscript=None, style='epub', memo=None, log=print):
+    """
+    Render the chapters to HTML pages plus an index.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript() (loaded if None)
+        style: 'epub' or 'print' stylesheet
+        memo: Dictionary kept between calls to skip the disk cache (optional)
+        log: Function called with progress lines
+
+    Returns:
+        Path to the index page
+
+    Raises:
+        RuntimeError: If Python-Markdown is not installed
+    """
+    if find_spec('markdown') is None:
+        raise RuntimeError("HTML preview needs Python-Markdown (pip install markdown)")
+    import markdown
+
+    start = time.perf_counter()
+    project_root = Path(project_root)
+    title = escape(str(config['book'].get('title', '')))
+    if manuscript is None:
+        manuscript = load_manuscript(project_root, config)
+    memo = {} if memo is None else memo
+
+    out_dir = output_dir(project_root, config)
+    preview_dir = out_dir / PREVIEW_DIRNAME
+    cache_dir = out_dir / CACHE_DIRNAME
+    preview_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    css_key, css_default, opening, closing = STYLES[style]
+    css_path = project_root / config['styles'].get(css_key, css_default)
+    css_href = Path(os.path.relpath(css_path, preview_dir)).as_posix()
+
+    def image_src(match):
+        src = match.group(2)
+        if SCHEME_RE.match(src) or src.startswith(('/', '#')):
+            return match.group(0)
+        image = resolve_image(project_root, src)
+        if image is None:
+            return match.group(0)
+        return match.group(1) + Path(os.path.relpath(image, preview_dir)).as_posix() + match.group(3)
+
+    pages = preview_pages(manuscript)
+    rendered = []
+    used = set()
+    misses = 0
+    for filename, css_class, text in pages:
+        key = chapter_key(text, markdown.__version__)
+        used.add(f"{key}.json")
+        if key not in memo:
+            cache_file = cache_dir / f"{key}.json"
+            memo[key] = _load_cached(cache_file)
+            if memo[key] is None:
+                converter = _markdown().reset()
+                html = converter.convert(text)
+                memo[key] = (html, converter.toc_tokens)
+                with open(cache_file, 'w', encoding='utf-8') as f:
+                    json.dump({'html': html, 'toc': converter.toc_tokens}, f)
+                misses += 1
+        html, toc = memo[key]
+        rendered.append((filename, opening.format(css_class) + HTML_IMAGE_RE.sub(image_src, html) + closing, toc))
+
+    for entry in cache_dir.iterdir():
+        if entry.suffix == '.json' and entry.name not in used:
+            entry.unlink()
+    for key in [key for key in memo if f"{key}.json" not in used]:
+        del memo[key]
+
+    written = 0
+    for index, (filename, body, toc) in enumerate(rendered):
+        links = []
+        if index > 0:
+            links.append(f'<a href="{rendered[index - 1][0]}">← Previous</a>')
+        links.append('<a href="index.html">Contents</a>')
+        if index + 1 < len(rendered):
+            links.append(f'<a href="{rendered[index + 1][0]}">Next →</a>')
+        page_title = toc[0]['name'] if toc else title
+        written += _write_if_changed(preview_dir / filename, render_page(page_title, body, css_href, ' | '.join(links)))
+
+    contents = ''.join(f'<li><a href="{filename}">{toc[0]["name"] if toc else filename}</a>'
+                       f'{_toc_list(toc[0]["children"] if len(toc) == 1 else toc, filename, 2)}</li>'
+                       for filename, _, toc in rendered)
+    index_body = f'<section class="toc">\n<h1>{title}</h1>\n<ol>{contents}</ol>\n</section>'
+    index_file = preview_dir / "index.html"
+    _write_if_changed(index_file, render_page(title, index_body, css_href, ''))
+
+    current = {filename for filename, _, _ in rendered} | {"index.html"}
+    for entry in preview_dir.iterdir():
+        if entry.suffix == '.html' and entry.name not in current:
+            entry.unlink()
+
+    elapsed = (time.perf_counter() - start) * 1000
+    log(f"   ✅ Preview: converted {misses} of {len(pages)} page(s), updated {written} in {elapsed:.0f}ms")
+    return index_file
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Render an HTML preview of the chapters.")
+    parser.add_argument('--style', choices=sorted(STYLES), default='epub',
+                        help="Stylesheet to preview with (default: epub)")
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--open', action='store_true', help="Open the preview in a browser")
+    args = parser.parse_args()
+
+    project_root = PROJECT_ROOT
+    config_file = Path(args.config) if args.config else project_root / "config.yaml"
+    if not config_file.exists():
+        print(f"❌ Config file not found: {config_file}", file=sys.stderr)
+        return 1
+    config = load_config(config_file)
+
+    print("👁️  Rendering HTML preview...")
+    try:
+        index_file = build_preview(project_root, config, style=args.style)
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    print(f"✅ Preview: {index_file}")
+    if args.open:
+        webbrowser.open(index_file.resolve().as_uri())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Subset and embed the fonts the EPUB and print stylesheets declare.
+Reads the @font-face rules in each stylesheet, keeps the faces whose
+family the stylesheet actually uses, and writes a copy of each local
+font file holding only the characters the book can show: the manuscript
+text, the book metadata, the stylesheet's generated content, pandoc's
+typographic punctuation and printable ASCII (page numbers and generated
+headings). Subsets are made in parallel and cached in
+<output_dir>/.font-cache/ by font hash and character set hash, so a
+font is only subset again when it or the book's character set changes.
+
+The EPUB gets the subsets in its manifest (pandoc --epub-embed-font, or
+the per-chapter builder) with the stylesheet's src urls pointed at
+../fonts/; the PDF gets a copy of the print stylesheet whose src urls
+point WeasyPrint at the cached subsets.
+
+Needs fontTools (pip install fonttools; WOFF2 output also needs brotli);
+without it the full font files are embedded.
+
+Usage: subset_fonts.py [project_root] [--formats epub,pdf] [--jobs N]
+"""
+
+import os
+import re
+import sys
+import string
+import hashlib
+import argparse
+import unicodedata
+from importlib.util import find_spec
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, load_config, output_dir
+from manuscript import load_manuscript, manuscript_texts
+
+CACHE_DIRNAME = ".font-cache"
+CACHE_VERSION = 1
+
+# config.yaml `fonts:` keys and their defaults
+DEFAULTS = {
+    'subset': True,
+}
+
+# Stylesheet each format's fonts come from
+STYLESHEETS = {
+    'epub': ('epub_css', 'styles/ebook_styles.css'),
+    'pdf': ('print_css', 'styles/print_styles.css'),
+}
+
+MEDIA_TYPES = {
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+}
+
+# Text pandoc writes itself: smart quotes, dashes and ellipses, the no-break
+# space of '\ ' escapes and the EPUB footnote back-link (↩ plus a text presentation selector)
+GENERATED_TEXT = '‘’“”–—…\u00a0\u21a9\ufe0e'
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+FONT_FACE_RE = re.compile(r'@font-face\s*\{([^}]*)\}', re.IGNORECASE)
+FAMILY_RE = re.compile(r'font-family\s*:\s*([^;}]+)', re.IGNORECASE)
+FONT_USE_RE = re.compile(r'\bfont(?:-family)?\s*:\s*([^;}]+)', re.IGNORECASE)
+URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', re.IGNORECASE)
+CONTENT_RE = re.compile(r'\bcontent\s*:\s*(["\'])(.*?)\1', re.IGNORECASE)
+QUOTED_RE = re.compile(r'(["\'])(.+?)\1')
+SCHEME_RE = re.compile(r'^[a-z][a-z0-9+.-]*:', re.IGNORECASE)
+
+def font_settings(config):
+    """Font settings from config.yaml merged over DEFAULTS"""
+    return dict(DEFAULTS, **(config.get('fonts') or {}))
+
+def _family_names(value):
+    """Family names in a font-family (or font shorthand) value, lowercased"""
+    names = set()
+    for name in value.split(','):
+        name = name.strip()
+        quoted = QUOTED_RE.search(name)
+        if quoted:
+            names.add(quoted.group(2).lower())
+        elif name:
+            # The font shorthand puts style and size before the first family
+            names.add(name.split()[-1].lower())
+    return names
+
+def used_families(css_text):
+    """Families a stylesheet's rules (outside @font-face) ask for"""
+    used = set()
+    for value in FONT_USE_RE.findall(FONT_FACE_RE.sub('', COMMENT_RE.sub('', css_text))):
+        used |= _family_names(value)
+    return used
+
+def _face_used(body, used):
+    family = FAMILY_RE.search(body)
+    return bool(family and _family_names(family.group(1)) & used)
+
+def font_faces(css_text, css_dir):
+    """
+    List the local font files of the @font-face rules a stylesheet uses.
+
+    A face counts as used when its family appears in a font-family or
+    font declaration outside the @font-face rules.
+
+    Args:
+        css_text: Stylesheet text
+        css_dir: Directory relative urls are resolved against
+
+    Returns:
+        List of (url as written, resolved Path) for font files that exist
+    """
+    used = used_families(css_text)
+    faces = []
+    for body in FONT_FACE_RE.findall(COMMENT_RE.sub('', css_text)):
+        if not _face_used(body, used):
+            continue
+        for _, url in URL_RE.findall(body):
+            path = Path(css_dir) / url
+            if (not SCHEME_RE.match(url) and path.suffix.lower() in MEDIA_TYPES
+                    and path.is_file() and (url, path) not in faces):
+                faces.append((url, path))
+    return faces
+
+def stylesheet_fonts(project_root, config, fmt):
+    """Font files a format's stylesheet embeds (empty for formats without one)"""
+    if fmt not in STYLESHEETS:
+        return []
+    key, default = STYLESHEETS[fmt]
+    css_path = Path(project_root) / config['styles'].get(key, default)
+    if not css_path.is_file():
+        return []
+    return [path for _, path in font_faces(css_path.read_text(encoding='utf-8'), css_path.parent)]
+
+def book_characters(config, manuscript, css_texts=()):
+    """
+    Every character the book can render.
+
+    Args:
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript()
+        css_texts: Stylesheets whose generated content counts too
+
+    Returns:
+        Sorted string of unique characters
+    """
+    characters = set(string.printable) - set(string.whitespace) | {' '}
+    characters.update(GENERATED_TEXT)
+    for text in manuscript_texts(manuscript):
+        characters.update(text)
+    for value in config['book'].values():
+        characters.update(str(value))
+    for css_text in css_texts:
+        for _, content in CONTENT_RE.findall(css_text):
+            characters.update(content)
+    # text-transform: uppercase needs the capitals of non-ASCII letters too
+    characters.update(''.join(c.upper() for c in characters if c.isalpha()))
+    # isprintable() rejects spaces other than ' ' (Zs) and the variation selector (Mn)
+    return ''.join(sorted(c for c in characters
+                          if c.isprintable() or unicodedata.category(c) in ('Zs', 'Mn')))
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def subset_name(source, font_hash, characters_hash, woff2=True):
+    """Cache file name for a subset of source"""
+    suffix = source.suffix.lower()
+    if suffix == '.woff2' and not woff2:
+        suffix = '.woff'
+    return f"{source.stem}-{font_hash}-{characters_hash}{suffix}"
+
+def subset_font(source, target, characters):
+    """
+    Write a copy of a font holding only the given characters.
+
+    Layout features are kept, so ligatures and kerning still work.
+    """
+    from fontTools import subset
+
+    options = subset.Options()
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.name_languages = ['*']
+    options.notdef_outline = True
+    options.flavor = {'.woff': 'woff', '.woff2': 'woff2'}.get(Path(target).suffix.lower())
+
+    font = subset.load_font(str(source), options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=[ord(c) for c in characters])
+    subsetter.subset(font)
+
+    # Write via a temp name so concurrent builds never read a partial file
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    subset.save_font(font, temp_path, options)
+    font.close()
+    os.replace(temp_path, target)
+
+def _rewrite_stylesheet(css_text, urls, other_base=None):
+    """
+    Point @font-face src urls at new locations and drop the faces nothing uses.
+
+    Args:
+        css_text: Stylesheet text
+        urls: Map of font url as written to its new url
+        other_base: If set, other relative urls are rebased onto this directory
+    """
+    used = used_families(css_text)
+
+    def face(match):
+        if not _face_used(match.group(1), used):
+            return ''
+        return URL_RE.sub(lambda m: f'url("{urls[m.group(2)]}")' if m.group(2) in urls else m.group(0),
+                          match.group(0))
+
+    def other(match):
+        url = match.group(2)
+        if SCHEME_RE.match(url) or url.startswith(('/', '#', 'data:')):
+            return match.group(0)
+        return f'url("{(Path(other_base) / url).as_posix()}")'
+
+    if other_base is not None:
+        parts = []
+        position = 0
+        for match in FONT_FACE_RE.finditer(css_text):
+            parts.append(URL_RE.sub(other, css_text[position:match.start()]))
+            parts.append(face(match))
+            position = match.end()
+        parts.append(URL_RE.sub(other, css_text[position:]))
+        return ''.join(parts)
+    return FONT_FACE_RE.sub(face, css_text)
+
+def prepare_fonts(project_root, config, manuscript, formats, jobs=None, log=print):
+    """
+    Create (or reuse) the font subsets and stylesheets for the formats being built.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        manuscript: Manuscript from load_manuscript()
+        formats: Formats being built
+        jobs: Number of worker processes (default: CPU count)
+        log: Function called with progress lines
+
+    Returns:
+        Dictionary mapping 'epub' and 'pdf' (when built and their
+        stylesheet declares local fonts) to (stylesheet path to use,
+        list of font file paths to embed)
+    """
+    project_root = Path(project_root)
+    settings = font_settings(config)
+
+    stylesheets = {}
+    for fmt in formats:
+        if fmt not in STYLESHEETS:
+            continue
+        key, default = STYLESHEETS[fmt]
+        css_path = project_root / config['styles'].get(key, default)
+        if not css_path.is_file():
+            continue
+        css_text = css_path.read_text(encoding='utf-8')
+        faces = font_faces(css_text, css_path.parent)
+        if faces:
+            stylesheets[fmt] = (css_path, css_text, faces)
+    if not stylesheets:
+        return {}
+
+    subsetting = bool(settings['subset'])
+    if subsetting and find_spec('fontTools') is None:
+        log("   ⚠️  fontTools not installed; embedding full fonts (pip install fonttools)")
+        subsetting = False
+
+    cache_dir = output_dir(project_root, config) / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Each font file maps to the file to embed: a cached subset, or the font itself
+    sources = {path for _, _, faces in stylesheets.values() for _, path in faces}
+    embedded = {path: path for path in sources}
+    todo = []
+    if subsetting:
+        # Same character set whichever formats are built, so they share subsets
+        css_texts = [(project_root / config['styles'].get(key, default)).read_text(encoding='utf-8')
+                     for key, default in STYLESHEETS.values()
+                     if (project_root / config['styles'].get(key, default)).is_file()]
+        characters = book_characters(config, manuscript, css_texts)
+        characters_hash = _digest(characters.encode('utf-8'))
+        woff2 = find_spec('brotli') is not None
+        for path in sorted(sources):
+            target = cache_dir / subset_name(path, _digest(path.read_bytes()), characters_hash, woff2)
+            embedded[path] = target
+            if not target.exists():
+                todo.append((path, target))
+
+    if todo:
+        # Only pay for the multiprocessing import when there is work for it
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = jobs or min(len(todo), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {(path, target): executor.submit(subset_font, str(path), str(target), characters)
+                       for path, target in todo}
+            for (path, target), future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    log(f"   ⚠️  Could not subset {os.path.relpath(path, project_root)}: {e}")
+                    embedded[path] = path
+
+    fonts = {}
+    for fmt, (css_path, css_text, faces) in stylesheets.items():
+        files = [embedded[path] for _, path in faces]
+        if fmt == 'epub':
+            # pandoc and the per-chapter builder put embedded fonts in EPUB/fonts/
+            urls = {url: f"../fonts/{embedded[path].name}" for url, path in faces}
+            css = _rewrite_stylesheet(css_text, urls)
+        else:
+            urls = {url: os.path.relpath(embedded[path], cache_dir) for url, path in faces}
+            css = _rewrite_stylesheet(css_text, urls, other_base=os.path.relpath(css_path.parent, cache_dir))
+        stylesheet = cache_dir / f"{fmt}-{_digest(css.encode('utf-8'))}.css"
+        if not stylesheet.exists():
+            stylesheet.write_text(css, encoding='utf-8')
+        fonts[fmt] = (str(stylesheet), [str(path) for path in dict.fromkeys(files)])
+
+    # Older subsets of these fonts and older stylesheets of these formats are stale
+    in_use = {Path(stylesheet).name for stylesheet, _ in fonts.values()}
+    in_use |= {Path(path).name for _, files in fonts.values() for path in files}
+    prefixes = tuple(f"{fmt}-" for fmt in fonts)
+    if subsetting:
+        prefixes += tuple(f"{path.stem}-" for path in sources)
+    for entry in cache_dir.iterdir():
+        if entry.name.startswith(prefixes) and entry.name not in in_use and not entry.name.endswith('.tmp'):
+            entry.unlink()
+
+    source_bytes = sum(path.stat().st_size for path in sources)
+    embedded_bytes = sum(Path(path).stat().st_size for path in set(embedded.values()))
+    if subsetting:
+        log(f"   ✅ Subset {len(todo)} of {len(sources)} font(s) ({len(sources) - len(todo)} cached), "
+            f"{source_bytes / 1024:.0f}KB → {embedded_bytes / 1024:.0f}KB")
+    else:
+        log(f"   ✅ Embedding {len(sources)} font(s), {source_bytes / 1024:.0f}KB")
+    return fonts
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Subset the fonts the EPUB and print stylesheets embed.")
+    parser.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--formats', default='epub,pdf',
+                        help="Comma-separated formats (default: epub,pdf)")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    project_root = Path(args.project_root)
+    config = load_config(Path(args.config) if args.config else project_root / "config.yaml")
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip() in STYLESHEETS]
+
+    try:
+        manuscript = load_manuscript(project_root, config)
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    print("🔤 Preparing fonts...")
+    fonts = prepare_fonts(project_root, config, manuscript, formats, args.jobs)
+    if not fonts:
+        print("   No @font-face fonts to embed")
+    for fmt, (stylesheet, files) in fonts.items():
+        print(f"   {fmt}: {os.path.relpath(stylesheet, project_root)}")
+        for path in files:
+            print(f"      {os.path.relpath(path, project_root)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
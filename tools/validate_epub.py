@@ -1,74 +1,428 @@
 #!/usr/bin/env python3
 """
-EPUB validation wrapper with better error reporting.
+EPUB validation with better error reporting.
+
+A native structural check reads every entry of the zip once, without
+extracting it: mimetype placement, container.xml -> OPF resolution,
+manifest/spine/NCX/nav href integrity, duplicate ids, well-formed XHTML
+and broken internal links and anchors. Results are cached by the EPUB's
+content hash, so a file that has already been checked is not read again.
+epubcheck is an optional deep check on top (--epubcheck).
+
+Usage: validate_epub.py <book.epub>... [--epubcheck] [--no-cache]
 """
 
+import os
+import re
 import sys
+import json
+import zipfile
+import argparse
+import posixpath
 import subprocess
-import re
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from epub_package import CONTAINER_PATH, NS, XHTML_MEDIA_TYPE, EpubPackage, resolve_href
+from file_hash import hash_file
+
+CACHE_FILENAME = ".validation-cache.json"
+CACHE_VERSION = 1
+
+# Bump when checks change so cached results are re-validated
+CHECKS_VERSION = 1
+
+# Cached results kept per cache file (most recent first)
+CACHE_ENTRIES = 50
+
+MIMETYPE = b'application/epub+zip'
+
+# Elements whose attribute points at another resource in the package
+LINK_ATTRIBUTES = {
+    'a': 'href',
+    'link': 'href',
+    'img': 'src',
+    'image': '{http://www.w3.org/1999/xlink}href',
+    'script': 'src',
+    'source': 'src',
+    'audio': 'src',
+    'video': 'src',
+}
+
+MAX_REPORTED = 5
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _split_link(base_dir, href):
+    """
+    Resolve an internal link.
+
+    Returns:
+        Tuple of (zip path, fragment), or None for external links
+    """
+    parts = urlsplit(href)
+    if parts.scheme or parts.netloc:
+        return None
+    path = resolve_href(base_dir, unquote(parts.path)) if parts.path else None
+    return path, unquote(parts.fragment)
+
+class _Checker:
+    """Collects errors and warnings for one EPUB"""
+
+    def __init__(self, zipf):
+        self.zipf = zipf
+        self.errors = []
+        self.warnings = []
+        self._data = {}
+
+    def error(self, message):
+        self.errors.append(message)
 
-def validate_epub(epub_path):
+    def warning(self, message):
+        self.warnings.append(message)
+
+    def read(self, name):
+        """Entry bytes, read from the archive at most once"""
+        if name not in self._data:
+            self._data[name] = self.zipf.read(name)
+        return self._data[name]
+
+    def parse(self, name):
+        """Parse an XML entry, reporting it if malformed"""
+        try:
+            return ET.fromstring(self.read(name))
+        except ET.ParseError as e:
+            self.error(f"{name}: not well-formed XML ({e})")
+        except KeyError:
+            self.error(f"{name}: missing from the archive")
+        return None
+
+    def check_mimetype(self, infos):
+        if not infos or infos[0].filename != 'mimetype':
+            self.error("mimetype: must be the first entry in the archive")
+            return
+        info = infos[0]
+        if info.compress_type != zipfile.ZIP_STORED:
+            self.error("mimetype: must be stored without compression")
+        if info.extra:
+            self.warning("mimetype: has a zip extra field; some readers reject this")
+        if self.read('mimetype') != MIMETYPE:
+            self.error(f"mimetype: content must be '{MIMETYPE.decode()}'")
+
+    def check_container(self, names):
+        """Resolve container.xml to the OPF path, or None"""
+        if CONTAINER_PATH not in names:
+            self.error(f"{CONTAINER_PATH}: missing")
+            return None
+        container = self.parse(CONTAINER_PATH)
+        if container is None:
+            return None
+
+        rootfiles = container.findall('.//{%s}rootfile' % NS['container']) or container.findall('.//rootfile')
+        if not rootfiles:
+            self.error(f"{CONTAINER_PATH}: no rootfile")
+            return None
+        opf_path = rootfiles[0].get('full-path', '')
+        if opf_path not in names:
+            self.error(f"{CONTAINER_PATH}: rootfile '{opf_path}' does not exist")
+            return None
+        if self.parse(opf_path) is None:
+            return None
+        return opf_path
+
+    def check_package(self, package):
+        """Manifest, spine and NCX integrity"""
+        opf = package.opf_path
+        seen_ids = set()
+        seen_paths = set()
+        for element in package.manifest.findall(f'{{{NS["opf"]}}}item') if package.manifest is not None else []:
+            item_id = element.get('id', '')
+            href = element.get('href', '')
+            path = resolve_href(package.opf_dir, href)
+            if not item_id:
+                self.error(f"{opf}: manifest item '{href}' has no id")
+            elif item_id in seen_ids:
+                self.error(f"{opf}: duplicate manifest id '{item_id}'")
+            seen_ids.add(item_id)
+            if not element.get('media-type'):
+                self.error(f"{opf}: manifest item '{item_id}' has no media-type")
+            if path in seen_paths:
+                self.warning(f"{opf}: '{href}' is listed in the manifest more than once")
+            seen_paths.add(path)
+            if path not in package.names:
+                self.error(f"{opf}: manifest item '{item_id}' points to missing file '{href}'")
+
+        if package.manifest is None:
+            self.error(f"{opf}: no manifest")
+        if not package.spine:
+            self.error(f"{opf}: spine is empty")
+        for idref in package.spine:
+            if idref not in package.items_by_id:
+                self.error(f"{opf}: spine itemref '{idref}' is not in the manifest")
+
+        if not any('nav' in item['properties'] for item in package.items_by_id.values()):
+            self.warning(f"{opf}: no manifest item has properties=\"nav\" (required by EPUB 3)")
+
+        # Entries a reading system will never see
+        listed = set(package.items_by_href) | {'mimetype', package.opf_path}
+        for name in sorted(package.names):
+            if name not in listed and not name.startswith('META-INF/') and not name.endswith('/'):
+                self.warning(f"{name}: not listed in the manifest")
+
+    def check_links(self, package):
+        """Duplicate ids in content documents and broken links, NCX entries included"""
+        documents = sorted({item['path'] for item in package.items_by_id.values()
+                            if item['media_type'] == XHTML_MEDIA_TYPE and item['path'] in package.names}
+                           | (package.xhtml_files & package.names))
+        anchors = {}
+        links = []
+        for name in documents:
+            root = self.parse(name)
+            if root is None:
+                continue
+            ids = set()
+            base_dir = posixpath.dirname(name)
+            for element in root.iter():
+                element_id = element.get('id')
+                if element_id is not None:
+                    if element_id in ids:
+                        self.error(f"{name}: duplicate id '{element_id}'")
+                    ids.add(element_id)
+                tag = _local_name(element.tag) if isinstance(element.tag, str) else ''
+                if tag == 'a' and element.get('name'):
+                    ids.add(element.get('name'))
+                attribute = LINK_ATTRIBUTES.get(tag)
+                if attribute and element.get(attribute):
+                    links.append((name, base_dir, element.get(attribute)))
+            anchors[name] = ids
+
+        for node in self._walk(package.nav_points):
+            if not node['src']:
+                self.error(f"{package.ncx_path}: navPoint '{node['label']}' has no content src")
+                continue
+            links.append((package.ncx_path, posixpath.dirname(package.ncx_path), node['src']))
+
+        for source, base_dir, href in links:
+            target = _split_link(base_dir, href)
+            if target is None:
+                continue
+            path, fragment = target
+            path = path or source
+            if path not in package.names:
+                self.error(f"{source}: link to missing file '{href}'")
+            elif fragment and path in anchors and fragment not in anchors[path]:
+                self.error(f"{source}: link to missing anchor '{href}'")
+
+    def check_ncx(self, package):
+        spine = package.opf_root.find(f'{{{NS["opf"]}}}spine')
+        toc = spine.get('toc') if spine is not None else None
+        if toc and toc not in package.items_by_id:
+            self.error(f"{package.opf_path}: spine toc '{toc}' is not in the manifest")
+        if package.ncx_path is None:
+            return
+        if package.ncx_path not in package.names:
+            self.error(f"{package.opf_path}: NCX '{package.ncx_path}' does not exist")
+        elif package.ncx_root is None or package.nav_map is None:
+            self.error(f"{package.ncx_path}: no navMap")
+        else:
+            ids = [element.get('id') for element in package.ncx_root.iter() if element.get('id')]
+            for element_id in sorted({i for i in ids if ids.count(i) > 1}):
+                self.error(f"{package.ncx_path}: duplicate id '{element_id}'")
+
+    @staticmethod
+    def _walk(nodes):
+        for node in nodes:
+            yield node
+            yield from _Checker._walk(node['children'])
+
+def check_epub(epub_path):
     """
-    Validate EPUB file using epubcheck.
-    
+    Run the native structural checks.
+
     Args:
         epub_path: Path to EPUB file
-        
+
     Returns:
-        0 if valid, 1 if invalid, 2 if epubcheck not available
+        Tuple of (errors, warnings), each a list of messages
     """
-    # Check if epubcheck is available
     try:
-        result = subprocess.run(['epubcheck', '--version'], 
-                               capture_output=True, 
-                               text=True,
-                               timeout=5)
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        print("⚠️  epubcheck not available. Install for EPUB validation.", file=sys.stderr)
-        return 2
-    
-    # Run epubcheck
+        zipf = zipfile.ZipFile(epub_path)
+    except (zipfile.BadZipFile, OSError) as e:
+        return [f"not a readable zip archive ({e})"], []
+
+    with zipf:
+        checker = _Checker(zipf)
+        infos = zipf.infolist()
+        names = {info.filename for info in infos}
+        if len(names) != len(infos):
+            checker.error("archive contains duplicate entry names")
+
+        checker.check_mimetype(infos)
+        opf_path = checker.check_container(names)
+        if opf_path is None:
+            return checker.errors, checker.warnings
+
+        try:
+            package = EpubPackage(names, checker.read)
+        except (ET.ParseError, KeyError) as e:
+            checker.error(f"could not read the package: {e}")
+            return checker.errors, checker.warnings
+
+        checker.check_package(package)
+        checker.check_ncx(package)
+        checker.check_links(package)
+        return checker.errors, checker.warnings
+
+def run_epubcheck(epub_path, timeout=300):
+    """
+    Deep check with epubcheck.
+
+    Args:
+        epub_path: Path to EPUB file
+        timeout: Seconds before giving up
+
+    Returns:
+        Tuple of (errors, warnings), or None if epubcheck is not available
+    """
     try:
-        result = subprocess.run(['epubcheck', epub_path],
-                               capture_output=True,
-                               text=True,
-                               timeout=30)
-        
-        if result.returncode == 0:
-            print("✅ EPUB validation passed")
-            return 0
-        else:
-            # Parse errors and warnings
-            output = result.stdout + result.stderr
-            
-            # Count errors and warnings
-            errors = len(re.findall(r'ERROR', output))
-            warnings = len(re.findall(r'WARNING', output))
-            
-            if errors > 0:
-                print(f"❌ EPUB validation failed: {errors} error(s), {warnings} warning(s)", file=sys.stderr)
-                # Print first few errors
-                error_lines = [line for line in output.split('\n') if 'ERROR' in line]
-                for line in error_lines[:5]:
-                    print(f"   {line}", file=sys.stderr)
-                if len(error_lines) > 5:
-                    print(f"   ... and {len(error_lines) - 5} more errors", file=sys.stderr)
-            elif warnings > 0:
-                print(f"⚠️  EPUB validation passed with {warnings} warning(s)")
-            
-            return 1 if errors > 0 else 0
-            
+        result = subprocess.run(['epubcheck', str(epub_path)], capture_output=True, text=True, timeout=timeout)
+    except FileNotFoundError:
+        return None
     except subprocess.TimeoutExpired:
-        print("❌ EPUB validation timed out", file=sys.stderr)
-        return 1
-    except Exception as e:
-        print(f"❌ EPUB validation error: {e}", file=sys.stderr)
+        return [f"epubcheck timed out after {timeout}s"], []
+
+    output = (result.stdout + result.stderr).splitlines()
+    errors = [line.strip() for line in output if re.search(r'\b(ERROR|FATAL)\b', line)]
+    warnings = [line.strip() for line in output if re.search(r'\bWARNING\b', line)]
+    if result.returncode != 0 and not errors:
+        errors = [f"epubcheck exited with status {result.returncode}"]
+    return errors, warnings
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache.get('results', {})
+
+def _save_cache(cache_file, results):
+    """Write the cache atomically, keeping the most recent entries"""
+    recent = sorted(results.items(), key=lambda item: item[1].get('checked_at', ''), reverse=True)
+    cache = {'version': CACHE_VERSION, 'results': dict(recent[:CACHE_ENTRIES])}
+    temp_path = Path(f"{cache_file}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+            f.write('\n')
+        os.replace(temp_path, cache_file)
+    except OSError:
+        temp_path.unlink(missing_ok=True)
+
+def cached_validation(digest, cache_file):
+    """
+    Native check result already cached for an EPUB with this content hash.
+
+    Returns:
+        Dictionary with 'errors' and 'warnings' lists, or None if the
+        file has not been checked (or was checked by older checks)
+    """
+    entry = _load_cache(cache_file).get(digest)
+    if entry is None or entry.get('checks') != CHECKS_VERSION:
+        return None
+    return entry.get('native')
+
+def validate_epub(epub_path, epubcheck=False, use_cache=True, cache_file=None, log=print):
+    """
+    Validate an EPUB, reusing cached results for identical files.
+
+    Args:
+        epub_path: Path to EPUB file
+        epubcheck: Also run epubcheck (if installed)
+        use_cache: Read and update the validation cache
+        cache_file: Cache path (default: .validation-cache.json next to the EPUB)
+        log: Function called with each progress message
+
+    Returns:
+        0 if valid, 1 if invalid
+    """
+    epub_path = Path(epub_path)
+    digest = hash_file(epub_path)
+    if digest is None:
+        log(f"❌ EPUB file not found: {epub_path}")
         return 1
 
+    cache_file = Path(cache_file) if cache_file else epub_path.parent / CACHE_FILENAME
+    results = _load_cache(cache_file) if use_cache else {}
+    entry = results.get(digest)
+    if entry is None or entry.get('checks') != CHECKS_VERSION:
+        entry = {'checks': CHECKS_VERSION}
+    cached = 'native' in entry
+
+    checks = [('native', 'EPUB validation', check_epub)]
+    if epubcheck:
+        checks.append(('epubcheck', 'epubcheck', run_epubcheck))
+
+    status = 0
+    updated = False
+    for key, label, check in checks:
+        if key not in entry:
+            outcome = check(epub_path)
+            if outcome is None:
+                log("⚠️  epubcheck not available. Install for deep EPUB validation.")
+                continue
+            entry[key] = {'errors': outcome[0], 'warnings': outcome[1]}
+            updated = True
+        errors, warnings = entry[key]['errors'], entry[key]['warnings']
+        suffix = " (cached)" if cached and key == 'native' else ""
+
+        if errors:
+            status = 1
+            log(f"❌ {label} failed: {len(errors)} error(s), {len(warnings)} warning(s){suffix}")
+            for message in errors[:MAX_REPORTED]:
+                log(f"   {message}")
+            if len(errors) > MAX_REPORTED:
+                log(f"   ... and {len(errors) - MAX_REPORTED} more errors")
+        elif warnings:
+            log(f"⚠️  {label} passed with {len(warnings)} warning(s){suffix}")
+            for message in warnings[:MAX_REPORTED]:
+                log(f"   {message}")
+            if len(warnings) > MAX_REPORTED:
+                log(f"   ... and {len(warnings) - MAX_REPORTED} more warnings")
+        else:
+            log(f"✅ {label} passed{suffix}")
+
+    if use_cache and updated:
+        entry['checked_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        results[digest] = entry
+        _save_cache(cache_file, results)
+
+    return status
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Validate EPUB files.")
+    parser.add_argument('epubs', nargs='+', help="EPUB files to validate")
+    parser.add_argument('--epubcheck', action='store_true',
+                        help="Also run epubcheck as a deep check (if installed)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Validate even if this exact file was validated before")
+    parser.add_argument('--cache-file', default=None,
+                        help=f"Validation cache (default: {CACHE_FILENAME} next to each EPUB)")
+    args = parser.parse_args()
+
+    status = 0
+    for epub_path in args.epubs:
+        if len(args.epubs) > 1:
+            print(f"📖 {epub_path}")
+        status |= validate_epub(epub_path, epubcheck=args.epubcheck, use_cache=not args.no_cache,
+                                cache_file=args.cache_file)
+    return status
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: validate_epub.py <epub_file.epub>", file=sys.stderr)
-        sys.exit(1)
-    
-    epub_path = sys.argv[1]
-    sys.exit(validate_epub(epub_path))
+    sys.exit(main())
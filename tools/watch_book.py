@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Rebuild outputs as the book is edited.
+Polls book_content/, styles/, config.yaml and any other build input,
+waits for a burst of saves to settle, then rebuilds only the formats the
+changed files feed: a print_styles.css edit rebuilds the PDF, a chapter
+edit rebuilds every format. The parsed config, the chapter list and a
+pool of warm render workers stay in memory between rebuilds.
+
+With --preview the HTML preview (preview.py) is refreshed on every
+change instead; pass --formats as well to keep outputs up to date too.
+
+Usage: watch_book.py [--formats epub,pdf,word] [--preview [epub|print]] [--jobs N]
+                     [--per-chapter] [--epubcheck] [--force] [--interval S] [--debounce S]
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from book_config import PROJECT_ROOT, FORMATS, FORMAT_LABELS, load_config
+from build_book import build_formats, parse_formats, plan_formats
+from build_cache import config_digest, format_input_files
+from build_trace import Tracer
+from detect_chapters import detect_chapters
+from manuscript import load_manuscript
+from preview import build_preview
+
+# Directories watched recursively (relative to the project root)
+WATCH_DIRS = ('book_content', 'styles')
+
+# Editor swap and backup files
+IGNORED_SUFFIXES = ('~', '.swp', '.swx', '.tmp')
+
+CHAPTERS_DIR = os.path.join('book_content', 'chapters')
+
+def _ignore_interrupt():
+    """Leave Ctrl+C to the watcher; workers are shut down with the pool"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _ignored(name):
+    return name.startswith('.') or name.endswith(IGNORED_SUFFIXES)
+
+def snapshot(project_root, extra_files=()):
+    """
+    Record the mtime and size of every watched file.
+
+    Args:
+        project_root: Project root directory
+        extra_files: Other files to watch (relative to project_root)
+
+    Returns:
+        Dictionary mapping relative path to (mtime_ns, size)
+    """
+    files = {}
+
+    def scan(directory):
+        try:
+            entries = list(os.scandir(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entry in entries:
+            if _ignored(entry.name):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    scan(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[os.path.relpath(entry.path, project_root)] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                continue  # Deleted mid-scan
+
+    for directory in WATCH_DIRS:
+        scan(os.path.join(project_root, directory))
+    for path in extra_files:
+        try:
+            stat = os.stat(os.path.join(project_root, path))
+        except FileNotFoundError:
+            continue
+        files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def changed_paths(before, after):
+    """Paths added, removed or modified between two snapshots"""
+    return {path for path in before.keys() | after.keys() if before.get(path) != after.get(path)}
+
+class BookWatcher:
+    """
+    Keeps a project's config, chapter list, input map and render workers
+    warm between rebuilds.
+    """
+
+    def __init__(self, project_root, config_file, formats, options, jobs=None, preview=None):
+        """
+        Args:
+            project_root: Project root directory
+            config_file: Path to config.yaml
+            formats: Formats to keep up to date
+            options: Build options ('per_chapter', 'epubcheck')
+            jobs: Number of worker processes (default: one per format)
+            preview: HTML preview style to keep up to date ('epub' or 'print', optional)
+
+        Raises:
+            Exception: If the config cannot be loaded
+        """
+        self.project_root = Path(project_root)
+        self.config_file = Path(config_file)
+        self.config_path = os.path.relpath(self.config_file, self.project_root)
+        self.formats = formats
+        self.options = dict(options, config_file=str(self.config_file))
+        self.config = load_config(self.config_file)
+        self.chapters = detect_chapters(str(self.project_root / CHAPTERS_DIR))
+        self._index_inputs()
+        self.jobs = jobs or max(len(formats), 1)
+        self.executor = None
+        self.preview = preview
+        self.preview_memo = {}
+
+    def close(self):
+        """Shut down the render workers"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _index_inputs(self):
+        """Map every input file to the formats it feeds"""
+        self.inputs = {}
+        for fmt in self.formats:
+            for path in format_input_files(self.project_root, self.config, fmt):
+                self.inputs.setdefault(os.path.normpath(path), set()).add(fmt)
+
+    def extra_files(self):
+        """Inputs outside the watched directories, and the config file"""
+        extra = [path for path in self.inputs if path.split(os.sep)[0] not in WATCH_DIRS]
+        return extra + [self.config_path]
+
+    def affected_formats(self, paths):
+        """
+        Work out which formats a set of changed files feeds.
+
+        Reloads the config and re-detects chapters as needed.
+
+        Args:
+            paths: Changed paths relative to the project root
+
+        Returns:
+            Formats to rebuild, in FORMATS order
+        """
+        formats = set()
+        for path in paths:
+            if path == self.config_path:
+                try:
+                    config = load_config(self.config_file)
+                except Exception as e:
+                    print(f"⚠️  Could not reload config (keeping the previous one): {e}")
+                    continue
+                formats |= {fmt for fmt in self.formats
+                            if config_digest(config, fmt) != config_digest(self.config, fmt)}
+                self.config = config
+            elif os.path.dirname(path) == CHAPTERS_DIR:
+                # Chapters added, removed or renamed change every format
+                chapters = detect_chapters(str(self.project_root / CHAPTERS_DIR))
+                if chapters != self.chapters:
+                    self.chapters = chapters
+                    formats |= set(self.formats)
+            formats |= self.inputs.get(path, set())
+
+        # Edited chapters may reference different images
+        self._index_inputs()
+        return [fmt for fmt in FORMATS if fmt in formats]
+
+    def rebuild(self, formats, force=False):
+        """
+        Rebuild formats whose inputs changed since their last build.
+        Workers are started on first use and kept for later rebuilds.
+
+        Returns:
+            Dictionary mapping format to success flag
+        """
+        fresh, inputs = plan_formats(self.project_root, self.config, formats, force,
+                                     self.options.get('per_chapter', False))
+        results = {fmt: True for fmt in fresh}
+        for fmt in fresh:
+            print(f"✅ {FORMAT_LABELS[fmt]} is up to date")
+        if not inputs:
+            return results
+
+        try:
+            manuscript = load_manuscript(self.project_root, self.config, self.chapters)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            results.update({fmt: False for fmt in inputs})
+            return results
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_ignore_interrupt)
+        try:
+            results.update(build_formats(self.executor, self.project_root, self.config, manuscript,
+                                         inputs, self.options, Tracer()))
+        except BrokenProcessPool as e:
+            # A worker died; start fresh ones for the next rebuild
+            print(f"❌ Render worker crashed: {e}")
+            self.executor = None
+            results.update({fmt: False for fmt in inputs})
+        return results
+
+    def refresh_preview(self):
+        """
+        Re-render the HTML preview; unchanged chapters come from memory.
+
+        Returns:
+            Path to the preview index page, or None if rendering failed
+        """
+        try:
+            manuscript = load_manuscript(self.project_root, self.config, self.chapters)
+            return build_preview(self.project_root, self.config, manuscript, self.preview, self.preview_memo)
+        except (FileNotFoundError, RuntimeError) as e:
+            print(f"❌ Preview: {e}")
+            return None
+
+    def watch(self, interval=0.5, debounce=0.3):
+        """Poll for changes and rebuild until interrupted"""
+        state = snapshot(self.project_root, self.extra_files())
+        print("👀 Watching for changes (Ctrl+C to stop)...")
+        while True:
+            time.sleep(interval)
+            current = snapshot(self.project_root, self.extra_files())
+            changed = changed_paths(state, current)
+            if not changed:
+                continue
+
+            # Wait for a burst of saves to settle before rebuilding
+            quiet_since = time.monotonic()
+            while time.monotonic() - quiet_since < debounce:
+                time.sleep(min(interval, debounce))
+                latest = snapshot(self.project_root, self.extra_files())
+                more = changed_paths(current, latest)
+                if more:
+                    changed |= more
+                    current = latest
+                    quiet_since = time.monotonic()
+            # Edits made during the rebuild show up in the next scan
+            state = current
+
+            formats = self.affected_formats(changed)
+            names = sorted(changed)
+            shown = ', '.join(names[:3]) + (f" and {len(names) - 3} more" if len(names) > 3 else '')
+            print()
+            # The preview reads the content, the stylesheets and the config
+            preview = self.preview and any(path == self.config_path or path.split(os.sep)[0] in WATCH_DIRS
+                                           for path in changed)
+            targets = [FORMAT_LABELS[fmt] for fmt in formats] + (["HTML preview"] if preview else [])
+            if not targets:
+                print(f"🔄 Changed: {shown} (no output depends on it)")
+                continue
+            print(f"🔄 Changed: {shown} → {', '.join(targets)}")
+
+            if preview:
+                self.refresh_preview()
+            if not formats:
+                print("👀 Watching for changes (Ctrl+C to stop)...")
+                continue
+            start = time.monotonic()
+            results = self.rebuild(formats)
+            status = "✅ Rebuilt" if all(results.values()) else "⚠️  Rebuilt with failures:"
+            print(f"{status} {', '.join(FORMAT_LABELS[fmt] for fmt in FORMATS if fmt in results)} "
+                  f"in {time.monotonic() - start:.1f}s")
+            print("👀 Watching for changes (Ctrl+C to stop)...")
+
+def main():
+    """CLI interface"""
+    parser = argparse.ArgumentParser(description="Rebuild outputs as the book is edited.")
+    parser.add_argument('--formats', type=parse_formats, default=None,
+                        help="Comma-separated formats to keep up to date "
+                             "(default: epub,pdf,word, or none with --preview)")
+    parser.add_argument('--preview', nargs='?', const='epub', choices=['epub', 'print'], default=None,
+                        help="Keep the HTML preview up to date, styled for epub (default) or print")
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help="Number of worker processes (default: one per format)")
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('--per-chapter', action='store_true',
+                        help="Build the EPUB and PDF one chapter at a time (cached, parallel)")
+    parser.add_argument('--epubcheck', action='store_true',
+                        help="Also validate the EPUB with epubcheck (slow; needs Java)")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild every format once at startup, even if up to date")
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help="Seconds between scans for changes (default: 0.5)")
+    parser.add_argument('--debounce', type=float, default=0.3,
+                        help="Seconds without changes before rebuilding (default: 0.3)")
+    args = parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.interval <= 0 or args.debounce < 0:
+        parser.error("--interval must be positive and --debounce not negative")
+    if args.formats is None:
+        args.formats = [] if args.preview else list(FORMATS)
+
+    config_file = Path(args.config) if args.config else PROJECT_ROOT / "config.yaml"
+    if not config_file.exists():
+        print(f"❌ Config file not found: {config_file}", file=sys.stderr)
+        return 1
+
+    try:
+        watcher = BookWatcher(PROJECT_ROOT, config_file, args.formats,
+                              {'per_chapter': args.per_chapter, 'epubcheck': args.epubcheck}, args.jobs,
+                              args.preview)
+    except Exception as e:
+        print(f"❌ Could not load config: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        if args.preview:
+            index_file = watcher.refresh_preview()
+            if index_file:
+                print(f"👁️  Preview: {index_file}")
+        watcher.rebuild(args.formats, args.force)
+        watcher.watch(args.interval, args.debounce)
+    except KeyboardInterrupt:
+        print()
+        print("👋 Stopped watching")
+    finally:
+        watcher.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
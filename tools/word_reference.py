@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Compile the Word formatting rules into a pandoc reference.docx.
+
+The page setup and paragraph styles that format_word.py applies are
+written once into a reference document, cached under
+<output_dir>/.word-reference-cache/ by a hash of the rules and the base
+template. Passing it to pandoc with --reference-doc makes pandoc's DOCX
+final, so the python-docx post-processing pass is not needed.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import importlib.util
+import argparse
+import subprocess
+from pathlib import Path
+
+from book_config import PROJECT_ROOT, load_config, output_dir
+from file_hash import hash_file
+
+CACHE_DIRNAME = ".word-reference-cache"
+CACHE_VERSION = 1
+
+def _base_template(project_root, config):
+    """Configured Word template, or None if it does not exist"""
+    template = Path(project_root) / config['styles'].get('word_template', 'styles/word_template.docx')
+    return template if template.is_file() else None
+
+def _pandoc_reference():
+    """pandoc's default reference.docx bytes, or None if pandoc is unavailable"""
+    try:
+        result = subprocess.run(['pandoc', '--print-default-data-file', 'reference.docx'],
+                                capture_output=True, check=True)
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return None
+    return result.stdout or None
+
+def _pandoc_version():
+    try:
+        result = subprocess.run(['pandoc', '--version'], capture_output=True, text=True, check=True)
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return ''
+    return result.stdout.splitlines()[0] if result.stdout else ''
+
+def rules_key(rules, base_template=None):
+    """
+    Cache key for a compiled reference document.
+
+    Args:
+        rules: Rules from format_word.load_rules()
+        base_template: Path to the template the rules are applied to, or None
+
+    Returns:
+        SHA-256 hex digest
+    """
+    h = hashlib.sha256()
+    base = hash_file(base_template) if base_template else _pandoc_version()
+    for part in (str(CACHE_VERSION), base or '', json.dumps(rules, sort_keys=True)):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def compile_reference_doc(rules, output_path, base_template=None):
+    """
+    Write a reference.docx carrying the page setup and styles.
+
+    Args:
+        rules: Rules from format_word.load_rules()
+        output_path: Where to write the document
+        base_template: Template to start from (default: pandoc's reference.docx)
+    """
+    # format_word needs python-docx, which only this path requires
+    from format_word import Document, apply_page_setup, apply_style_rules
+
+    output_path = Path(output_path)
+    temp_path = output_path.with_name(output_path.name + f".{os.getpid()}.tmp")
+
+    if base_template is None:
+        data = _pandoc_reference()
+        if data is not None:
+            temp_path.write_bytes(data)
+            base_template = temp_path
+
+    doc = Document(str(base_template)) if base_template else Document()
+    apply_page_setup(doc, rules['page'])
+    apply_style_rules(doc, rules['styles'], rules.get('blockquote_style'))
+
+    # Write via a temp name so concurrent builds never read a partial file
+    doc.save(str(temp_path))
+    os.replace(temp_path, output_path)
+
+def reference_doc(project_root, config, log=print):
+    """
+    Get the compiled reference.docx for a project, building it if needed.
+
+    Args:
+        project_root: Project root directory
+        config: Config dictionary
+        log: Function called with progress messages
+
+    Returns:
+        Path to the reference document, or None if python-docx is not installed
+    """
+    if importlib.util.find_spec('docx') is None:
+        return None
+    from format_word import load_rules
+
+    rules = load_rules(config)
+    base_template = _base_template(project_root, config)
+
+    cache_dir = output_dir(project_root, config) / CACHE_DIRNAME
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cached = cache_dir / f"{rules_key(rules, base_template)}.docx"
+
+    if not cached.exists():
+        log("   → Compiling Word reference document...")
+        compile_reference_doc(rules, cached, base_template)
+        # Older compilations are never reused once the rules change
+        for entry in cache_dir.glob('*.docx'):
+            if entry != cached:
+                entry.unlink()
+
+    return cached
+
+def main():
+    """
+    CLI interface: print the path of the compiled reference.docx.
+    Exits 1 if it cannot be built (e.g. python-docx is not installed).
+    """
+    parser = argparse.ArgumentParser(description="Compile Word formatting rules into a reference.docx.")
+    parser.add_argument('--config', default=None,
+                        help="Path to config.yaml (default: <project root>/config.yaml)")
+    parser.add_argument('project_root', nargs='?', default=str(PROJECT_ROOT))
+    args = parser.parse_args()
+
+    project_root = Path(args.project_root)
+    config_file = Path(args.config) if args.config else project_root / "config.yaml"
+    config = load_config(config_file)
+
+    try:
+        path = reference_doc(project_root, config, log=lambda message: print(message, file=sys.stderr))
+    except Exception as e:
+        print(f"❌ Error compiling Word reference document: {e}", file=sys.stderr)
+        return 1
+
+    if path is None:
+        return 1
+    print(path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Streaming post-processor for very long Word documents.
+
+format_word.py normally loads the whole DOCX into python-docx and saves
+it again, holding every paragraph and run in memory. This mode reads
+word/document.xml from the zip with an incremental (SAX) parser and
+writes it straight into the new zip, holding at most one paragraph at a
+time, so memory stays flat however long the book is. The same rules are
+applied: style definitions go into word/styles.xml (a small part, edited
+with python-docx), every section gets the page setup, and body
+paragraphs after a heading get the first-paragraph style or lose their
+first-line indent. Every other part is copied without recompressing it.
+"""
+
+import io
+import os
+import zipfile
+import xml.sax
+from xml.sax.saxutils import XMLGenerator
+from pathlib import Path
+
+from epub_archive import copy_entry
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+DOCUMENT_PART = 'word/document.xml'
+STYLES_PART = 'word/styles.xml'
+
+# Child order the schema requires, for inserting missing elements
+PPR_ORDER = (
+    'pStyle', 'keepNext', 'keepLines', 'pageBreakBefore', 'framePr', 'widowControl', 'numPr',
+    'suppressLineNumbers', 'pBdr', 'shd', 'tabs', 'suppressAutoHyphens', 'kinsoku', 'wordWrap',
+    'overflowPunct', 'topLinePunct', 'autoSpaceDE', 'autoSpaceDN', 'bidi', 'adjustRightInd',
+    'snapToGrid', 'spacing', 'ind', 'contextualSpacing', 'mirrorIndents', 'suppressOverlap', 'jc',
+    'textDirection', 'textAlignment', 'textboxTightWrap', 'outlineLvl', 'divId', 'cnfStyle',
+    'rPr', 'sectPr', 'pPrChange',
+)
+SECTPR_ORDER = (
+    'headerReference', 'footerReference', 'footnotePr', 'endnotePr', 'type', 'pgSz', 'pgMar',
+    'paperSrc', 'pgBorders', 'lnNumType', 'pgNumType', 'cols', 'formProt', 'vAlign',
+    'noEndnote', 'titlePg', 'textDirection', 'bidi', 'rtlGutter', 'docGrid', 'printerSettings',
+    'sectPrChange',
+)
+
+def document_size(doc_path):
+    """Uncompressed size of a DOCX's word/document.xml in bytes"""
+    with zipfile.ZipFile(doc_path) as zipf:
+        return zipf.getinfo(DOCUMENT_PART).file_size
+
+def _twips(inches):
+    # Same rounding as python-docx (inches -> EMU -> twips)
+    return str(round(int(inches * 914400) / 635))
+
+def _local(name):
+    return name.rpartition(':')[2]
+
+def style_table(styles_xml, rules):
+    """
+    Apply the style rules to a styles.xml part.
+
+    Args:
+        styles_xml: The part's bytes
+        rules: Rules from format_word.load_rules()
+
+    Returns:
+        Tuple of (new part bytes, {paragraph style id: name}, (default
+        paragraph style id, name), first-paragraph style id or None)
+    """
+    # python-docx is only needed for this small part
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.opc.oxml import serialize_part_xml
+    from docx.oxml import parse_xml
+    from docx.styles.styles import Styles
+    from format_word import write_style_rules
+
+    element = parse_xml(styles_xml)
+    styles = Styles(element)
+    write_style_rules(styles, rules['styles'], rules.get('blockquote_style'))
+
+    names = {style.style_id: style.name for style in styles if style.type == WD_STYLE_TYPE.PARAGRAPH}
+    default = styles.default(WD_STYLE_TYPE.PARAGRAPH)
+    default = (default.style_id, default.name) if default is not None else (None, 'Normal')
+    first_style = rules['first_paragraph_style']
+    first_id = None
+    if first_style in rules['styles']:
+        first_id = next((style_id for style_id, name in names.items() if name == first_style), None)
+    return serialize_part_xml(element), names, default, first_id
+
+class DocumentFilter(xml.sax.handler.ContentHandler):
+    """
+    Copy document.xml SAX events to an XML writer, applying the rules.
+
+    Events pass straight through except for a section's properties and a
+    paragraph right after a heading, which are held as a small tree until
+    they end so they can be edited.
+    """
+
+    def __init__(self, out, rules, style_names, default_style, first_style_id):
+        # default_style is the (id, name) pair of the default paragraph style
+        super().__init__()
+        self.out = XMLGenerator(out, encoding='utf-8', short_empty_elements=True)
+        self.page = rules['page']
+        self.first_style = rules['first_paragraph_style']
+        self.body_styles = set(rules['body_styles'])
+        self.style_names = style_names
+        self.default_id, self.default_style = default_style
+        self.first_style_id = first_style_id
+        self.prefix = 'w:'
+        self.path = []
+        self.stack = []
+        self.style_id = None
+        self.after_heading = False
+        self.direct = 0
+
+    def w(self, name):
+        return self.prefix + name
+
+    def style_name(self, style_id):
+        return self.style_names.get(style_id, self.default_style) if style_id else self.default_style
+
+    def startDocument(self):
+        self.out.startDocument()
+
+    def endDocument(self):
+        self.out.endDocument()
+
+    def startElement(self, name, attrs):
+        if not self.path:
+            # Word and pandoc bind the main namespace to w:, but only the URI is fixed
+            for key, value in attrs.items():
+                if key.startswith('xmlns:') and value == W_NS:
+                    self.prefix = key[len('xmlns:'):] + ':'
+        parent = self.path[-1] if self.path else None
+        self.path.append(name)
+
+        if self.stack:
+            node = [name, dict(attrs), []]
+            self.stack[-1][2].append(node)
+            self.stack.append(node)
+            return
+
+        if name == self.w('p') and parent == self.w('body'):
+            self.style_id = None
+            if self.after_heading:
+                self.stack.append([name, dict(attrs), []])
+                return
+        elif name == self.w('sectPr') and (parent == self.w('body') or
+                                           self.path[-4:-1] == [self.w('body'), self.w('p'), self.w('pPr')]):
+            # The sections python-docx sees: the body's last one and those ending a paragraph
+            self.stack.append([name, dict(attrs), []])
+            return
+        elif (name == self.w('pStyle') and self.path[-2:-5:-1] == [self.w('pPr'), self.w('p'), self.w('body')]):
+            self.style_id = attrs.get(self.w('val'))
+        self.out.startElement(name, attrs)
+
+    def endElement(self, name):
+        self.path.pop()
+        if self.stack:
+            node = self.stack.pop()
+            if not self.stack:
+                if name == self.w('sectPr'):
+                    self.page_setup(node)
+                else:
+                    self.first_paragraph(node)
+                self.emit(node)
+            return
+
+        if name == self.w('p') and self.path and self.path[-1] == self.w('body'):
+            if self.style_name(self.style_id).startswith('Heading'):
+                self.after_heading = True
+        self.out.endElement(name)
+
+    def characters(self, content):
+        if self.stack:
+            children = self.stack[-1][2]
+            if children and isinstance(children[-1], str):
+                children[-1] += content
+            else:
+                children.append(content)
+        else:
+            self.out.characters(content)
+
+    ignorableWhitespace = characters
+
+    def processingInstruction(self, target, data):
+        self.out.processingInstruction(target, data)
+
+    def emit(self, node):
+        name, attrs, children = node
+        self.out.startElement(name, attrs)
+        for child in children:
+            if isinstance(child, str):
+                self.out.characters(child)
+            else:
+                self.emit(child)
+        self.out.endElement(name)
+
+    def child(self, node, local, order=None):
+        """A node's child element, inserted in schema order if missing (when order is given)"""
+        name = self.w(local)
+        for child in node[2]:
+            if not isinstance(child, str) and child[0] == name:
+                return child
+        if order is None:
+            return None
+        new = [name, {}, []]
+        later = set(order[order.index(local) + 1:])
+        for index, child in enumerate(node[2]):
+            if not isinstance(child, str) and _local(child[0]) in later:
+                node[2].insert(index, new)
+                return new
+        node[2].append(new)
+        return new
+
+    def paragraph_properties(self, paragraph):
+        """A paragraph's pPr, added as its first child if missing"""
+        p_pr = self.child(paragraph, 'pPr')
+        if p_pr is None:
+            p_pr = [self.w('pPr'), {}, []]
+            paragraph[2].insert(0, p_pr)
+        return p_pr
+
+    def page_setup(self, sect_pr):
+        """Page size and margins for one section, as format_word.apply_page_setup() sets them"""
+        page = self.page
+        size = self.child(sect_pr, 'pgSz', SECTPR_ORDER)[1]
+        size[self.w('w')] = _twips(page['width'])
+        size[self.w('h')] = _twips(page['height'])
+        margins = self.child(sect_pr, 'pgMar', SECTPR_ORDER)[1]
+        margins[self.w('top')] = _twips(page['top_margin'])
+        margins[self.w('bottom')] = _twips(page['bottom_margin'])
+        margins[self.w('left')] = _twips(page['inside_margin'])
+        margins[self.w('right')] = _twips(page['outside_margin'])
+        if page.get('mirror_margins'):
+            self.child(sect_pr, 'titlePg', SECTPR_ORDER)[1].pop(self.w('val'), None)
+
+    def _text(self, paragraph):
+        """Text of the paragraph's runs (direct or in hyperlinks), like python-docx's Paragraph.text"""
+        parts = []
+        for child in paragraph[2]:
+            if isinstance(child, str):
+                continue
+            runs = [child] if child[0] == self.w('r') else []
+            if child[0] == self.w('hyperlink'):
+                runs = [run for run in child[2] if not isinstance(run, str) and run[0] == self.w('r')]
+            for run in runs:
+                for item in run[2]:
+                    if not isinstance(item, str) and item[0] == self.w('t'):
+                        parts.extend(text for text in item[2] if isinstance(text, str))
+        return ''.join(parts)
+
+    def first_paragraph(self, paragraph):
+        """Rules for a body paragraph that follows a heading (see format_word.format_paragraphs())"""
+        p_pr = self.child(paragraph, 'pPr')
+        if p_pr is not None:
+            sect_pr = self.child(p_pr, 'sectPr')
+            if sect_pr is not None:
+                self.page_setup(sect_pr)
+
+        style_id = None
+        if p_pr is not None and self.child(p_pr, 'pStyle') is not None:
+            style_id = self.child(p_pr, 'pStyle')[1].get(self.w('val'))
+        style_name = self.style_name(style_id)
+
+        if style_name.startswith('Heading') or not self._text(paragraph).strip():
+            return
+
+        if self.first_style_id is not None and style_name in self.body_styles:
+            if self.first_style_id == self.default_id:
+                # The default style is written as no pStyle at all
+                if p_pr is not None:
+                    p_pr[2] = [child for child in p_pr[2] if isinstance(child, str) or child[0] != self.w('pStyle')]
+            else:
+                p_pr = self.paragraph_properties(paragraph)
+                self.child(p_pr, 'pStyle', PPR_ORDER)[1][self.w('val')] = self.first_style_id
+        elif style_name != self.first_style:
+            indent = self.child(self.paragraph_properties(paragraph), 'ind', PPR_ORDER)[1]
+            indent[self.w('firstLine')] = '0'
+            indent.pop(self.w('hanging'), None)
+            self.direct += 1
+        self.after_heading = False
+
+def stream_format(doc_path, rules):
+    """
+    Format a DOCX in place, streaming word/document.xml.
+
+    Args:
+        doc_path: Path to Word document
+        rules: Rules from format_word.load_rules()
+
+    Returns:
+        Number of paragraphs that needed direct formatting
+    """
+    doc_path = Path(doc_path)
+    temp_path = doc_path.with_name(doc_path.name + f".{os.getpid()}.tmp")
+    try:
+        with zipfile.ZipFile(doc_path) as src, open(doc_path, 'rb') as raw_file, \
+                zipfile.ZipFile(temp_path, 'w') as zipf:
+            styles_xml, names, default_style, first_id = style_table(src.read(STYLES_PART), rules)
+            direct = 0
+            for info in src.infolist():
+                if info.filename == DOCUMENT_PART:
+                    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    out_info.compress_type = zipfile.ZIP_DEFLATED
+                    # Size hint, so a huge document gets zip64 headers up front
+                    out_info.file_size = info.file_size
+                    with src.open(info) as source, zipf.open(out_info, 'w') as target:
+                        text = io.TextIOWrapper(target, encoding='utf-8', newline='\n', write_through=True)
+                        handler = DocumentFilter(text, rules, names, default_style, first_id)
+                        xml.sax.parse(source, handler)
+                        text.flush()
+                        text.detach()
+                    direct = handler.direct
+                elif info.filename == STYLES_PART:
+                    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    zipf.writestr(out_info, styles_xml, compress_type=zipfile.ZIP_DEFLATED)
+                else:
+                    copy_entry(zipf, src, raw_file, info, info.date_time)
+        os.replace(temp_path, doc_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return direct